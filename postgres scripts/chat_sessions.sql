@@ -8,6 +8,10 @@ CREATE TABLE IF NOT EXISTS public.chat_sessions
     id serial NOT NULL,
     user_id integer NOT NULL,
     created_at timestamp without time zone,
+    document_ids json NOT NULL DEFAULT '[]'::json,
+    summary text COLLATE pg_catalog."default",
+    summary_message_id integer,
+    expired_at timestamp without time zone,
     CONSTRAINT chat_sessions_pkey PRIMARY KEY (id)
 );
 
@@ -59,7 +63,8 @@ CREATE TABLE IF NOT EXISTS public.temporary_storage
     key text COLLATE pg_catalog."default" NOT NULL,
     value text COLLATE pg_catalog."default" NOT NULL,
     created_at timestamp without time zone DEFAULT now(),
-    CONSTRAINT temporary_storage_pkey PRIMARY KEY (id)
+    CONSTRAINT temporary_storage_pkey PRIMARY KEY (id),
+    CONSTRAINT temporary_storage_session_id_key_key UNIQUE (session_id, key)
 );
 
 ALTER TABLE IF EXISTS public.chat_sessions
@@ -0,0 +1,8 @@
+-- Adds the document_ids column to an existing chat_sessions table.
+BEGIN;
+
+
+ALTER TABLE IF EXISTS public.chat_sessions
+    ADD COLUMN IF NOT EXISTS document_ids json NOT NULL DEFAULT '[]'::json;
+
+END;
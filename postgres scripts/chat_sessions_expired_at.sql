@@ -0,0 +1,8 @@
+-- Adds the retention marker to an existing chat_sessions table.
+BEGIN;
+
+
+ALTER TABLE IF EXISTS public.chat_sessions
+    ADD COLUMN IF NOT EXISTS expired_at timestamp without time zone;
+
+END;
@@ -0,0 +1,9 @@
+-- Adds the history summary columns to an existing chat_sessions table.
+BEGIN;
+
+
+ALTER TABLE IF EXISTS public.chat_sessions
+    ADD COLUMN IF NOT EXISTS summary text COLLATE pg_catalog."default",
+    ADD COLUMN IF NOT EXISTS summary_message_id integer;
+
+END;
@@ -0,0 +1,31 @@
+BEGIN;
+
+
+CREATE TABLE IF NOT EXISTS public.context_updates
+(
+    id serial NOT NULL,
+    user_id integer NOT NULL,
+    session_id integer NOT NULL,
+    message text COLLATE pg_catalog."default" NOT NULL,
+    attempts integer NOT NULL DEFAULT 0,
+    created_at timestamp without time zone DEFAULT now(),
+    CONSTRAINT context_updates_pkey PRIMARY KEY (id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_context_updates_user_id
+    ON public.context_updates USING btree (user_id);
+
+ALTER TABLE IF EXISTS public.context_updates
+    ADD CONSTRAINT context_updates_user_id_fkey FOREIGN KEY (user_id)
+    REFERENCES public.users (id) MATCH SIMPLE
+    ON UPDATE NO ACTION
+    ON DELETE CASCADE;
+
+
+ALTER TABLE IF EXISTS public.context_updates
+    ADD CONSTRAINT context_updates_session_id_fkey FOREIGN KEY (session_id)
+    REFERENCES public.chat_sessions (id) MATCH SIMPLE
+    ON UPDATE NO ACTION
+    ON DELETE CASCADE;
+
+END;
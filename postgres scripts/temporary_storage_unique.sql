@@ -0,0 +1,15 @@
+-- Adds the (session_id, key) unique constraint to an existing temporary_storage table,
+-- keeping the latest row of duplicated keys.
+BEGIN;
+
+
+DELETE FROM public.temporary_storage AS t
+    USING public.temporary_storage AS newer
+    WHERE t.session_id = newer.session_id
+    AND t.key = newer.key
+    AND t.id < newer.id;
+
+ALTER TABLE IF EXISTS public.temporary_storage
+    ADD CONSTRAINT temporary_storage_session_id_key_key UNIQUE (session_id, key);
+
+END;
@@ -14,8 +14,9 @@ from app.api.routers.llm.vercel_response import VercelStreamResponse
 from app.engine.engine import get_chat_engine
 from app.engine.query_filter import generate_filters
 from fastapi import HTTPException, BackgroundTasks, Request, Depends, APIRouter
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.db.database import get_db, ChatSession, Message as DBMessage
+from app.db.database import get_async_db, get_db, ChatSession, Message as DBMessage
 from app.engine.engine import get_chat_engine
 from app.engine.query_filter import generate_filters
 from app.api.routers.llm.models import ChatData
@@ -48,14 +49,11 @@ async def chat(
 
         doc_ids = data.get_chat_document_ids()
         filters = generate_filters(doc_ids)
-        params = data.data or {}
         logger.info(
             f"Creating chat engine with filters: {str(filters)}",
         )
         event_handler = EventCallbackHandler()
-        chat_engine = get_chat_engine(
-            filters=filters, params=params, event_handlers=[event_handler]
-        )
+        chat_engine = get_chat_engine(filters=filters, event_handlers=[event_handler])
         response = chat_engine.astream_chat(last_message_content, messages)
 
         return VercelStreamResponse(
@@ -79,12 +77,11 @@ async def chat_request(
 
     doc_ids = data.get_chat_document_ids()
     filters = generate_filters(doc_ids)
-    params = data.data or {}
     logger.info(
         f"Creating chat engine with filters: {str(filters)}",
     )
 
-    chat_engine = get_chat_engine(filters=filters, params=params)
+    chat_engine = get_chat_engine(filters=filters)
 
     response = await chat_engine.achat(last_message_content, messages)
     return Result(
@@ -94,7 +91,12 @@ async def chat_request(
 
 
 
-chat_router.post("/new_session")(lambda user=Depends(AuthService.get_current_user), db=Depends(get_db): ChatService.create_chat_session(user, db))
+@chat_router.post("/new_session")
+async def new_session(
+    user: User = Depends(AuthService.aget_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await ChatService.acreate_chat_session(user, db)
 # chat_router.post("/chat")(lambda request, data, background_tasks, user=Depends(AuthService.get_current_user), db=Depends(get_db): ChatService.chat(request, data, background_tasks, user, db))
 
 @chat_router.post("/chat")
@@ -102,22 +104,22 @@ async def chat_endpoint(
     request: Request,
     data: ChatData,  # ✅ Now FastAPI expects JSON body, not query params
     background_tasks: BackgroundTasks,
-    user: User = Depends(AuthService.get_current_user),
-    db: Session = Depends(get_db)
+    user: User = Depends(AuthService.aget_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
 
     return await ChatService.chat(request, data, background_tasks, user, db)
 
 
 @chat_router.get("/sessions")
-def get_sessions(user: User = Depends(AuthService.get_current_user), db: Session = Depends(get_db)):
-    return ChatService.get_user_sessions(user, db)
+async def get_sessions(user: User = Depends(AuthService.aget_current_user), db: AsyncSession = Depends(get_async_db)):
+    return await ChatService.aget_user_sessions(user, db)
 
 
 @chat_router.get("/messages/{session_id}")
-def get_messages(
+async def get_messages(
     session_id: int,
-    user: User = Depends(AuthService.get_current_user),
-    db: Session = Depends(get_db)
+    user: User = Depends(AuthService.aget_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    return ChatService.get_chat_messages(user, session_id, db)
\ No newline at end of file
+    return await ChatService.aget_chat_messages(user, session_id, db)
\ No newline at end of file
@@ -110,6 +110,8 @@ class ChatData(BaseModel):
     session_id: int  # ✅ Explicitly add this field
     messages: List[Message]  # Assuming Message is defined elsewhere
     data: Any = None
+    # The server keeps the history of the session, messages only holds the new message
+    server_history: bool = False
 
     class Config:
         json_schema_extra = {
@@ -130,6 +132,12 @@ class ChatData(BaseModel):
             raise ValueError("Messages must not be empty")
         return v
 
+    @validator("server_history")
+    def server_history_must_only_send_new_message(cls, v, values):
+        if v and len(values.get("messages", [])) > 1:
+            raise ValueError("Only the new message must be sent when the server keeps the history")
+        return v
+
     def get_last_message_content(self) -> str:
         """
         Get the content of the last message along with the data content from all user messages
@@ -1,7 +1,7 @@
 import logging
 
 from fastapi import APIRouter
-from app.engine.index import IndexConfig, get_index
+from app.engine.engine import ChatEngineFactory
 from llama_index.core.base.base_query_engine import BaseQueryEngine
 
 
@@ -11,8 +11,7 @@ logger = logging.getLogger("uvicorn")
 
 
 def get_query_engine() -> BaseQueryEngine:
-    index_config = IndexConfig(**{})
-    index = get_index(index_config)
+    index = ChatEngineFactory.get_index()
     return index.as_query_engine()
 
 
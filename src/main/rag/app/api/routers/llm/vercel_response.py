@@ -1,6 +1,8 @@
+import asyncio
+import inspect
 import json
 import logging
-from typing import Awaitable, List
+from typing import Awaitable, Callable, List, Optional, Set, Union
 
 from aiostream import stream
 from fastapi import BackgroundTasks, Request
@@ -24,16 +26,25 @@ class VercelStreamResponse(StreamingResponse):
     DATA_PREFIX = "8:"
     ERROR_PREFIX = "3:"
 
+    # Running final response callbacks, referenced until they finish
+    _final_response_tasks: Set[asyncio.Task] = set()
+
     def __init__(
         self,
         request: Request,
         event_handler: EventCallbackHandler,
-        response: Awaitable[StreamingAgentChatResponse],
+        response: Union[StreamingAgentChatResponse, Awaitable[StreamingAgentChatResponse]],
         chat_data: ChatData,
         background_tasks: BackgroundTasks,
+        on_final_response: Optional[Callable[[str], Awaitable[None]]] = None,
     ):
+        """
+        on_final_response (optional): Called in the background with the response text once
+        the agent finished streaming it. Not called if the agent fails or the client
+        disconnects before the end, so no partial answer is stored.
+        """
         content = VercelStreamResponse.content_generator(
-            request, event_handler, response, chat_data, background_tasks
+            request, event_handler, response, chat_data, background_tasks, on_final_response
         )
         super().__init__(content=content)
 
@@ -42,12 +53,13 @@ class VercelStreamResponse(StreamingResponse):
         cls,
         request: Request,
         event_handler: EventCallbackHandler,
-        response: Awaitable[StreamingAgentChatResponse],
+        response: Union[StreamingAgentChatResponse, Awaitable[StreamingAgentChatResponse]],
         chat_data: ChatData,
         background_tasks: BackgroundTasks,
+        on_final_response: Optional[Callable[[str], Awaitable[None]]] = None,
     ):
         chat_response_generator = cls._chat_response_generator(
-            response, background_tasks, event_handler, chat_data
+            response, background_tasks, event_handler, chat_data, on_final_response
         )
         event_generator = cls._event_generator(event_handler)
 
@@ -88,16 +100,17 @@ class VercelStreamResponse(StreamingResponse):
     @classmethod
     async def _chat_response_generator(
         cls,
-        response: Awaitable[StreamingAgentChatResponse],
+        response: Union[StreamingAgentChatResponse, Awaitable[StreamingAgentChatResponse]],
         background_tasks: BackgroundTasks,
         event_handler: EventCallbackHandler,
         chat_data: ChatData,
+        on_final_response: Optional[Callable[[str], Awaitable[None]]] = None,
     ):
         """
         Yield the text response and source nodes from the chat engine
         """
         # Wait for the response from the chat engine
-        result = response #REMOVED await
+        result = await response if inspect.isawaitable(response) else response
 
         # Once we got a source node, start a background task to download the files (if needed)
         cls._process_response_nodes(result.source_nodes, background_tasks)
@@ -120,6 +133,10 @@ class VercelStreamResponse(StreamingResponse):
             final_response += token
             yield cls.convert_text(token)
 
+        if on_final_response is not None:
+            # Don't hold the stream on the callback
+            cls._run_in_background(on_final_response(final_response))
+
         # Generate next questions if next question prompt is configured
         question_data = await cls._generate_next_questions(
             chat_data.messages, final_response
@@ -130,6 +147,25 @@ class VercelStreamResponse(StreamingResponse):
         # the text_generator is the leading stream, once it's finished, also finish the event stream
         event_handler.is_done = True
 
+    @classmethod
+    def _run_in_background(cls, callback: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(callback)
+        cls._final_response_tasks.add(task)
+        task.add_done_callback(cls._final_response_done)
+
+    @classmethod
+    def _final_response_done(cls, task: asyncio.Task) -> None:
+        cls._final_response_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Error in final response callback", exc_info=task.exception())
+
+    @classmethod
+    async def wait_final_responses(cls) -> None:
+        """
+        Wait for the running final response callbacks, e.g. on server shutdown.
+        """
+        await asyncio.gather(*cls._final_response_tasks, return_exceptions=True)
+
     @classmethod
     def convert_text(cls, token: str):
         # Escape newlines and double quotes to avoid breaking the stream
@@ -1,8 +1,9 @@
 
 from fastapi import HTTPException, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
-from app.db.database import get_db, User
+from app.db.database import get_async_db, get_db, User
 from app.api.services.authentication.authservice import AuthService
 from fastapi import APIRouter, Depends
 from datetime import timedelta
@@ -12,5 +13,5 @@ from app.api.services.user.userservice import UserService
 login_router = APIRouter()
 
 @login_router.post("/token")
-def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    return UserService.login_user(form_data, db)
+async def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return await UserService.alogin_user(form_data, db)
@@ -1,7 +1,8 @@
 from fastapi import HTTPException, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
-from app.db.database import get_db, User
+from app.db.database import get_async_db, get_db, User
 from app.api.services.authentication.authservice import AuthService
 from fastapi import APIRouter, Depends
 from datetime import timedelta
@@ -9,5 +10,5 @@ from app.api.services.user.userservice import UserService
 
 user_router = APIRouter()
 @user_router.post("/register")
-def register_user(username: str, password: str, db: Session = Depends(get_db)):
-    return UserService.register_user(username, password, db)
\ No newline at end of file
+async def register_user(username: str, password: str, db: AsyncSession = Depends(get_async_db)):
+    return await UserService.aregister_user(username, password, db)
\ No newline at end of file
@@ -2,8 +2,9 @@ from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.db.database import get_db, User
+from app.db.database import get_async_db, get_db, User
 
 import logging
 from fastapi.security import OAuth2PasswordBearer
@@ -41,7 +42,10 @@ class AuthService:
         return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
     @staticmethod
-    def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    def get_user_id(token: str) -> int:
+        """
+        Get the user ID from the access token.
+        """
         try:
             logger.info(f"Decoding token: {token}")  # ✅ Add logging
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -53,14 +57,29 @@ class AuthService:
                 raise HTTPException(status_code=401, detail="Invalid authentication")
 
             # ✅ Ensure user_id is converted to an integer for database query
-            user = db.query(User).filter(User.id == int(user_id)).first()
-
-            if user is None:
-                logger.error(f"User with ID {user_id} not found")
-                raise HTTPException(status_code=401, detail="User not found")
-
-            return user
+            return int(user_id)
         except JWTError as e:
             logger.error(f"JWT Error: {e}")
             raise HTTPException(status_code=401, detail="Invalid token")
 
+    @staticmethod
+    def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+        user_id = AuthService.get_user_id(token)
+        user = db.query(User).filter(User.id == user_id).first()
+
+        if user is None:
+            logger.error(f"User with ID {user_id} not found")
+            raise HTTPException(status_code=401, detail="User not found")
+
+        return user
+
+    @staticmethod
+    async def aget_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+        user_id = AuthService.get_user_id(token)
+        user = await db.get(User, user_id)
+
+        if user is None:
+            logger.error(f"User with ID {user_id} not found")
+            raise HTTPException(status_code=401, detail="User not found")
+
+        return user
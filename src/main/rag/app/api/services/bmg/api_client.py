@@ -1,6 +1,8 @@
 import os
+import asyncio
 import httpx
 import logging
+from typing import Optional
 from fastapi import HTTPException
 
 logger = logging.getLogger("uvicorn")
@@ -8,22 +10,72 @@ logger = logging.getLogger("uvicorn")
 BMG_BASE_URL = os.getenv("BMG_BASE_URL")
 BMG_API_KEY = os.getenv("BMG_API_KEY")
 
+# Connection pool and timeouts of the shared client. The pool does work per open
+# connection on every request, a few busy connections beat many idle ones.
+BMG_MAX_CONNECTIONS = int(os.getenv("BMG_MAX_CONNECTIONS", "20"))
+BMG_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("BMG_MAX_KEEPALIVE_CONNECTIONS", "20"))
+BMG_KEEPALIVE_EXPIRY = float(os.getenv("BMG_KEEPALIVE_EXPIRY", "30"))
+BMG_TIMEOUT = float(os.getenv("BMG_TIMEOUT", "10"))
+BMG_CONNECT_TIMEOUT = float(os.getenv("BMG_CONNECT_TIMEOUT", "5"))
+
+
+class BMGClient:
+    """
+    Long-lived HTTP client for the BMG API, opened and closed by the app lifespan.
+    Connections are kept alive and reused across calls, so concurrent product fetches
+    share a few TLS sessions instead of one handshake each.
+    Requests beyond BMG_MAX_CONNECTIONS wait for a slot before entering the pool.
+    """
+
+    _client: Optional[httpx.AsyncClient] = None
+    _slots: Optional[asyncio.Semaphore] = None
+
+    @staticmethod
+    def _create() -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=BMG_MAX_CONNECTIONS,
+                max_keepalive_connections=BMG_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=BMG_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(BMG_TIMEOUT, connect=BMG_CONNECT_TIMEOUT),
+            headers={"Accept": "application/json"},
+        )
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._client is None:
+            cls._client = cls._create()
+            cls._slots = asyncio.Semaphore(BMG_MAX_CONNECTIONS)
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client, cls._slots = None, None
+
+    @classmethod
+    async def aget(cls, url: str, **kwargs) -> httpx.Response:
+        """
+        GET with the shared client, created on first use outside of the app (e.g. in scripts).
+        """
+        cls.start()
+        async with cls._slots:
+            return await cls._client.get(url, **kwargs)
+
+
 async def fetch_from_bmg(endpoint: str, params=None):
     """ Generic function to fetch data from BMG API """
     if not BMG_BASE_URL or not BMG_API_KEY:
         raise HTTPException(status_code=500, detail="Server misconfiguration: Missing BMG_BASE_URL or BMG_API_KEY")
 
     url = f"{BMG_BASE_URL}{endpoint}"
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            url,
-            headers={
-                "X-Authorization": BMG_API_KEY,
-                "Accept": "application/json"
-            },
-            params=params
-        )
+
+    response = await BMGClient.aget(
+        url,
+        headers={"X-Authorization": BMG_API_KEY},
+        params=params
+    )
 
     if response.status_code != 200:
         logger.error(f"Failed to fetch data: {response.status_code} - {response.text}")
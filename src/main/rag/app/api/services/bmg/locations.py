@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import time
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.api.services.bmg.api_client import fetch_from_bmg
+
+logger = logging.getLogger("uvicorn")
+
+# The catalog is refreshed in the background once it's older than this
+BMG_LOCATIONS_TTL = float(os.getenv("BMG_LOCATIONS_TTL", "3600"))
+# Delay before retrying a failed refresh
+BMG_LOCATIONS_RETRY_DELAY = float(os.getenv("BMG_LOCATIONS_RETRY_DELAY", "60"))
+
+
+def normalize_name(name: str) -> str:
+    """
+    Place names that only differ by case, accents or whitespace match.
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+
+class LocationCatalog:
+    """
+    In-memory index of the BMG locations (`/v2/config`), keyed by normalized
+    (country, city) and by city alone, so resolving a city doesn't call BMG.
+    The catalog is fetched once and refreshed every BMG_LOCATIONS_TTL seconds by a
+    background task started with the app; lookups keep using the previous catalog
+    while a refresh runs.
+    """
+
+    _by_country_city: Dict[Tuple[str, str], str] = {}
+    _by_city: Dict[str, List[str]] = {}
+    _loaded_at: Optional[float] = None
+    _load_lock: Optional[asyncio.Lock] = None
+    _task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._task is None:
+            cls._task = asyncio.create_task(cls._refresh_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        await asyncio.gather(cls._task, return_exceptions=True)
+        cls._task = None
+
+    @classmethod
+    async def _refresh_loop(cls) -> None:
+        while True:
+            try:
+                await cls.refresh()
+                delay = BMG_LOCATIONS_TTL
+            except Exception as e:
+                logger.error(f"Failed to refresh the BMG location catalog: {e}")
+                delay = BMG_LOCATIONS_RETRY_DELAY
+            await asyncio.sleep(delay)
+
+    @classmethod
+    def _get_load_lock(cls) -> asyncio.Lock:
+        if cls._load_lock is None:
+            cls._load_lock = asyncio.Lock()
+        return cls._load_lock
+
+    @classmethod
+    async def refresh(cls) -> None:
+        """
+        Fetch the locations and swap in the new indexes.
+        """
+        async with cls._get_load_lock():
+            data = await fetch_from_bmg("/v2/config")
+            by_country_city, by_city = cls._build_indexes(data)
+            cls._by_country_city, cls._by_city = by_country_city, by_city
+            cls._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(by_country_city)} BMG cities")
+
+    @staticmethod
+    def _build_indexes(data) -> Tuple[Dict[Tuple[str, str], str], Dict[str, List[str]]]:
+        by_country_city: Dict[Tuple[str, str], str] = {}
+        city_uuids: Dict[str, Set[str]] = {}
+        for continent in data["locations"]["data"]:
+            for country in continent["countries"]["data"]:
+                country_key = normalize_name(country["name"])
+                for state in country["states"]["data"]:
+                    for city in state["cities"]["data"]:
+                        city_key = normalize_name(city["name"])
+                        # Keep the first city of a name in a country, like the former scan
+                        by_country_city.setdefault((country_key, city_key), city["uuid"])
+                        city_uuids.setdefault(city_key, set()).add(city["uuid"])
+        by_city = {city_key: sorted(uuids) for city_key, uuids in city_uuids.items()}
+        return by_country_city, by_city
+
+    @classmethod
+    async def _ensure_loaded(cls) -> None:
+        """
+        Load the catalog on first use, e.g. in scripts that don't run the app lifespan.
+        """
+        if cls._loaded_at is None:
+            # Wait for a load in progress rather than starting another one
+            async with cls._get_load_lock():
+                pass
+        if cls._loaded_at is None:
+            await cls.refresh()
+
+    @classmethod
+    async def resolve_city(cls, country: str, city: str) -> Optional[str]:
+        """
+        UUID of the city in the country. If the country doesn't match, a city name
+        that's unique in the catalog is enough.
+        """
+        await cls._ensure_loaded()
+        city_key = normalize_name(city)
+        city_uuid = cls._by_country_city.get((normalize_name(country), city_key))
+        if city_uuid is not None:
+            return city_uuid
+        uuids = cls._by_city.get(city_key, [])
+        return uuids[0] if len(uuids) == 1 else None
@@ -1,25 +1,79 @@
-from typing import Optional
+import copy
+import os
+import time
 import logging
 import asyncio
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from cachetools import LRUCache
 from app.api.services.bmg.api_client import fetch_from_bmg
 from app.api.routers.basket.models import Activity
 
 
 logger = logging.getLogger("uvicorn")
 
-async def get_city_uuid(data, country: str, city: str) -> Optional[str]:
-    for continent in data['locations']['data']:
-        for c in continent['countries']['data']:
-            if c['name'] == country:
-                for state in c['states']['data']:
-                    for c in state['cities']['data']:
-                        if c['name'] == city:
-                            city_uuid = c['uuid']
-                            return city_uuid
-    return None
+# Product details are served from memory for BMG_PRODUCT_TTL seconds, then served stale
+# while refreshed in the background for up to BMG_PRODUCT_STALE_TTL seconds
+BMG_PRODUCT_CACHE_SIZE = int(os.getenv("BMG_PRODUCT_CACHE_SIZE", "5000"))
+BMG_PRODUCT_TTL = float(os.getenv("BMG_PRODUCT_TTL", "900"))
+BMG_PRODUCT_STALE_TTL = float(os.getenv("BMG_PRODUCT_STALE_TTL", "86400"))
+# Product detail requests sent to BMG at the same time
+BMG_PRODUCT_FETCH_CONCURRENCY = int(os.getenv("BMG_PRODUCT_FETCH_CONCURRENCY", "10"))
 
 
+class ProductCache:
+    """
+    Stale-while-revalidate cache of the product details, shared by the activity
+    recommendations and the basket.
+    - Fresh details are returned from memory.
+    - Stale details are returned at once and refreshed in the background.
+    - Missing or expired details are fetched, one request per product even if many
+      callers ask at the same time, and at most BMG_PRODUCT_FETCH_CONCURRENCY at once.
+    """
+
+    _entries: LRUCache = LRUCache(maxsize=BMG_PRODUCT_CACHE_SIZE)
+    _inflight: Dict[str, asyncio.Task] = {}
+    _slots: Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    async def get(cls, uuid: str) -> Activity:
+        entry: Optional[Tuple[float, Activity]] = cls._entries.get(uuid)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < BMG_PRODUCT_TTL:
+                return copy.copy(entry[1])
+            if age < BMG_PRODUCT_STALE_TTL:
+                cls._fetch(uuid)
+                return copy.copy(entry[1])
+        return copy.copy(await asyncio.shield(cls._fetch(uuid)))
+
+    @classmethod
+    def _fetch(cls, uuid: str) -> asyncio.Task:
+        """
+        The running fetch of the product, or a new one.
+        """
+        task = cls._inflight.get(uuid)
+        if task is None:
+            task = asyncio.create_task(cls._fetch_and_store(uuid))
+            cls._inflight[uuid] = task
+            task.add_done_callback(lambda _: cls._inflight.pop(uuid, None))
+            # Retrieve the error of background refreshes nobody awaits
+            task.add_done_callback(cls._log_error)
+        return task
+
+    @classmethod
+    async def _fetch_and_store(cls, uuid: str) -> Activity:
+        if cls._slots is None:
+            cls._slots = asyncio.Semaphore(BMG_PRODUCT_FETCH_CONCURRENCY)
+        async with cls._slots:
+            details = await fetch_product_details(uuid)
+        cls._entries[uuid] = (time.monotonic(), details)
+        return details
+
+    @staticmethod
+    def _log_error(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to fetch product details: {task.exception()}")
+
 async def get_product_list(city_uuid: str) -> List[Dict]:
     """ Fetches the list of products for a given city UUID """
     products = await fetch_from_bmg("/v2/products", {"city": city_uuid})
@@ -27,6 +81,11 @@ async def get_product_list(city_uuid: str) -> List[Dict]:
 
 
 async def get_product_details(uuid: str) -> Activity:
+    """ Product details given a UUID, from the product cache """
+    return await ProductCache.get(uuid)
+
+
+async def fetch_product_details(uuid: str) -> Activity:
     """ Fetches product details given a UUID """
     data = await fetch_from_bmg(f"/v2/products/{uuid}")
 
@@ -65,7 +124,7 @@ async def get_products_with_details(city_uuid: str) -> List[Activity]:
     products = await get_product_list(city_uuid)
     product_uuids = [p["uuid"] for p in products]
 
-    # Fetch product details concurrently
+    # Fetch product details concurrently, the product cache bounds the requests to BMG
     product_details = await asyncio.gather(*[get_product_details(uuid) for uuid in product_uuids])
 
     return product_details
\ No newline at end of file
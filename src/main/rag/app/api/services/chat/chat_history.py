@@ -0,0 +1,69 @@
+import os
+from typing import List, Optional, Tuple
+
+from llama_index.core.llms import ChatMessage, MessageRole
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import ChatSession, Message, Response
+from app.api.services.context.context_cache import CHAT_HISTORY, get_context_cache
+
+# Most recent turns (user message and response) given to the LLM, older ones are
+# folded into the session summary by the HistoryCompactor
+HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "10"))
+
+
+class ChatHistory:
+    """
+    Server-held history of a chat session, for clients that only send the new message.
+    The turns that aren't in the session summary yet (at most the last HISTORY_WINDOW)
+    are read from the messages and responses tables once, then kept in the context
+    cache and appended to as turns are stored.
+    """
+
+    @staticmethod
+    async def aget_window(session_id: int, db: AsyncSession) -> List[ChatMessage]:
+        cache = get_context_cache()
+        window = cache.get(CHAT_HISTORY, session_id)
+        if window is None:
+            generation = cache.generation
+            summarized_id = (
+                select(ChatSession.summary_message_id)
+                .where(ChatSession.id == session_id)
+                .scalar_subquery()
+            )
+            query: Select = (
+                select(Message.content, Response.content)
+                .outerjoin(Response, Response.message_id == Message.id)
+                .where(
+                    Message.session_id == session_id,
+                    Message.role == "user",
+                    Message.id > func.coalesce(summarized_id, 0),
+                )
+                .order_by(Message.id.desc())
+                .limit(HISTORY_WINDOW)
+            )
+            turns: List[Tuple[str, Optional[str]]] = list((await db.execute(query)).all())
+            window = []
+            for content, response_content in reversed(turns):
+                window.extend(ChatHistory._turn(content, response_content))
+            cache.fill(CHAT_HISTORY, session_id, window, generation)
+        return window
+
+    @staticmethod
+    async def aappend(session_id: int, content: str, response_content: str) -> None:
+        """
+        Add a stored turn to the cached window of the session.
+        """
+        def write(window: List[ChatMessage]) -> None:
+            window.extend(ChatHistory._turn(content, response_content))
+            del window[: max(len(window) - 2 * HISTORY_WINDOW, 0)]
+
+        await get_context_cache().amodify(CHAT_HISTORY, session_id, write)
+
+    @staticmethod
+    def _turn(content: str, response_content: str | None) -> List[ChatMessage]:
+        turn = [ChatMessage(role=MessageRole.USER, content=content)]
+        if response_content is not None:
+            turn.append(ChatMessage(role=MessageRole.ASSISTANT, content=response_content))
+        return turn
@@ -1,4 +1,8 @@
+import asyncio
+from functools import partial
 from fastapi import HTTPException, BackgroundTasks, Request, Depends, APIRouter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.db.database import get_db, ChatSession, Message as DBMessage
 from app.engine.engine import get_chat_engine
@@ -12,10 +16,11 @@ from app.db.database import User, Response
 import logging
 from app.db.database import Message
 from app.api.routers.llm.events import EventCallbackHandler
-from app.api.services.context.retrieve_user_context import RetrieveUserContext
-from app.api.services.context.update_session_context import UpdateSessionContext
-from app.api.services.context.update_user_embeddings import UpdateUserEmbeddings
-from app.api.services.context.update_user_preference import UpdateUserPreference
+from app.api.services.context.context_stage import ContextStage, with_async_session
+from app.api.services.context.update_queue import ContextUpdateQueue
+from app.api.services.chat.chat_history import ChatHistory
+from app.api.services.chat.history_compactor import HistoryCompactor
+from llama_index.core.llms import ChatMessage
 
 logger = logging.getLogger("uvicorn")
 
@@ -46,55 +51,116 @@ class ChatService:
         return {"sessions": [{"session_id": session.id, "created_at": session.created_at} for session in sessions]}
 
     @staticmethod
-    async def chat(request: Request, data: ChatData, background_tasks: BackgroundTasks, user, db: Session):
-        session = db.query(ChatSession).filter(
-            ChatSession.id == data.session_id, ChatSession.user_id == user.id
-        ).first()
+    async def acreate_chat_session(user, db: AsyncSession):
+        new_session = ChatSession(user_id=user.id)
+        db.add(new_session)
+        await db.commit()
+        return {"session_id": new_session.id}
 
-        #call update_session_context function 
-        #call update_user_embeddings function 
-        #call update_user_preference function
+    @staticmethod
+    async def aget_user_sessions(user, db: AsyncSession):
+        """Fetch all chat sessions for a given user"""
+        sessions = await db.scalars(select(ChatSession).where(ChatSession.user_id == user.id))
+        return {"sessions": [{"session_id": session.id, "created_at": session.created_at} for session in sessions]}
 
-        if not session:
-            raise HTTPException(status_code=400, detail="Invalid session ID")
+    @staticmethod
+    async def aget_user_session(user, session_id: int, db: AsyncSession):
+        return await db.scalar(
+            select(ChatSession).where(ChatSession.id == session_id, ChatSession.user_id == user.id)
+        )
 
+    @staticmethod
+    async def chat(request: Request, data: ChatData, background_tasks: BackgroundTasks, user, db: AsyncSession):
         last_message_content = data.get_last_message_content()
-        messages = data.get_history_messages(db)  # Query DB for history #NO longer used
 
-        # 🔹 Step 1: Retrieve the existing user context
-        user_context = RetrieveUserContext.retrieve_user_context(user.id, session.id, last_message_content, db)
+        # 🔹 Step 1: Check the session first, nothing of it is read (or cached) unless it
+        # belongs to the user. Then retrieve the existing user context and the history
+        # at the same time.
+        session = await ChatService.aget_user_session(user, data.session_id, db)
+        if not session:
+            raise HTTPException(status_code=400, detail="Invalid session ID")
 
-        # 🔹 Step 2: Update session context with new information
-        UpdateSessionContext.update_session_context(session, last_message_content, db)
+        user_context, history = await asyncio.gather(
+            ContextStage.retrieve_user_context(user.id, session.id, last_message_content),
+            ChatService.aget_history(data),
+        )
 
-        # 🔹 Step 3: Update user embeddings in Pinecone
-        UpdateUserEmbeddings.update_user_embeddings(user.id, session.id, last_message_content)
+        document_ids = data.get_chat_document_ids()
+        if data.server_history:
+            # Earlier uploads are only known to the server
+            document_ids = await ChatService.aadd_session_documents(session, document_ids, db)
+        else:
+            # The server-held history already starts after the summary
+            history = await HistoryCompactor.atrim_client_history(session, history, db)
 
-        # 🔹 Step 4: Update user preferences
-        UpdateUserPreference.update_user_preferences(user, last_message_content, db)
+        # 🔹 Step 2: Queue the session context, user embeddings and user preferences updates.
+        # They only feed the next turns, so they are applied in the background.
+        await ContextUpdateQueue.enqueue(user.id, session.id, last_message_content)
 
-        filters = generate_filters(data.get_chat_document_ids())  # Query DB for doc IDs
+        filters = generate_filters(document_ids)  # Query DB for doc IDs
         chat_engine = get_chat_engine(filters=filters)
-        response = await chat_engine.astream_chat(last_message_content, user_context)
-        #print(dir(response)) #see what methods are available
+        # Not awaited here, tokens are streamed as soon as the agent produces them
+        chat_history = HistoryCompactor.build_chat_history(user_context, session.summary, history)
+        response = chat_engine.astream_chat(last_message_content, chat_history)
+        event_handler = EventCallbackHandler()
+
+        # 🔹 Step 3: Store the user message and the full response once the stream ends,
+        # in its own DB session as the request's one is closed by then, and add them
+        # to the server-held history
+        return VercelStreamResponse(
+            request,
+            event_handler,
+            response,
+            data,
+            background_tasks,
+            on_final_response=partial(ChatService.asave_turn, session.id, last_message_content),
+        )
+
+    @staticmethod
+    async def aget_history(data: ChatData) -> List[ChatMessage]:
+        """
+        History of the chat, held by the server or sent by the client
+        """
+        if data.server_history:
+            return await with_async_session(ChatHistory.aget_window, data.session_id)
+        return data.get_history_messages()
+
+    @staticmethod
+    async def aadd_session_documents(session: ChatSession, document_ids: List[str], db: AsyncSession) -> List[str]:
+        """
+        Add the documents of the new message to the session, return all of its documents
+        """
+        session_document_ids = set(session.document_ids or [])
+        if not session_document_ids.issuperset(document_ids):
+            session.document_ids = sorted(session_document_ids.union(document_ids))
+            await db.commit()
+        return list(session.document_ids or [])
+
+    @staticmethod
+    async def asave_turn(session_id: int, content: str, response_content: str):
+        """
+        Store the user message and the response for it, and add them to the history
+        """
+        await with_async_session(ChatService.astore_message, session_id, content, response_content)
+        await ChatHistory.aappend(session_id, content, response_content)
+        HistoryCompactor.schedule(session_id)
 
-        #Store user message in DB
+    @staticmethod
+    async def astore_message(session_id: int, content: str, response_content: str, db: AsyncSession):
+        """Store the user message and the response for it"""
         new_message = Message(
-            session_id=session.id, role="user", content=last_message_content
+            session_id=session_id, role="user", content=content
         )
         db.add(new_message)
-        db.commit()
-        event_handler = EventCallbackHandler()
+        await db.flush()
 
         new_response = Response(
-            session_id=session.id,
+            session_id=session_id,
             message_id=new_message.id, 
-            content=response.response
+            content=response_content
         )
         db.add(new_response)
-        db.commit()
-
-        return VercelStreamResponse(request, event_handler, response, data, background_tasks)
+        await db.commit()
 
     @staticmethod
     def get_chat_messages(user, session_id: int, db: Session):
@@ -113,4 +179,23 @@ class ChatService:
                 {"id": msg.id, "role": msg.role, "content": msg.content, "created_at": msg.created_at}
                 for msg in messages
             ],
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    async def aget_chat_messages(user, session_id: int, db: AsyncSession):
+        """Fetch all messages for a given chat session"""
+        session = await ChatService.aget_user_session(user, session_id, db)
+
+        if not session:
+            raise HTTPException(status_code=404, detail="Chat session not found")
+
+        messages = await db.scalars(
+            select(Message).where(Message.session_id == session_id).order_by(Message.created_at)
+        )
+        return {
+            "session_id": session_id,
+            "messages": [
+                {"id": msg.id, "role": msg.role, "content": msg.content, "created_at": msg.created_at}
+                for msg in messages
+            ],
+        }
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional, Set, Tuple
+
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.prompts import PromptTemplate
+from llama_index.core.settings import Settings
+from sqlalchemy import Select, func, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import ChatSession, Message, Response
+from app.api.services.chat.chat_history import HISTORY_WINDOW
+from app.api.services.context.context_cache import CHAT_HISTORY, get_context_cache
+from app.api.services.context.context_stage import with_async_session
+
+logger = logging.getLogger(__name__)
+
+# Recent turns (user message and response) that are always kept verbatim
+VERBATIM_TURNS = int(os.getenv("CHAT_HISTORY_VERBATIM_TURNS", "4"))
+# Older turns are folded into the session summary once there are this many of them
+SUMMARY_BATCH_TURNS = int(os.getenv("CHAT_SUMMARY_BATCH_TURNS", "2"))
+
+# Token budget of each section of the prompt history
+CONTEXT_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKENS", "800"))
+SUMMARY_BUDGET = int(os.getenv("PROMPT_SUMMARY_TOKENS", "300"))
+HISTORY_BUDGET = int(os.getenv("PROMPT_HISTORY_TOKENS", "1200"))
+
+SUMMARY_PROMPT = PromptTemplate(
+    "Update the summary of a travel planning conversation with its next turns.\n"
+    "Keep the destinations, dates, budget, bookings and preferences the user stated, "
+    "and the decisions made. Use at most {max_tokens} tokens.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "Next turns:\n{conversation}\n\n"
+    "Updated summary:"
+)
+
+
+def count_tokens(text: str) -> int:
+    return len(Settings.tokenizer(text))
+
+
+def fit_text(text: str, budget: int) -> str:
+    """
+    Cut the text to the token budget.
+    """
+    tokens = count_tokens(text)
+    while tokens > budget and text:
+        text = text[: int(len(text) * budget / tokens)]
+        tokens = count_tokens(text)
+    return text
+
+
+class HistoryCompactor:
+    """
+    Keeps the history sent to the LLM within a token budget.
+    - The last VERBATIM_TURNS turns of a session are sent as they are.
+    - Older turns are folded into a summary stored on the chat session. The summary is
+      updated in the background after a turn is stored, SUMMARY_BATCH_TURNS turns at a
+      time, so it costs one LLM call every few turns instead of growing the prompt.
+    - The user context, the summary and the history each have a token budget.
+    """
+
+    # Sessions being compacted, and sessions to compact again once done
+    _running: Set[int] = set()
+    _pending: Set[int] = set()
+    _tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def build_chat_history(
+        user_context: List[ChatMessage],
+        summary: Optional[str],
+        history: List[ChatMessage],
+    ) -> List[ChatMessage]:
+        """
+        Chat history for the LLM: the user context, the summary of the older turns and
+        the recent turns, each cut to its token budget.
+        """
+        chat_history = HistoryCompactor._fit_messages(user_context, CONTEXT_BUDGET, keep_newest=False)
+        if summary:
+            chat_history.append(
+                ChatMessage(
+                    role=MessageRole.SYSTEM,
+                    content=f"--- Conversation Summary ---\n{fit_text(summary, SUMMARY_BUDGET)}",
+                )
+            )
+        chat_history.extend(HistoryCompactor._fit_messages(history, HISTORY_BUDGET, keep_newest=True))
+        return chat_history
+
+    @staticmethod
+    def _fit_messages(messages: List[ChatMessage], budget: int, keep_newest: bool) -> List[ChatMessage]:
+        """
+        Keep the first (or the last) messages that fit in the token budget.
+        """
+        ordered = reversed(messages) if keep_newest else messages
+        kept: List[ChatMessage] = []
+        for message in ordered:
+            budget -= count_tokens(message.content or "")
+            if budget < 0:
+                logger.info(f"Dropped {len(messages) - len(kept)} messages over the token budget")
+                break
+            kept.append(message)
+        return kept[::-1] if keep_newest else kept
+
+    @staticmethod
+    async def atrim_client_history(
+        session: ChatSession, history: List[ChatMessage], db: AsyncSession
+    ) -> List[ChatMessage]:
+        """
+        Turns of a history sent by the client that aren't in the session summary yet, at
+        most the last HISTORY_WINDOW like the server-held history. The client sends every
+        turn of the session, the summarized ones would be in the prompt twice.
+        """
+        turns = HistoryCompactor._split_turns(history)
+        if session.summary_message_id is not None:
+            summarized_turns = await db.scalar(
+                select(func.count(Message.id)).where(
+                    Message.session_id == session.id,
+                    Message.role == "user",
+                    Message.id <= session.summary_message_id,
+                )
+            )
+            turns = turns[summarized_turns or 0 :]
+        return [message for turn in turns[-HISTORY_WINDOW:] for message in turn]
+
+    @staticmethod
+    def _split_turns(messages: List[ChatMessage]) -> List[List[ChatMessage]]:
+        """
+        Group the messages in turns, each starting with a user message.
+        """
+        turns: List[List[ChatMessage]] = []
+        for message in messages:
+            if message.role == MessageRole.USER or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    @classmethod
+    def schedule(cls, session_id: int) -> None:
+        """
+        Update the summary of the session in the background.
+        """
+        if session_id in cls._running:
+            cls._pending.add(session_id)
+            return
+        cls._running.add(session_id)
+        task = asyncio.create_task(cls._run(session_id))
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+
+    @classmethod
+    async def _run(cls, session_id: int) -> None:
+        try:
+            while True:
+                cls._pending.discard(session_id)
+                try:
+                    await with_async_session(cls.acompact, session_id)
+                except Exception as e:
+                    # The turns stay unsummarized, the next turn retries
+                    logger.error(f"Failed to summarize the history of session {session_id}: {e}")
+                if session_id not in cls._pending:
+                    break
+        finally:
+            cls._running.discard(session_id)
+
+    @staticmethod
+    async def acompact(session_id: int, db: AsyncSession) -> int:
+        """
+        Fold the turns older than the verbatim ones into the session summary.
+        Return the number of turns summarized.
+        """
+        session = await db.get(ChatSession, session_id)
+        if session is None:
+            return 0
+        summarized_id: Optional[int] = session.summary_message_id
+        query: Select = (
+            select(Message.id, Message.content, Response.content)
+            .outerjoin(Response, Response.message_id == Message.id)
+            .where(
+                Message.session_id == session_id,
+                Message.role == "user",
+                Message.id > literal(summarized_id or 0),
+            )
+            .order_by(Message.id)
+        )
+        turns: List[Tuple[int, str, Optional[str]]] = list((await db.execute(query)).all())
+        old_turns = turns[: max(len(turns) - VERBATIM_TURNS, 0)]
+        if not old_turns or len(old_turns) < SUMMARY_BATCH_TURNS:
+            return 0
+
+        conversation = "\n".join(
+            f"User: {content}\nAssistant: {response_content or ''}"
+            for _, content, response_content in old_turns
+        )
+        output = await Settings.llm.acomplete(
+            SUMMARY_PROMPT.format(
+                summary=session.summary or "None",
+                conversation=conversation,
+                max_tokens=SUMMARY_BUDGET,
+            )
+        )
+        summary = fit_text(output.text.strip(), SUMMARY_BUDGET)
+
+        # Only one worker folds the same turns
+        updated = await db.scalar(
+            update(ChatSession)
+            .where(
+                ChatSession.id == session_id,
+                ChatSession.summary_message_id.is_not_distinct_from(summarized_id),
+            )
+            .values(summary=summary, summary_message_id=old_turns[-1][0])
+            .returning(ChatSession.id)
+        )
+        await db.commit()
+        if updated is None:
+            return 0
+        # The cached window only holds the turns after the summary
+        await get_context_cache().ainvalidate(CHAT_HISTORY, session_id)
+        logger.info(f"Summarized {len(old_turns)} turns of session {session_id}")
+        return len(old_turns)
@@ -0,0 +1,267 @@
+import copy
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from cachetools import LRUCache
+from sqlalchemy import text
+
+from app.db.database import engine, get_async_engine
+
+logger = logging.getLogger(__name__)
+
+USER_CONTEXT = "user"
+SESSION_CONTEXT = "session"
+CHAT_HISTORY = "history"
+
+
+class InvalidationChannel:
+    """
+    Broadcasts cache invalidations to the other workers.
+    The default channel only has one process to notify, so it does nothing.
+    """
+
+    def publish(self, message: str) -> None:
+        pass
+
+    async def apublish(self, message: str) -> None:
+        pass
+
+    def subscribe(self, callback: Callable[[Optional[str]], None]) -> None:
+        """
+        The callback gets every message, or None if messages may have been missed.
+        """
+
+
+class PostgresInvalidationChannel(InvalidationChannel):
+    """
+    Invalidation channel over Postgres LISTEN/NOTIFY, so every worker that shares the
+    database also shares the invalidations.
+    """
+
+    CHANNEL = "context_cache"
+
+    def __init__(self, reconnect_delay: float = 5):
+        self.reconnect_delay = reconnect_delay
+        self._callback: Optional[Callable[[Optional[str]], None]] = None
+        self._listener: Optional[threading.Thread] = None
+
+    def publish(self, message: str) -> None:
+        with engine.connect() as connection:
+            connection.execute(
+                text("SELECT pg_notify(:channel, :message)"),
+                {"channel": self.CHANNEL, "message": message},
+            )
+            connection.commit()
+
+    async def apublish(self, message: str) -> None:
+        async with get_async_engine().connect() as connection:
+            await connection.execute(
+                text("SELECT pg_notify(:channel, :message)"),
+                {"channel": self.CHANNEL, "message": message},
+            )
+            await connection.commit()
+
+    def subscribe(self, callback: Callable[[Optional[str]], None]) -> None:
+        self._callback = callback
+        if self._listener is None:
+            self._listener = threading.Thread(
+                target=self._listen, name="context-cache-listener", daemon=True
+            )
+            self._listener.start()
+
+    def _listen(self) -> None:
+        import psycopg2
+
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            try:
+                connection = psycopg2.connect(dsn)
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.CHANNEL}")
+                # Notifications sent while we weren't listening are lost
+                self._callback(None)
+                while True:
+                    if select.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self._callback(connection.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"Context cache invalidation channel failed: {e}")
+                time.sleep(self.reconnect_delay)
+
+
+class _WriteLog(LRUCache):
+    """
+    Generation of the last write per cached key. Keys evicted from the log are treated
+    as written at the highest generation evicted so far.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize=maxsize)
+        self.floor = 0
+
+    def popitem(self) -> Tuple[Hashable, int]:
+        key, generation = super().popitem()
+        self.floor = max(self.floor, generation)
+        return key, generation
+
+    def last_write(self, key: Hashable) -> int:
+        return self.get(key, self.floor)
+
+
+class ContextCache:
+    """
+    Bounded LRU cache of the persistent storage of users, the temporary storage of
+    sessions and the recent chat history of sessions. Writers update it through
+    (e.g. UpdateUserPreference and UpdateSessionContext), and other workers drop their
+    copy through the invalidation channel, so a cached context can be served without
+    a DB round-trip.
+    """
+
+    def __init__(self, maxsize: int, channel: InvalidationChannel):
+        self._caches: Dict[str, LRUCache] = {
+            USER_CONTEXT: LRUCache(maxsize=maxsize),
+            SESSION_CONTEXT: LRUCache(maxsize=maxsize),
+            CHAT_HISTORY: LRUCache(maxsize=maxsize),
+        }
+        self._lock = threading.Lock()
+        # Bumped by every write, a read only fills the cache if no write to the same
+        # key happened while it was loading from the DB
+        self._generation = 0
+        self._writes = _WriteLog(maxsize=3 * maxsize)
+        self._origin = uuid.uuid4().hex
+        self._channel = channel
+        self._channel.subscribe(self._on_invalidation)
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, kind: str, key: int) -> Optional[Any]:
+        with self._lock:
+            data = self._caches[kind].get(key)
+            return copy.copy(data) if data is not None else None
+
+    def fill(self, kind: str, key: int, data: Any, generation: int) -> None:
+        """
+        Cache data read from the DB at the given generation, unless the key was
+        written since.
+        """
+        with self._lock:
+            if self._writes.last_write((kind, key)) <= generation:
+                self._caches[kind][key] = copy.copy(data)
+
+    def update(self, kind: str, key: int, field: str, value: str) -> None:
+        """
+        Write through a stored value and invalidate the other workers.
+        """
+        self.update_many(kind, key, {field: value})
+
+    def update_many(self, kind: str, key: int, values: Dict[str, str]) -> None:
+        """
+        Write through several stored values with a single invalidation.
+        """
+        self.modify(kind, key, lambda data: data.update(values))
+
+    def modify(self, kind: str, key: int, write: Callable[[Any], None]) -> None:
+        """
+        Apply a write to the cached data, if cached, and invalidate the other workers.
+        """
+        self._modify(kind, key, write)
+        self._publish(kind, key)
+
+    async def amodify(self, kind: str, key: int, write: Callable[[Any], None]) -> None:
+        """
+        Same as modify, for the event loop: the invalidation is published without blocking it.
+        """
+        self._modify(kind, key, write)
+        await self._apublish(kind, key)
+
+    def invalidate(self, kind: str, key: int) -> None:
+        self._invalidate(kind, key)
+        self._publish(kind, key)
+
+    async def ainvalidate(self, kind: str, key: int) -> None:
+        self._invalidate(kind, key)
+        await self._apublish(kind, key)
+
+    def _modify(self, kind: str, key: int, write: Callable[[Any], None]) -> None:
+        with self._lock:
+            self._record_write(kind, key)
+            data = self._caches[kind].get(key)
+            if data is not None:
+                write(data)
+
+    def _invalidate(self, kind: str, key: int) -> None:
+        with self._lock:
+            self._record_write(kind, key)
+            self._caches[kind].pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            # Every key counts as written, the reads in flight are dropped
+            self._generation += 1
+            self._writes.clear()
+            self._writes.floor = self._generation
+            for cache in self._caches.values():
+                cache.clear()
+
+    def _record_write(self, kind: str, key: int) -> None:
+        self._generation += 1
+        self._writes[(kind, key)] = self._generation
+
+    def _publish(self, kind: str, key: int) -> None:
+        try:
+            self._channel.publish(f"{self._origin}:{kind}:{key}")
+        except Exception as e:
+            # Other workers may serve a stale entry until it's evicted
+            logger.error(f"Failed to publish context cache invalidation: {e}")
+
+    async def _apublish(self, kind: str, key: int) -> None:
+        try:
+            await self._channel.apublish(f"{self._origin}:{kind}:{key}")
+        except Exception as e:
+            logger.error(f"Failed to publish context cache invalidation: {e}")
+
+    def _on_invalidation(self, message: Optional[str]) -> None:
+        if message is None:
+            self.clear()
+            return
+        origin, kind, key = message.split(":")
+        if origin == self._origin or kind not in self._caches:
+            return
+        with self._lock:
+            self._record_write(kind, int(key))
+            self._caches[kind].pop(int(key), None)
+
+
+def get_invalidation_channel() -> InvalidationChannel:
+    channel = os.getenv("CONTEXT_CACHE_INVALIDATION", "local")
+    if channel == "postgres":
+        return PostgresInvalidationChannel()
+    if channel == "local":
+        return InvalidationChannel()
+    raise ValueError(f"Invalid context cache invalidation channel: {channel}")
+
+
+_context_cache: Optional[ContextCache] = None
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache() -> ContextCache:
+    global _context_cache
+    if _context_cache is None:
+        with _context_cache_lock:
+            if _context_cache is None:
+                _context_cache = ContextCache(
+                    maxsize=int(os.getenv("CONTEXT_CACHE_SIZE", "1024")),
+                    channel=get_invalidation_channel(),
+                )
+    return _context_cache
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, List
+
+from llama_index.core.llms import ChatMessage
+
+from app.db.database import AsyncSessionLocal, SessionLocal
+from app.db.pinecone import search_embeddings
+from app.api.services.context.retrieve_user_context import RetrieveUserContext
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool for the blocking Pinecone and LLM calls of a chat turn, so they don't
+# stall the event loop
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CONTEXT_POOL_SIZE", "8")),
+    thread_name_prefix="context",
+)
+# Separate bounded pool for the background workers (context updates, retention), so a
+# backlog of background work never takes the threads of the chat turns
+_background_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CONTEXT_BACKGROUND_POOL_SIZE", "4")),
+    thread_name_prefix="context-background",
+)
+
+
+async def run_in_pool(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking function of the chat turn in the context thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+async def run_in_background_pool(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking function of a background worker in the background thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_background_executor, partial(func, *args, **kwargs))
+
+
+async def with_async_session(func: Callable, *args) -> Any:
+    """
+    Await func with its own async DB session as last argument, a session can't run
+    concurrent queries.
+    """
+    async with AsyncSessionLocal() as db:
+        return await func(*args, db)
+
+
+def with_session(func: Callable, *args) -> Any:
+    """
+    Run func with its own DB session as last argument, a session can't be shared
+    between concurrent threads.
+    """
+    db = SessionLocal()
+    try:
+        return func(*args, db)
+    finally:
+        db.close()
+
+
+class ContextStage:
+    """
+    Gathers the context of a chat turn concurrently instead of step by step.
+    Reads (persistent storage, temporary storage, memory search) run at the same time,
+    the DB reads on the async engine and the memory search in the thread pool.
+    """
+
+    @staticmethod
+    async def retrieve_user_context(user_id: int, session_id: int, query: str) -> List[ChatMessage]:
+        """
+        Same context as RetrieveUserContext.retrieve_user_context, with the DB queries
+        and the memory search running concurrently.
+        """
+        persistent_data, temporary_data, embedding_results = await asyncio.gather(
+            with_async_session(RetrieveUserContext.aget_persistent_data, user_id),
+            with_async_session(RetrieveUserContext.aget_temporary_data, session_id),
+            run_in_pool(search_embeddings, user_id, session_id, query, k=3),
+        )
+        chat_messages = RetrieveUserContext.format_context(
+            persistent_data, temporary_data, embedding_results
+        )
+        logger.info(f"Retrieved context for user {user_id}, session {session_id}: {chat_messages}")
+        return chat_messages
+
+    @staticmethod
+    def shutdown() -> None:
+        """
+        Wait for the running blocking calls, e.g. on server shutdown.
+        """
+        _executor.shutdown(wait=True)
+        _background_executor.shutdown(wait=True)
@@ -0,0 +1,72 @@
+from collections import deque
+from typing import Dict, FrozenSet, Generic, Hashable, Iterable, List, Mapping, Set, TypeVar
+
+Label = TypeVar("Label", bound=Hashable)
+
+
+class KeywordMatcher(Generic[Label]):
+    """
+    Aho-Corasick automaton over a table of labelled keywords, e.g.
+    `{"home_airport": ["airport", "depart from"], ...}`.
+    Finds the labels of every keyword contained in a text in one pass over the text,
+    whatever the number of keywords. Matches are substring matches, like `keyword in text`.
+    """
+
+    def __init__(self, keywords: Mapping[Label, Iterable[str]], case_sensitive: bool = False):
+        self.case_sensitive = case_sensitive
+        # Trie transitions, failure links and labels matched by each state
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._labels: List[FrozenSet[Label]] = [frozenset()]
+
+        for label, label_keywords in keywords.items():
+            for keyword in label_keywords:
+                self._add(self._normalize(keyword), label)
+        self._link()
+
+    def _normalize(self, text: str) -> str:
+        return text if self.case_sensitive else text.lower()
+
+    def _add(self, keyword: str, label: Label) -> None:
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._labels.append(frozenset())
+            state = next_state
+        self._labels[state] = self._labels[state] | {label}
+
+    def _link(self) -> None:
+        """
+        Set the failure links breadth-first, a state also matches the labels of the
+        longest suffix it fails to.
+        """
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._labels[next_state] = self._labels[next_state] | self._labels[self._fail[next_state]]
+                queue.append(next_state)
+
+    def find(self, text: str) -> Set[Label]:
+        """
+        Labels of all keywords found in the text.
+        """
+        goto, fail, labels = self._goto, self._fail, self._labels
+        found: Set[Label] = set()
+        state = 0
+        for char in self._normalize(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if labels[state]:
+                found |= labels[state]
+        return found
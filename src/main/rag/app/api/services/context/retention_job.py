@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from app.db.database import (
+    RETENTION_LOCK,
+    ChatSession,
+    Message,
+    TemporaryStorage,
+    atry_advisory_lock,
+)
+from app.db.memory_store import get_memory_store
+from app.api.services.context.context_cache import (
+    CHAT_HISTORY,
+    SESSION_CONTEXT,
+    get_context_cache,
+)
+from app.api.services.context.context_stage import run_in_background_pool, with_session
+
+logger = logging.getLogger(__name__)
+
+# Sessions without activity for this long lose their temporary memories and storage
+RETENTION_DAYS = float(os.getenv("TEMPORARY_RETENTION_DAYS", "30"))
+# Time between runs, 0 disables the job
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+# Sessions collected per batch, and the pause between batches
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "50"))
+RETENTION_BATCH_DELAY = float(os.getenv("RETENTION_BATCH_DELAY_SECONDS", "1"))
+
+
+class RetentionJob:
+    """
+    Background garbage collection of the session-temporary context.
+    - A session is stale once it had no message (or was created, if it has none) for
+      TEMPORARY_RETENTION_DAYS. Resuming a collected session makes it stale again later.
+    - The temporary memory vectors and the temporary_storage rows of stale sessions are
+      deleted RETENTION_BATCH_SIZE sessions at a time, pausing between batches so the
+      memory store and the database aren't flooded.
+    - Sessions are marked with expired_at once collected, and the reclaimed counts are
+      logged after each run.
+    - Every worker schedules the job, a run only goes ahead in the worker holding the
+      advisory lock, the others skip it.
+    """
+
+    _task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def start(cls) -> None:
+        if RETENTION_INTERVAL > 0 and cls._task is None:
+            cls._task = asyncio.create_task(cls._loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        await asyncio.gather(cls._task, return_exceptions=True)
+        cls._task = None
+
+    @classmethod
+    async def _loop(cls) -> None:
+        while True:
+            try:
+                await cls.run()
+            except Exception as e:
+                logger.error(f"Retention job failed: {e}")
+            await asyncio.sleep(RETENTION_INTERVAL)
+
+    @classmethod
+    async def run(cls) -> Dict[str, int]:
+        """
+        Collect all stale sessions, return the reclaimed counts.
+        """
+        reclaimed = {"sessions": 0, "vectors": 0, "temporary_storage": 0}
+        async with atry_advisory_lock(RETENTION_LOCK) as acquired:
+            if not acquired:
+                logger.info("Retention job is running in another worker, skipping this run")
+                return reclaimed
+            await cls._collect_stale_sessions(reclaimed)
+        logger.info(f"Retention job reclaimed {reclaimed}")
+        return reclaimed
+
+    @classmethod
+    async def _collect_stale_sessions(cls, reclaimed: Dict[str, int]) -> None:
+        cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+        while True:
+            sessions = await run_in_background_pool(
+                with_session, cls._get_stale_sessions, cutoff, RETENTION_BATCH_SIZE
+            )
+            if not sessions:
+                break
+            vectors, rows = await run_in_background_pool(with_session, cls._collect, sessions)
+            reclaimed["sessions"] += len(sessions)
+            reclaimed["vectors"] += vectors
+            reclaimed["temporary_storage"] += rows
+            if len(sessions) < RETENTION_BATCH_SIZE:
+                break
+            await asyncio.sleep(RETENTION_BATCH_DELAY)
+
+    @staticmethod
+    def _get_stale_sessions(cutoff: datetime, limit: int, db: Session) -> List[Tuple[int, int]]:
+        """
+        (session id, user id) of sessions inactive since the cutoff and not collected
+        since their last activity.
+        """
+        last_message = (
+            db.query(func.max(Message.created_at))
+            .filter(Message.session_id == ChatSession.id)
+            .correlate(ChatSession)
+            .scalar_subquery()
+        )
+        last_activity = func.coalesce(last_message, ChatSession.created_at)
+        rows: List[Tuple[int, int]] = (
+            db.query(ChatSession.id, ChatSession.user_id)
+            .filter(
+                last_activity < cutoff,
+                or_(ChatSession.expired_at.is_(None), ChatSession.expired_at < last_activity),
+            )
+            .order_by(ChatSession.id)
+            .limit(limit)
+            .all()
+        )
+        return [(session_id, user_id) for session_id, user_id in rows]
+
+    @staticmethod
+    def _collect(sessions: List[Tuple[int, int]], db: Session) -> Tuple[int, int]:
+        """
+        Delete the temporary vectors and rows of the sessions, return how many of each.
+        The vectors go first: if that fails, the sessions stay stale and are retried.
+        """
+        store = get_memory_store()
+        vectors = sum(store.delete_temporary(user_id, session_id) for session_id, user_id in sessions)
+
+        session_ids = [session_id for session_id, _ in sessions]
+        rows = (
+            db.query(TemporaryStorage)
+            .filter(TemporaryStorage.session_id.in_(session_ids))
+            .delete(synchronize_session=False)
+        )
+        db.query(ChatSession).filter(ChatSession.id.in_(session_ids)).update(
+            {ChatSession.expired_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.commit()
+
+        cache = get_context_cache()
+        for session_id in session_ids:
+            cache.invalidate(SESSION_CONTEXT, session_id)
+            cache.invalidate(CHAT_HISTORY, session_id)
+        return vectors, rows
@@ -2,7 +2,14 @@ from fastapi import Depends
 from app.db.database import get_db
 from app.db.database import PersistentStorage, TemporaryStorage
 from app.db.pinecone import search_embeddings
+from app.api.services.context.context_cache import (
+    SESSION_CONTEXT,
+    USER_CONTEXT,
+    get_context_cache,
+)
 import logging
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 # from llama_index.core.schema import ChatMessage
 from llama_index.core.llms import ChatMessage
@@ -20,7 +27,7 @@ class RetrieveUserContext:
     """
 
     @staticmethod
-    def retrieve_user_context(user_id: str, session_id: str, query: str, db: Session = Depends(get_db)) -> list:
+    def retrieve_user_context(user_id: int, session_id: int, query: str, db: Session = Depends(get_db)) -> list:
         """
         Retrieves:
         - Persistent storage for the user
@@ -30,17 +37,72 @@ class RetrieveUserContext:
         """
 
         # Step 1: Retrieve Persistent Storage (Long-term data)
-        persistent_entries = db.query(PersistentStorage).filter_by(user_id=user_id).all()
-        persistent_data = {entry.key: entry.value for entry in persistent_entries}
+        persistent_data = RetrieveUserContext.get_persistent_data(user_id, db)
 
         # Step 2: Retrieve Temporary Storage (Session-specific data)
-        temporary_entries = db.query(TemporaryStorage).filter_by(session_id=session_id).all()
-        temporary_data = {entry.key: entry.value for entry in temporary_entries}
+        temporary_data = RetrieveUserContext.get_temporary_data(session_id, db)
 
         # Step 3: Search Embeddings for Contextual Information
         embedding_results = search_embeddings(user_id, session_id, query, k=3)
 
         # Step 4: Format Context as a List of ChatMessage Objects
+        chat_messages = RetrieveUserContext.format_context(
+            persistent_data, temporary_data, embedding_results
+        )
+
+        logger.info(f"Retrieved context for user {user_id}, session {session_id}: {chat_messages}")
+
+        return chat_messages  # ✅ Returning as a list of ChatMessage objects
+
+    @staticmethod
+    def get_persistent_data(user_id: int, db: Session) -> dict:
+        cache = get_context_cache()
+        persistent_data = cache.get(USER_CONTEXT, user_id)
+        if persistent_data is None:
+            generation = cache.generation
+            persistent_entries = db.query(PersistentStorage).filter_by(user_id=user_id).all()
+            persistent_data = {entry.key: entry.value for entry in persistent_entries}
+            cache.fill(USER_CONTEXT, user_id, persistent_data, generation)
+        return persistent_data
+
+    @staticmethod
+    def get_temporary_data(session_id: int, db: Session) -> dict:
+        cache = get_context_cache()
+        temporary_data = cache.get(SESSION_CONTEXT, session_id)
+        if temporary_data is None:
+            generation = cache.generation
+            temporary_entries = db.query(TemporaryStorage).filter_by(session_id=session_id).all()
+            temporary_data = {entry.key: entry.value for entry in temporary_entries}
+            cache.fill(SESSION_CONTEXT, session_id, temporary_data, generation)
+        return temporary_data
+
+    @staticmethod
+    async def aget_persistent_data(user_id: int, db: AsyncSession) -> dict:
+        cache = get_context_cache()
+        persistent_data = cache.get(USER_CONTEXT, user_id)
+        if persistent_data is None:
+            generation = cache.generation
+            persistent_entries = await db.scalars(select(PersistentStorage).filter_by(user_id=user_id))
+            persistent_data = {entry.key: entry.value for entry in persistent_entries}
+            cache.fill(USER_CONTEXT, user_id, persistent_data, generation)
+        return persistent_data
+
+    @staticmethod
+    async def aget_temporary_data(session_id: int, db: AsyncSession) -> dict:
+        cache = get_context_cache()
+        temporary_data = cache.get(SESSION_CONTEXT, session_id)
+        if temporary_data is None:
+            generation = cache.generation
+            temporary_entries = await db.scalars(select(TemporaryStorage).filter_by(session_id=session_id))
+            temporary_data = {entry.key: entry.value for entry in temporary_entries}
+            cache.fill(SESSION_CONTEXT, session_id, temporary_data, generation)
+        return temporary_data
+
+    @staticmethod
+    def format_context(persistent_data: dict, temporary_data: dict, embedding_results: list) -> list:
+        """
+        Formats the retrieved data as a list of ChatMessage objects for the LLM.
+        """
         chat_messages = []
 
         # Add persistent storage messages
@@ -65,8 +127,6 @@ class RetrieveUserContext:
         if not chat_messages:
             chat_messages.append(ChatMessage(role="system", content="No user context available."))
 
-        logger.info(f"Retrieved context for user {user_id}, session {session_id}: {chat_messages}")
-
-        return chat_messages  # ✅ Returning as a list of ChatMessage objects
+        return chat_messages
 
     
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.db.database import (
+    CONTEXT_UPDATE_LOCK,
+    ContextUpdate,
+    SessionLocal,
+    advisory_xact_lock,
+)
+from app.db.pinecone import store_embeddings
+from app.api.services.context.context_cache import (
+    SESSION_CONTEXT,
+    USER_CONTEXT,
+    get_context_cache,
+)
+from app.api.services.context.context_stage import (
+    run_in_background_pool,
+    with_async_session,
+    with_session,
+)
+from app.api.services.context.update_session_context import UpdateSessionContext
+from app.api.services.context.update_user_preference import UpdateUserPreference
+
+logger = logging.getLogger(__name__)
+
+# Updates that keep failing are dropped after this many attempts
+MAX_ATTEMPTS = int(os.getenv("CONTEXT_UPDATE_MAX_ATTEMPTS", "5"))
+RETRY_DELAY = float(os.getenv("CONTEXT_UPDATE_RETRY_DELAY", "10"))
+
+
+class ContextUpdateQueue:
+    """
+    Durable write-behind queue for the post-turn context updates
+    (session context, user embeddings and user preferences).
+    - An update is stored in the `context_updates` table before the chat response is
+      returned and applied later by a worker task, so pending updates survive restarts.
+    - A user always maps to the same worker, and an advisory lock on the user is held
+      while their updates are applied, so they are applied in order across workers and
+      processes.
+    - A burst of updates from one user is applied in one go: the messages of a session
+      are classified and upserted to Pinecone with a single call.
+    """
+
+    _queues: List[asyncio.Queue] = []
+    _workers: List[asyncio.Task] = []
+    # Users waiting for a worker, new updates for them join the pending drain
+    _scheduled: Set[int] = set()
+
+    @classmethod
+    async def start(cls) -> None:
+        worker_count = int(os.getenv("CONTEXT_UPDATE_WORKERS", "4"))
+        cls._queues = [asyncio.Queue() for _ in range(worker_count)]
+        cls._workers = [asyncio.create_task(cls._work(queue)) for queue in cls._queues]
+
+        # Apply the updates left over from a previous run
+        for user_id in await run_in_background_pool(with_session, cls._get_pending_users):
+            cls._schedule(user_id)
+
+    @classmethod
+    async def stop(cls, timeout: float = 30) -> None:
+        """
+        Wait for the scheduled updates, the rest is applied on the next start.
+        """
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in cls._queues)), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Context updates still pending, they are applied on next start")
+        for worker in cls._workers:
+            worker.cancel()
+        await asyncio.gather(*cls._workers, return_exceptions=True)
+        cls._queues, cls._workers = [], []
+        cls._scheduled.clear()
+
+    @classmethod
+    async def enqueue(cls, user_id: int, session_id: int, message: str) -> None:
+        """
+        Store the update durably and schedule it, without waiting for it to be applied.
+        """
+        await with_async_session(cls._store_update, user_id, session_id, message)
+        cls._schedule(user_id)
+
+    @classmethod
+    def _schedule(cls, user_id: int) -> None:
+        if user_id in cls._scheduled or not cls._queues:
+            return
+        cls._scheduled.add(user_id)
+        cls._queues[user_id % len(cls._queues)].put_nowait(user_id)
+
+    @classmethod
+    async def _work(cls, queue: asyncio.Queue) -> None:
+        while True:
+            user_id = await queue.get()
+            cls._scheduled.discard(user_id)
+            try:
+                applied = await run_in_background_pool(cls._apply_pending_updates, user_id)
+                logger.info(f"Applied {applied} context updates for user {user_id}")
+            except Exception as e:
+                logger.error(f"Failed to apply context updates for user {user_id}: {e}")
+                # The updates stay in the table, retry them later
+                asyncio.get_running_loop().call_later(RETRY_DELAY, cls._schedule, user_id)
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    async def _store_update(user_id: int, session_id: int, message: str, db: AsyncSession) -> None:
+        db.add(ContextUpdate(user_id=user_id, session_id=session_id, message=message))
+        await db.commit()
+
+    @staticmethod
+    def _get_pending_users(db: Session) -> List[int]:
+        rows: List[Tuple[int]] = db.query(ContextUpdate.user_id).distinct().all()
+        return [user_id for (user_id,) in rows]
+
+    @staticmethod
+    def _get_updates(user_id: int, db: Session) -> List[ContextUpdate]:
+        return (
+            db.query(ContextUpdate)
+            .filter(ContextUpdate.user_id == user_id)
+            .order_by(ContextUpdate.id)
+            .all()
+        )
+
+    @staticmethod
+    def _apply_pending_updates(user_id: int) -> int:
+        """
+        Apply all pending updates of the user in order and remove them from the queue.
+        The session context and preference writes commit in the transaction holding the
+        user's lock, together with the updates' removal or their context_applied flag,
+        so a retry only stores the embeddings that failed.
+        """
+        db = SessionLocal()
+        try:
+            # Held until the updates are removed, so no other worker applies the same
+            # updates or overtakes them. An advisory lock rather than FOR UPDATE on the
+            # users row: the foreign key checks of the writes below and of enqueue()
+            # take a key share lock on that row and would wait for this transaction.
+            advisory_xact_lock(db, CONTEXT_UPDATE_LOCK, user_id)
+            updates = ContextUpdateQueue._get_updates(user_id, db)
+            if not updates:
+                return 0
+            session_ids = ContextUpdateQueue._pending_context_sessions(updates)
+            try:
+                ContextUpdateQueue._apply_context(user_id, updates, db)
+            except Exception:
+                # Nothing of this attempt is kept
+                db.rollback()
+                advisory_xact_lock(db, CONTEXT_UPDATE_LOCK, user_id)
+                ContextUpdateQueue._count_attempt(user_id, ContextUpdateQueue._get_updates(user_id, db), db)
+                db.commit()
+                raise
+            try:
+                ContextUpdateQueue._store_embeddings(user_id, updates)
+            except Exception:
+                # Commits the context writes, the updates stay queued for their embeddings
+                ContextUpdateQueue._count_attempt(user_id, updates, db)
+                db.commit()
+                ContextUpdateQueue._invalidate(user_id, session_ids)
+                raise
+            count = len(updates)
+            for update in updates:
+                db.delete(update)
+            db.commit()
+            ContextUpdateQueue._invalidate(user_id, session_ids)
+            return count
+        finally:
+            db.close()
+
+    @staticmethod
+    def _pending_context_sessions(updates: List[ContextUpdate]) -> Set[int]:
+        session_ids: Set[int] = set()
+        for update in updates:
+            session_id: int = update.session_id
+            if not update.context_applied:
+                session_ids.add(session_id)
+        return session_ids
+
+    @staticmethod
+    def _count_attempt(user_id: int, updates: List[ContextUpdate], db: Session) -> None:
+        for update in updates:
+            update.attempts += 1
+            if update.attempts >= MAX_ATTEMPTS:
+                logger.error(
+                    f"Dropping context update {update.id} for user {user_id} "
+                    f"after {update.attempts} attempts"
+                )
+                db.delete(update)
+
+    @staticmethod
+    def _apply_context(user_id: int, updates: List[ContextUpdate], db: Session) -> None:
+        """
+        Merge the session context and preferences of the updates not applied yet,
+        without committing.
+        """
+        for update in updates:
+            if update.context_applied:
+                continue
+            session_id: int = update.session_id
+            message: str = update.message
+            UpdateSessionContext.update_session_context_by_id(session_id, message, db, commit=False)
+            UpdateUserPreference.update_user_preferences_by_id(user_id, message, db, commit=False)
+            update.context_applied = True
+
+    @staticmethod
+    def _store_embeddings(user_id: int, updates: List[ContextUpdate]) -> None:
+        messages_by_session: Dict[int, List[str]] = {}
+        for update in updates:
+            session_id: int = update.session_id
+            message: str = update.message
+            messages_by_session.setdefault(session_id, []).append(message)
+
+        # One classification call and upsert per session instead of one per message.
+        # Called directly rather than through the UpdateUserEmbeddings tool, which reports
+        # errors as its result: a failure must raise so the updates are retried. Memory
+        # ids are content hashes, storing a message again doesn't duplicate it.
+        for session_id, messages in messages_by_session.items():
+            store_embeddings(user_id, session_id, "\n".join(messages))
+
+    @staticmethod
+    def _invalidate(user_id: int, session_ids: Set[int]) -> None:
+        """
+        Drop the cached context the committed writes changed, it's reloaded on next read.
+        """
+        if not session_ids:
+            return
+        cache = get_context_cache()
+        cache.invalidate(USER_CONTEXT, user_id)
+        for session_id in session_ids:
+            cache.invalidate(SESSION_CONTEXT, session_id)
@@ -1,7 +1,10 @@
 from fastapi import Depends
 from sqlalchemy.orm import Session
-from app.db.database import get_db
+from typing import Dict, List, Tuple
+from app.db.database import get_db, upsert
 from app.db.database import TemporaryStorage, ChatSession  # Ensure correct import paths
+from app.api.services.context.keyword_matcher import KeywordMatcher
+from app.api.services.context.context_cache import SESSION_CONTEXT, get_context_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,23 +32,52 @@ class UpdateSessionContext:
         "chatting_preference": ["summarize", "detailed response"]
     }
 
+    # Keyword pairs of contradicting values, the new value replaces the existing one
+    CONTRADICTORY_KEYWORDS = [
+        ("cheap", "expensive"),
+        ("budget", "luxury"),
+        ("economy", "first class"),
+        ("short trip", "long vacation"),
+        ("direct flight", "layover"),
+        ("basic", "premium"),
+    ]
+
+    # Compiled once, extraction and merging scan a message once whatever the table sizes
+    _keyword_matcher = KeywordMatcher(TEMP_STORAGE_KEYS)
+    _contradiction_matcher = KeywordMatcher(
+        {keyword: [keyword] for pair in CONTRADICTORY_KEYWORDS for keyword in pair},
+        case_sensitive=True,
+    )
+
     @staticmethod
     def update_session_context(session: ChatSession, message: str, db: Session= Depends(get_db)):
         """
         Automatically updates session-specific temporary storage based on chat input.
         """
+        return UpdateSessionContext.update_session_context_by_id(session.id, message, db)
 
+    @staticmethod
+    def update_session_context_by_id(
+        session_id: int, message: str, db: Session = Depends(get_db), commit: bool = True
+    ):
+        """
+        Same as update_session_context, for callers that only hold the session ID
+        (e.g. worker threads that can't share the request's ORM objects).
+        With commit=False the write joins the caller's transaction, see update_storage_bulk.
+        """
         extracted_prefs = UpdateSessionContext.extract_preferences_from_message(message)
         
         if not extracted_prefs:
             return "No relevant temporary storage updates found in the message."
 
-        for key, new_value in extracted_prefs.items():
-            existing_value = UpdateSessionContext.get_existing_value(session.id, key, db)
-            merged_value = UpdateSessionContext.merge_values(key, existing_value, new_value)
+        existing_values = UpdateSessionContext.get_existing_values(session_id, list(extracted_prefs), db)
+        merged_values = {
+            key: UpdateSessionContext.merge_values(key, existing_values.get(key), new_value)
+            for key, new_value in extracted_prefs.items()
+        }
 
-            # Insert or update the database
-            UpdateSessionContext.update_storage(session.id, key, merged_value, db)
+        # Insert or update all keys in one statement and transaction
+        UpdateSessionContext.update_storage_bulk(session_id, merged_values, db, commit)
         
         return f"Updated temporary storage: {extracted_prefs}"
 
@@ -55,24 +87,20 @@ class UpdateSessionContext:
         """
         Extracts relevant temporary storage values from user messages dynamically.
         """
-        message_lower = message.lower()
-        extracted_prefs = {}
-
-        for key, keywords in UpdateSessionContext.TEMP_STORAGE_KEYS.items():
-            for keyword in keywords:
-                if keyword in message_lower:
-                    extracted_prefs[key] = message
-                    break  # Stop checking once a match is found
-
-        return extracted_prefs
+        matched_keys = UpdateSessionContext._keyword_matcher.find(message)
+        return {key: message for key in UpdateSessionContext.TEMP_STORAGE_KEYS if key in matched_keys}
 
     @staticmethod
-    def get_existing_value(session_id: int, key: str, db: Session= Depends(get_db)):
+    def get_existing_values(session_id: int, keys: List[str], db: Session= Depends(get_db)) -> Dict[str, str]:
         """
-        Retrieves the existing stored value from temporary storage.
+        Retrieves the existing stored values of the given keys in one query.
         """
-        existing_entry = db.query(TemporaryStorage).filter_by(session_id=session_id, key=key).first()
-        return existing_entry.value if existing_entry else None
+        entries: List[Tuple[str, str]] = (
+            db.query(TemporaryStorage.key, TemporaryStorage.value)
+            .filter(TemporaryStorage.session_id == session_id, TemporaryStorage.key.in_(keys))
+            .all()
+        )
+        return {key: value for key, value in entries}
 
     @staticmethod
     def merge_values(key: str, existing_value: str, new_value: str) -> str:
@@ -86,18 +114,11 @@ class UpdateSessionContext:
             return new_value  # ✅ Store directly if no prior data
 
         # **Auto-detect contradictions based on opposites**
-        contradictory_keywords = [
-            ("cheap", "expensive"),
-            ("budget", "luxury"),
-            ("economy", "first class"),
-            ("short trip", "long vacation"),
-            ("direct flight", "layover"),
-            ("basic", "premium"),
-        ]
-
         # **Check if existing value contains a contradiction**
-        for old_value, new_option in contradictory_keywords:
-            if old_value in existing_value and new_option in new_value:
+        existing_keywords = UpdateSessionContext._contradiction_matcher.find(existing_value)
+        new_keywords = UpdateSessionContext._contradiction_matcher.find(new_value)
+        for old_value, new_option in UpdateSessionContext.CONTRADICTORY_KEYWORDS:
+            if old_value in existing_keywords and new_option in new_keywords:
                 return new_value  # ✅ Replace conflicting value
 
         existing_values = set(existing_value.split(", "))
@@ -117,18 +138,22 @@ class UpdateSessionContext:
 
 
     @staticmethod
-    def update_storage(session_id: int, key: str, value: str, db: Session= Depends(get_db)):
+    def update_storage_bulk(
+        session_id: int, values: Dict[str, str], db: Session = Depends(get_db), commit: bool = True
+    ):
         """
-        Inserts or updates temporary storage in the database.
+        Inserts or updates several keys of the temporary storage with a single upsert.
+        With commit=False the caller commits and then invalidates the cached session context.
         """
-        existing_entry = db.query(TemporaryStorage).filter_by(session_id=session_id, key=key).first()
-
-        if existing_entry:
-            existing_entry.value = value  # Update
-        else:
-            new_entry = TemporaryStorage(session_id=session_id, key=key, value=value)
-            db.add(new_entry)
-
+        upsert(
+            db,
+            TemporaryStorage,
+            [{"session_id": session_id, "key": key, "value": value} for key, value in values.items()],
+            index_elements=["session_id", "key"],
+            update_columns=["value"],
+        )
+        if not commit:
+            return
         db.commit()
-        logger.info(f"Updated temporary storage '{key}' for session {session_id}: {value}")
-
+        get_context_cache().update_many(SESSION_CONTEXT, session_id, values)
+        logger.info(f"Updated temporary storage for session {session_id}: {values}")
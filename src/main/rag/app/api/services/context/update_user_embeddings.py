@@ -12,8 +12,8 @@ class UpdateUserEmbeddings:
     def update_user_embeddings(user_id: str, session_id: str, message: str):
         """
         Updates the user's persistent and temporary embeddings in Pinecone based on the chat input.
-        - Persistent vectors -> Indexed as "{user_id}-persistent-{i}"
-        - Temporary vectors -> Indexed as "{user_id}-{session_id}-temp-{i}"
+        - Persistent vectors -> Indexed as "{user_id}-persistent-{hash}"
+        - Temporary vectors -> Indexed as "{user_id}-{session_id}-temp-{hash}"
         """
         try:
             store_embeddings(user_id, session_id, message)
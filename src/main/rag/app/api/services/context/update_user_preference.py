@@ -1,9 +1,13 @@
 import logging
+from datetime import datetime
+from typing import Dict, List, Tuple
 
 from app.db.database import PersistentStorage, User  # Ensure correct imports
 from fastapi import Depends
 from sqlalchemy.orm import Session
-from app.db.database import get_db
+from app.db.database import get_db, upsert
+from app.api.services.context.keyword_matcher import KeywordMatcher
+from app.api.services.context.context_cache import USER_CONTEXT, get_context_cache
 
 logger = logging.getLogger(__name__)
 
@@ -20,23 +24,52 @@ class UpdateUserPreference:
         "loyalty_programmes": ["loyalty program", "frequent flyer", "membership", "reward points"],
     }
 
+    # Keyword pairs of contradicting values, the new value replaces the existing one
+    CONTRADICTORY_KEYWORDS = [
+        ("cheap", "expensive"),
+        ("budget", "luxury"),
+        ("economy", "first class"),
+        ("short trip", "long vacation"),
+        ("direct flight", "layover"),
+        ("basic", "premium"),
+    ]
+
+    # Compiled once, extraction and merging scan a message once whatever the table sizes
+    _keyword_matcher = KeywordMatcher(PREFERENCE_KEYS)
+    _contradiction_matcher = KeywordMatcher(
+        {keyword: [keyword] for pair in CONTRADICTORY_KEYWORDS for keyword in pair},
+        case_sensitive=True,
+    )
+
     @staticmethod
     def update_user_preferences(user: User, message: str, db: Session = Depends(get_db)):
         """
         Automatically updates user travel preferences based on chat input.
         """
+        return UpdateUserPreference.update_user_preferences_by_id(user.id, message, db)
 
+    @staticmethod
+    def update_user_preferences_by_id(
+        user_id: int, message: str, db: Session = Depends(get_db), commit: bool = True
+    ):
+        """
+        Same as update_user_preferences, for callers that only hold the user ID
+        (e.g. worker threads that can't share the request's ORM objects).
+        With commit=False the write joins the caller's transaction, see update_persistent_storage_bulk.
+        """
         extracted_prefs = UpdateUserPreference.extract_preferences_from_message(message)
         
         if not extracted_prefs:
             return "No relevant preferences found in the message."
 
-        for key, new_value in extracted_prefs.items():
-            existing_value = UpdateUserPreference.get_existing_preference(user.id, key, db)
-            merged_value = UpdateUserPreference.merge_preferences(key, existing_value, new_value)
+        existing_values = UpdateUserPreference.get_existing_preferences(user_id, list(extracted_prefs), db)
+        merged_values = {
+            key: UpdateUserPreference.merge_preferences(key, existing_values.get(key), new_value)
+            for key, new_value in extracted_prefs.items()
+        }
 
-            # Insert or update the database
-            UpdateUserPreference.update_persistent_storage(user.id, key, merged_value, db)
+        # Insert or update all keys in one statement and transaction
+        UpdateUserPreference.update_persistent_storage_bulk(user_id, merged_values, db, commit)
         
         return f"Updated preferences: {extracted_prefs}"
 
@@ -45,24 +78,20 @@ class UpdateUserPreference:
         """
         Extracts travel-related preferences from user messages dynamically.
         """
-        message_lower = message.lower()
-        extracted_prefs = {}
-
-        for key, keywords in UpdateUserPreference.PREFERENCE_KEYS.items():
-            for keyword in keywords:
-                if keyword in message_lower:
-                    extracted_prefs[key] = message
-                    break  # Stop checking once a match is found
-
-        return extracted_prefs
+        matched_keys = UpdateUserPreference._keyword_matcher.find(message)
+        return {key: message for key in UpdateUserPreference.PREFERENCE_KEYS if key in matched_keys}
 
     @staticmethod
-    def get_existing_preference(user_id: int, key: str, db: Session= Depends(get_db)):
+    def get_existing_preferences(user_id: int, keys: List[str], db: Session= Depends(get_db)) -> Dict[str, str]:
         """
-        Retrieves the existing stored preference from the database.
+        Retrieves the existing stored preferences of the given keys in one query.
         """
-        existing_entry = db.query(PersistentStorage).filter_by(user_id=user_id, key=key).first()
-        return existing_entry.value if existing_entry else None
+        entries: List[Tuple[str, str]] = (
+            db.query(PersistentStorage.key, PersistentStorage.value)
+            .filter(PersistentStorage.user_id == user_id, PersistentStorage.key.in_(keys))
+            .all()
+        )
+        return {key: value for key, value in entries}
 
     @staticmethod
     def merge_preferences(key: str, existing_value: str, new_value: str) -> str:
@@ -76,17 +105,10 @@ class UpdateUserPreference:
             return new_value  # Store directly if no prior data
 
         # ✅ Detect contradictions dynamically
-        contradictory_keywords = [
-            ("cheap", "expensive"),
-            ("budget", "luxury"),
-            ("economy", "first class"),
-            ("short trip", "long vacation"),
-            ("direct flight", "layover"),
-            ("basic", "premium"),
-        ]
-
-        for old_value, new_option in contradictory_keywords:
-            if old_value in existing_value and new_option in new_value:
+        existing_keywords = UpdateUserPreference._contradiction_matcher.find(existing_value)
+        new_keywords = UpdateUserPreference._contradiction_matcher.find(new_value)
+        for old_value, new_option in UpdateUserPreference.CONTRADICTORY_KEYWORDS:
+            if old_value in existing_keywords and new_option in new_keywords:
                 return new_value  # ✅ Replace conflicting value
 
         existing_values = set(existing_value.split(", "))
@@ -103,18 +125,26 @@ class UpdateUserPreference:
         return ", ".join(sorted(merged_values))
 
     @staticmethod
-    def update_persistent_storage(user_id: int, key: str, value: str, db: Session= Depends(get_db)):
+    def update_persistent_storage_bulk(
+        user_id: int, values: Dict[str, str], db: Session = Depends(get_db), commit: bool = True
+    ):
         """
-        Inserts or updates the persistent storage in the database.
+        Inserts or updates several keys of the persistent storage with a single upsert.
+        With commit=False the caller commits and then invalidates the cached user context.
         """
-        existing_entry = db.query(PersistentStorage).filter_by(user_id=user_id, key=key).first()
-
-        if existing_entry:
-            existing_entry.value = value  # Update
-        else:
-            new_entry = PersistentStorage(user_id=user_id, key=key, value=value)
-            db.add(new_entry)
-
+        now = datetime.utcnow()
+        upsert(
+            db,
+            PersistentStorage,
+            [
+                {"user_id": user_id, "key": key, "value": value, "updated_at": now}
+                for key, value in values.items()
+            ],
+            index_elements=["user_id", "key"],
+            update_columns=["value", "updated_at"],
+        )
+        if not commit:
+            return
         db.commit()
-        logger.info(f"Updated {key} for user {user_id}: {value}")
-
+        get_context_cache().update_many(USER_CONTEXT, user_id, values)
+        logger.info(f"Updated preferences for user {user_id}: {values}")
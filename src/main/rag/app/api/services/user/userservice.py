@@ -1,7 +1,10 @@
 from fastapi import HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
-from app.db.database import get_db, User
+from app.db.database import get_async_db, get_db, User
 from app.api.services.authentication.authservice import AuthService
 from fastapi import APIRouter, Depends
 from datetime import timedelta
@@ -25,3 +28,25 @@ class UserService:
             raise HTTPException(status_code=400, detail="Invalid username or password")
         access_token = AuthService.create_access_token({"sub": user.id}, timedelta(minutes=30))
         return {"access_token": access_token, "token_type": "bearer"}
+
+    @staticmethod
+    async def aregister_user(username: str, password: str, db: AsyncSession = Depends(get_async_db)):
+        existing_user = await db.scalar(select(User).where(User.username == username))
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Username already exists")
+        # bcrypt is slow on purpose, keep it off the event loop
+        hashed_password = await run_in_threadpool(AuthService.get_password_hash, password)
+        new_user = User(username=username, hashed_password=hashed_password)
+        db.add(new_user)
+        await db.commit()
+        return {"message": "User registered successfully"}
+
+    @staticmethod
+    async def alogin_user(form_data: OAuth2PasswordRequestForm, db: AsyncSession = Depends(get_async_db)):
+        user = await db.scalar(select(User).where(User.username == form_data.username))
+        if not user or not await run_in_threadpool(
+            AuthService.verify_password, form_data.password, user.hashed_password
+        ):
+            raise HTTPException(status_code=400, detail="Invalid username or password")
+        access_token = AuthService.create_access_token({"sub": user.id}, timedelta(minutes=30))
+        return {"access_token": access_token, "token_type": "bearer"}
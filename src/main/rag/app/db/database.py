@@ -1,19 +1,34 @@
 import os
+import threading
+from contextlib import asynccontextmanager
 from datetime import datetime
-
-from sqlalchemy import (Column, DateTime, ForeignKey, Integer, String,
-                        Text, create_engine)
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from typing import AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import (JSON, Boolean, Column, DateTime, ForeignKey, Integer, String,
+                        Text, UniqueConstraint, create_engine, text)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession, async_sessionmaker,
+                                    create_async_engine)
+from sqlalchemy.orm import Session, declarative_base, relationship, sessionmaker
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Sync engine, used by scripts and by the background workers
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Async drivers for the sync drivers of DATABASE_URL, aiosqlite is installed with the
+# `sqlite` extra
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
 # # User Model
 # class User(Base):
 #     __tablename__ = "users"
@@ -62,6 +77,13 @@ class ChatSession(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # IDs of the documents uploaded in the session, for clients that don't resend them
+    document_ids = Column(JSON, nullable=False, default=list)
+    # Summary of the turns up to summary_message_id, kept by the HistoryCompactor
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(Integer, nullable=True)
+    # When the temporary memories of the session were collected by the RetentionJob
+    expired_at = Column(DateTime, nullable=True)
 
     user = relationship("User", back_populates="chat_sessions")
     messages = relationship("Message", back_populates="session")
@@ -98,6 +120,7 @@ class Response(Base):
 # Persistent Storage Model
 class PersistentStorage(Base):
     __tablename__ = "persistent_storage"
+    __table_args__ = (UniqueConstraint("user_id", "key"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -111,6 +134,7 @@ class PersistentStorage(Base):
 # Temporary Storage Model
 class TemporaryStorage(Base):
     __tablename__ = "temporary_storage"
+    __table_args__ = (UniqueConstraint("session_id", "key"),)
 
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False)
@@ -120,6 +144,19 @@ class TemporaryStorage(Base):
 
     session = relationship("ChatSession", back_populates="temporary_storage")
 
+# Context Update Model (write-behind queue for the post-turn context updates)
+class ContextUpdate(Base):
+    __tablename__ = "context_updates"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False)
+    message = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    # The session context and preferences are merged, only the embeddings are pending
+    context_applied = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 
 # Create tables
 def init_db():
@@ -132,3 +169,114 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Dialects supporting INSERT ... ON CONFLICT DO UPDATE
+UPSERT_DIALECTS = {
+    "postgresql": postgresql,
+    "sqlite": sqlite,
+}
+
+
+def upsert(db: Session, model, rows: List[Dict], index_elements: List[str], update_columns: List[str]) -> None:
+    """
+    Insert the rows, or update the given columns of the rows that already exist,
+    in a single `INSERT ... ON CONFLICT DO UPDATE` statement.
+    `index_elements` must be covered by a unique constraint of the model.
+    """
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name not in UPSERT_DIALECTS:
+        raise ValueError(f"Upsert is not supported on {dialect_name}")
+    statement = UPSERT_DIALECTS[dialect_name].insert(model).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: statement.excluded[column] for column in update_columns},
+    )
+    db.execute(statement)
+
+
+# First key of the advisory locks, so the locks of different jobs never collide
+CONTEXT_UPDATE_LOCK = 1
+RETENTION_LOCK = 2
+
+
+def advisory_xact_lock(db: Session, namespace: int, key: int) -> None:
+    """
+    Lock (namespace, key) across processes until the transaction ends. Unlike a row
+    lock it doesn't conflict with the key share locks of the foreign key checks.
+    Only Postgres has advisory locks, sqlite serializes the writers anyway.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:namespace, :key)"),
+            {"namespace": namespace, "key": key},
+        )
+
+
+def get_async_database_url() -> str:
+    """
+    ASYNC_DATABASE_URL if set, otherwise DATABASE_URL with the matching async driver,
+    e.g. postgresql://... -> postgresql+asyncpg://...
+    """
+    async_database_url = os.getenv("ASYNC_DATABASE_URL")
+    if async_database_url:
+        return async_database_url
+    url = make_url(DATABASE_URL)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver for {url.get_backend_name()}, set ASYNC_DATABASE_URL")
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+_async_engine: Optional[AsyncEngine] = None
+_async_session_factory: Optional[async_sessionmaker] = None
+_async_engine_lock = threading.Lock()
+
+
+def get_async_engine() -> AsyncEngine:
+    """
+    Async engine for the request handlers. Created on first use,
+    so scripts that only use the sync engine don't need the async driver.
+    """
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        with _async_engine_lock:
+            if _async_engine is None:
+                _async_engine = create_async_engine(get_async_database_url())
+                _async_session_factory = async_sessionmaker(
+                    _async_engine, autoflush=False, expire_on_commit=False
+                )
+    return _async_engine
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    get_async_engine()
+    return _async_session_factory()
+
+
+@asynccontextmanager
+async def atry_advisory_lock(namespace: int, key: int = 0) -> AsyncIterator[bool]:
+    """
+    Try to lock (namespace, key) across processes for the duration of the block,
+    yield whether it was acquired. The lock is held by a dedicated connection, so it
+    spans the transactions of the block. Without Postgres it's always acquired.
+    """
+    if engine.dialect.name != "postgresql":
+        yield True
+        return
+    params = {"namespace": namespace, "key": key}
+    async with get_async_engine().connect() as connection:
+        acquired = bool(
+            await connection.scalar(text("SELECT pg_try_advisory_lock(:namespace, :key)"), params)
+        )
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await connection.execute(text("SELECT pg_advisory_unlock(:namespace, :key)"), params)
+
+
+# Dependency to get an async database session
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,159 @@
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.api.services.context.keyword_matcher import KeywordMatcher
+from app.db.memory_store import get_memory_store
+
+logger = logging.getLogger(__name__)
+
+# hybrid: local fast path, LLM for low-confidence messages; local: never the LLM; llm: always the LLM
+CLASSIFIER_MODE = os.getenv("MEMORY_CLASSIFIER", "hybrid")
+# Messages with a sentence scored below this confidence (0 to 1) go to the LLM in hybrid mode.
+# Raising it sends more messages to the LLM, lowering it keeps more on the fast path.
+MIN_CONFIDENCE = float(os.getenv("MEMORY_CLASSIFIER_MIN_CONFIDENCE", "0.6"))
+# Log the fast path ratio every this many messages
+STATS_LOG_INTERVAL = 100
+
+# Steepness of the persistence score over the similarity margin of the prototypes
+SIMILARITY_SCALE = 20.0
+# Below this many words the prototype similarity says little, such sentences are only
+# scored confidently by a cue phrase
+MIN_SENTENCE_WORDS = 3
+
+
+class MemoryClassifier:
+    """
+    Local fast path of the memory extraction: splits a message into sentences and scores
+    each one for persistence (1 for facts about the user that hold across sessions, 0 for
+    the current trip), with cue phrases first and the embedding similarity to prototype
+    sentences otherwise. The sentences are embedded like the memories, so storing them
+    afterwards hits the embedding cache.
+    """
+
+    PERSISTENT_CUES = [
+        "i am a", "i'm a", "i am an", "i'm an", "my name is", "i work", "i live", "i always",
+        "i usually", "i never", "i often", "i love", "i like", "i enjoy", "i hate", "i prefer",
+        "i don't like", "i can't stand", "i'm allergic", "i am allergic", "allergic to",
+        "i'm vegetarian", "i am vegetarian", "i'm vegan", "i am vegan", "my wife", "my husband",
+        "my partner", "my kids", "my children", "my family", "my dog", "in general", "every time",
+    ]
+    TEMPORARY_CUES = [
+        "this trip", "this time", "next week", "next month", "this weekend", "tomorrow", "tonight",
+        "today", "right now", "for now", "find me", "book", "looking for", "can you", "could you",
+        "show me", "how much", "i need", "i want to go", "we want to go", "flight to", "hotel in",
+        "on monday", "on tuesday", "on wednesday", "on thursday", "on friday", "on saturday",
+        "on sunday", "in january", "in february", "in march", "in april", "in may", "in june",
+        "in july", "in august", "in september", "in october", "in november", "in december",
+    ]
+    PERSISTENT_PROTOTYPES = [
+        "I am a software engineer and I love coding.",
+        "I always fly with the same airline.",
+        "I prefer window seats on long flights.",
+        "I'm vegetarian and allergic to nuts.",
+        "I travel with my wife and two kids.",
+        "I don't like crowded tourist places.",
+        "I usually stay in boutique hotels.",
+    ]
+    TEMPORARY_PROTOTYPES = [
+        "Find me a flight to Rome next Friday.",
+        "For this trip we want a hotel near the beach.",
+        "I need a rental car for three days.",
+        "How much is a ticket to Lisbon in May?",
+        "We land at 6pm, can you book a transfer?",
+        "Show me museums to visit tomorrow.",
+        "This time I'd like to try something different.",
+    ]
+
+    # Cue phrases match whole words, the sentences are padded with spaces
+    _cue_matcher = KeywordMatcher(
+        {
+            1.0: [f" {cue} " for cue in PERSISTENT_CUES],
+            0.0: [f" {cue} " for cue in TEMPORARY_CUES],
+        }
+    )
+    _prototypes: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    _prototypes_lock = threading.Lock()
+    _stats = {"fast_path": 0, "fallback": 0}
+    _stats_lock = threading.Lock()
+
+    @staticmethod
+    def split_sentences(message: str) -> List[str]:
+        sentences = re.split(r"(?<=[.!?;])\s+|\n+", message)
+        return [sentence.strip() for sentence in sentences if sentence.strip()]
+
+    @classmethod
+    def classify(cls, message: str) -> Tuple[List[Dict[str, Any]], float]:
+        """
+        Phrases of the message with their persistence score, and the confidence of the
+        least confident one.
+        """
+        sentences = cls.split_sentences(message)
+        if not sentences:
+            return [], 1.0
+
+        scores: Dict[int, Tuple[float, float]] = {}
+        unmatched = []
+        for i, sentence in enumerate(sentences):
+            words = re.sub(r"[^a-z0-9']+", " ", sentence.lower())
+            labels = cls._cue_matcher.find(f" {words} ")
+            if len(labels) == 1:
+                scores[i] = (next(iter(labels)), 1.0)
+            else:
+                unmatched.append(i)
+
+        if unmatched:
+            persistent, temporary = cls._get_prototypes()
+            embeddings = cls._normalize(
+                get_memory_store().embed([sentences[i] for i in unmatched], input_type="passage")
+            )
+            margins = (embeddings @ persistent.T).max(axis=1) - (embeddings @ temporary.T).max(axis=1)
+            for i, margin in zip(unmatched, margins):
+                persistence = float(1 / (1 + np.exp(-SIMILARITY_SCALE * margin)))
+                confidence = abs(2 * persistence - 1)
+                if len(sentences[i].split()) < MIN_SENTENCE_WORDS:
+                    # e.g. "Vegan here.", left to the LLM in hybrid mode
+                    confidence = 0.0
+                scores[i] = (round(persistence, 2), confidence)
+
+        phrases = [
+            {"phrase": sentence, "persistence": scores[i][0]}
+            for i, sentence in enumerate(sentences)
+        ]
+        return phrases, min(confidence for _, confidence in scores.values())
+
+    @classmethod
+    def _get_prototypes(cls) -> Tuple[np.ndarray, np.ndarray]:
+        if cls._prototypes is None:
+            with cls._prototypes_lock:
+                if cls._prototypes is None:
+                    embeddings = cls._normalize(
+                        get_memory_store().embed(
+                            cls.PERSISTENT_PROTOTYPES + cls.TEMPORARY_PROTOTYPES, input_type="passage"
+                        )
+                    )
+                    split = len(cls.PERSISTENT_PROTOTYPES)
+                    cls._prototypes = (embeddings[:split], embeddings[split:])
+        return cls._prototypes
+
+    @staticmethod
+    def _normalize(embeddings: List[List[float]]) -> np.ndarray:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    @classmethod
+    def record(cls, fast_path: bool) -> None:
+        """
+        Count a message classified on the fast path or by the LLM fallback.
+        """
+        with cls._stats_lock:
+            cls._stats["fast_path" if fast_path else "fallback"] += 1
+            total = cls._stats["fast_path"] + cls._stats["fallback"]
+            fast_path_count = cls._stats["fast_path"]
+        if total % STATS_LOG_INTERVAL == 0:
+            logger.info(f"Memory classifier: {fast_path_count}/{total} messages on the fast path")
@@ -0,0 +1,384 @@
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+import numpy as np
+
+from app.embedding_batcher import get_embedding_batcher
+from app.embedding_cache import get_embedding_cache
+
+logger = logging.getLogger(__name__)
+
+PINECONE_INDEX_NAME = "chatbot-memory"
+PINECONE_NAMESPACE = "ns1"
+PINECONE_EMBED_MODEL = "llama-text-embed-v2"
+
+
+class MemoryStore(ABC):
+    """
+    Vector store of the user memories extracted from chat messages.
+    A memory has an `id` and `values`, and its metadata holds `text`, `type`
+    ("persistent" or "temporary"), `user_id`, `session_id` and `persistence_score`.
+    """
+
+    # Model part of the embedding cache keys, None if the embeddings aren't cached
+    # or batched here
+    cache_model: Optional[str] = None
+
+    def embed(self, texts: List[str], input_type: str = "passage") -> List[List[float]]:
+        """
+        Embed texts for storage (`passage`) or search (`query`).
+        The texts missing from the cache are batched with those of concurrent callers.
+        """
+        if not self.cache_model:
+            return self._embed(texts, input_type)
+
+        batcher = get_embedding_batcher()
+
+        def embed_missing(missing: List[str]) -> List[List[float]]:
+            if batcher is None:
+                return self._embed(missing, input_type)
+            return batcher.embed(
+                (self.cache_model, input_type), missing, lambda batch: self._embed(batch, input_type)
+            )
+
+        cache = get_embedding_cache()
+        if cache is None:
+            return embed_missing(texts)
+        return cache.embed(self.cache_model, input_type, texts, embed_missing)
+
+    @abstractmethod
+    def _embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        """
+        Embed texts with the backend's model, without the cache and the batcher.
+        """
+
+    @abstractmethod
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        """
+        Insert the memories, replacing those with the same id.
+        """
+
+    @abstractmethod
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        """
+        The ids of the list that are stored.
+        """
+
+    @abstractmethod
+    def delete_temporary(self, user_id: int, session_id: int) -> int:
+        """
+        Delete the temporary memories of the session, return how many were deleted.
+        """
+
+    def query(self, vector: List[float], user_id: int, session_id: int, top_k: int) -> List[Dict[str, Any]]:
+        """
+        Metadata of the top_k memories closest to the vector, among the persistent
+        memories of the user and the temporary memories of the user's session.
+        """
+        return [match["metadata"] for match in self.query_matches(vector, user_id, session_id, top_k)]
+
+    @abstractmethod
+    def query_matches(self, vector: List[float], user_id: int, session_id: int, top_k: int) -> List[Dict[str, Any]]:
+        """
+        Like query, with the `id`, the cosine similarity `score` and the `metadata` of each match.
+        """
+
+
+class PineconeMemoryStore(MemoryStore):
+    """
+    Memories in the hosted Pinecone index, embedded with Pinecone inference.
+    """
+
+    cache_model = f"pinecone:{PINECONE_EMBED_MODEL}"
+
+    def __init__(self):
+        from pinecone import Pinecone
+
+        self._pc = Pinecone(api_key=os.getenv("PINECONE_API"), environment="us-east-1")
+        self._index = self._pc.Index(PINECONE_INDEX_NAME)
+
+    def _embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        embeddings = self._pc.inference.embed(
+            model=PINECONE_EMBED_MODEL,
+            inputs=texts,
+            parameters={"input_type": input_type},
+        )
+        return [embedding.values for embedding in embeddings]
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        self._index.upsert(vectors=vectors, namespace=PINECONE_NAMESPACE)
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        if not ids:
+            return set()
+        response = self._index.fetch(ids=ids, namespace=PINECONE_NAMESPACE)
+        return set(response.vectors.keys())
+
+    def delete_temporary(self, user_id: int, session_id: int) -> int:
+        # Serverless indexes can't delete by metadata, the temporary ids share a prefix
+        deleted = 0
+        for ids in self._index.list(prefix=f"{user_id}-{session_id}-temp-", namespace=PINECONE_NAMESPACE):
+            self._index.delete(ids=ids, namespace=PINECONE_NAMESPACE)
+            deleted += len(ids)
+        return deleted
+
+    def query_matches(self, vector: List[float], user_id: int, session_id: int, top_k: int) -> List[Dict[str, Any]]:
+        # Match only the persistent vectors of the user and the temporary vectors of the session
+        filter_conditions = {
+            "$or": [
+                {"user_id": user_id, "type": "persistent"},
+                {"user_id": user_id, "session_id": session_id, "type": "temporary"},
+            ]
+        }
+        search_results = self._index.query(
+            namespace=PINECONE_NAMESPACE,
+            vector=vector,
+            top_k=top_k,
+            include_metadata=True,
+            filter=filter_conditions,
+        )
+        return [
+            {"id": match["id"], "score": match["score"], "metadata": match["metadata"]}
+            for match in search_results["matches"]
+        ]
+
+
+class _LocalSnapshot(NamedTuple):
+    """
+    View of the first `count` local memories. New memories are written past the view and
+    then published as a new snapshot, so queries don't need a lock. A replaced memory is
+    overwritten in place, a query running at the same time may score it either way.
+    """
+
+    count: int
+    embeddings: np.ndarray  # (count, dim) float32, L2-normalized
+    user_ids: np.ndarray
+    session_ids: np.ndarray  # -1 if none
+    persistent: np.ndarray  # bool
+    ids: List[str]
+    metadata: List[Dict[str, Any]]
+
+
+class LocalMemoryStore(MemoryStore):
+    """
+    Memories in process: a numpy matrix searched by cosine similarity, with the
+    metadata and vectors persisted in a SQLite file. For single-node deployments and
+    offline runs, memories are embedded with the configured llama-index embed model.
+    New memories are appended to preallocated buffers that double when full.
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS memories (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                session_id INTEGER,
+                type TEXT NOT NULL,
+                text TEXT NOT NULL,
+                persistence_score REAL,
+                embedding BLOB NOT NULL
+            )
+            """
+        )
+        self._connection.commit()
+        self._write_lock = threading.Lock()
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._user_ids = np.zeros(0, dtype=np.int64)
+        self._session_ids = np.zeros(0, dtype=np.int64)
+        self._persistent = np.zeros(0, dtype=bool)
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._snapshot = self._publish(0)
+        self._load()
+
+    def _load(self) -> None:
+        rows = self._connection.execute(
+            "SELECT id, user_id, session_id, type, text, persistence_score, embedding FROM memories"
+        ).fetchall()
+        self._write(
+            [
+                {
+                    "id": memory_id,
+                    "values": np.frombuffer(embedding, dtype=np.float32),
+                    "metadata": {
+                        "text": text,
+                        "type": memory_type,
+                        "user_id": user_id,
+                        "session_id": session_id,
+                        "persistence_score": persistence_score,
+                    },
+                }
+                for memory_id, user_id, session_id, memory_type, text, persistence_score, embedding in rows
+            ]
+        )
+
+    def _publish(self, count: int) -> _LocalSnapshot:
+        return _LocalSnapshot(
+            count=count,
+            embeddings=self._embeddings[:count],
+            user_ids=self._user_ids[:count],
+            session_ids=self._session_ids[:count],
+            persistent=self._persistent[:count],
+            ids=self._ids,
+            metadata=self._metadata,
+        )
+
+    def _reserve(self, count: int, dim: int) -> None:
+        """
+        Grow the buffers to hold count rows. Rows beyond the published snapshot can be
+        written in place, a full buffer is copied to a new one.
+        """
+        size = self._snapshot.count
+        if size and self._embeddings.shape[1] != dim:
+            raise ValueError(f"Memory dimension {dim} doesn't match the stored memories ({self._embeddings.shape[1]})")
+        if len(self._embeddings) >= count and self._embeddings.shape[1] == dim:
+            return
+        capacity = max(count, 2 * len(self._embeddings), 64)
+        embeddings = np.zeros((capacity, dim), dtype=np.float32)
+        if size:
+            embeddings[:size] = self._embeddings[:size]
+        self._embeddings = embeddings
+        self._user_ids = np.resize(self._user_ids, capacity)
+        self._session_ids = np.resize(self._session_ids, capacity)
+        self._persistent = np.resize(self._persistent, capacity)
+
+    def _write(self, vectors: List[Dict[str, Any]]) -> None:
+        if not vectors:
+            return
+        count = self._snapshot.count
+        new_ids = {vector["id"] for vector in vectors if vector["id"] not in self._id_to_row}
+        self._reserve(count + len(new_ids), len(vectors[0]["values"]))
+        metadata = self._metadata
+        for vector in vectors:
+            row = self._id_to_row.get(vector["id"])
+            if row is None:
+                row = self._id_to_row[vector["id"]] = count
+                count += 1
+                self._ids.append(vector["id"])
+                metadata.append(None)
+            embedding = np.asarray(vector["values"], dtype=np.float32)
+            self._embeddings[row] = embedding / (np.linalg.norm(embedding) or 1.0)
+            memory_metadata = dict(vector["metadata"])
+            self._user_ids[row] = memory_metadata["user_id"]
+            self._session_ids[row] = memory_metadata.get("session_id") or -1
+            self._persistent[row] = memory_metadata["type"] == "persistent"
+            metadata[row] = memory_metadata
+        self._snapshot = self._publish(count)
+
+    def _embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        # The embed model has its own cache, see init_settings
+        from llama_index.core.settings import Settings
+
+        if input_type == "query":
+            return [Settings.embed_model.get_query_embedding(text) for text in texts]
+        return Settings.embed_model.get_text_embedding_batch(texts)
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        if not vectors:
+            return
+        with self._write_lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO memories "
+                "(id, user_id, session_id, type, text, persistence_score, embedding) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        vector["id"],
+                        vector["metadata"]["user_id"],
+                        vector["metadata"].get("session_id"),
+                        vector["metadata"]["type"],
+                        vector["metadata"]["text"],
+                        vector["metadata"].get("persistence_score"),
+                        np.asarray(vector["values"], dtype=np.float32).tobytes(),
+                    )
+                    for vector in vectors
+                ],
+            )
+            self._connection.commit()
+            self._write(vectors)
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        return {memory_id for memory_id in ids if memory_id in self._id_to_row}
+
+    def delete_temporary(self, user_id: int, session_id: int) -> int:
+        with self._write_lock:
+            self._connection.execute(
+                "DELETE FROM memories WHERE user_id = ? AND session_id = ? AND type = 'temporary'",
+                (user_id, session_id),
+            )
+            self._connection.commit()
+            snapshot = self._snapshot
+            removed = (
+                (snapshot.user_ids == user_id)
+                & (snapshot.session_ids == session_id)
+                & ~snapshot.persistent
+            )
+            if removed.any():
+                self._compact(~removed)
+            return int(removed.sum())
+
+    def _compact(self, keep: np.ndarray) -> None:
+        """
+        Copy the kept rows to new buffers, queries keep using the previous snapshot until
+        the new one is published.
+        """
+        rows = np.flatnonzero(keep)
+        snapshot = self._snapshot
+        self._embeddings = snapshot.embeddings[rows].copy()
+        self._user_ids = snapshot.user_ids[rows].copy()
+        self._session_ids = snapshot.session_ids[rows].copy()
+        self._persistent = snapshot.persistent[rows].copy()
+        self._ids = [snapshot.ids[row] for row in rows]
+        self._metadata = [snapshot.metadata[row] for row in rows]
+        self._id_to_row = {memory_id: row for row, memory_id in enumerate(self._ids)}
+        self._snapshot = self._publish(len(rows))
+
+    def query_matches(self, vector: List[float], user_id: int, session_id: int, top_k: int) -> List[Dict[str, Any]]:
+        snapshot = self._snapshot
+        if snapshot.count == 0:
+            return []
+        mask = (snapshot.user_ids == user_id) & (
+            snapshot.persistent | (snapshot.session_ids == session_id)
+        )
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        scores = snapshot.embeddings[rows] @ (query / (np.linalg.norm(query) or 1.0))
+        top = np.argsort(-scores)[:top_k]
+        return [
+            {"id": snapshot.ids[rows[i]], "score": float(scores[i]), "metadata": dict(snapshot.metadata[rows[i]])}
+            for i in top
+        ]
+
+
+def create_memory_store() -> MemoryStore:
+    store = os.getenv("MEMORY_STORE", "pinecone")
+    if store == "pinecone":
+        return PineconeMemoryStore()
+    if store == "local":
+        return LocalMemoryStore(os.getenv("MEMORY_STORE_PATH", "memory.db"))
+    raise ValueError(f"Invalid memory store: {store}")
+
+
+_memory_store: Optional[MemoryStore] = None
+_memory_store_lock = threading.Lock()
+
+
+def get_memory_store() -> MemoryStore:
+    """
+    Memory store selected by MEMORY_STORE (pinecone or local), created on first use.
+    """
+    global _memory_store
+    if _memory_store is None:
+        with _memory_store_lock:
+            if _memory_store is None:
+                _memory_store = create_memory_store()
+    return _memory_store
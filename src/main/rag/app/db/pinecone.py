@@ -1,10 +1,15 @@
-from pinecone import Pinecone, ServerlessSpec
 import os
-import uuid
+import json
+import hashlib
 import openai
 from dotenv import load_dotenv
-import json
 import logging
+import threading
+from typing import Dict, Tuple
+
+from app.db.memory_classifier import CLASSIFIER_MODE, MIN_CONFIDENCE, MemoryClassifier
+from app.db.memory_store import get_memory_store
+from app.embedding_cache import normalize_text
 
 # Configure the logger
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -12,48 +17,55 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-API_KEY=os.getenv("PINECONE_API")
 OPENAI_API_KEY=os.getenv("OPENAI_API_KEY")
+MEMORY_CLASSIFIER_MODEL = os.getenv("MEMORY_CLASSIFIER_MODEL", "gpt-4")
+# Cosine similarity above which a new meaning is a duplicate of a stored memory
+MEMORY_DEDUP_THRESHOLD = float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0.95"))
 
-pc = Pinecone(api_key=API_KEY, environment="us-east-1")
-from pinecone import Pinecone
-import uuid
+_openai_client = None
+_openai_client_lock = threading.Lock()
 
-# Define index name
-index_name = "chatbot-memory"
-index = pc.Index(index_name)
+
+def get_openai_client():
+    """
+    OpenAI client shared by the extraction calls, created on first use.
+    """
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                _openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
 
 
 def embed_texts(texts): 
     """
     Converts a list of text inputs into embeddings.
     """
-    return pc.inference.embed(
-        model="llama-text-embed-v2",
-        inputs=texts,
-        parameters={"input_type": "passage"}
-    )
+    return get_memory_store().embed(texts, input_type="passage")
 #--------------
 
-import json
-import openai
-import logging
-import os
-
-logger = logging.getLogger(__name__)
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-import json
-import openai
-import logging
-import os
-
-logger = logging.getLogger(__name__)
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
 def extract_embeddings(message):
+    """
+    Extracts the different meanings of a message with a persistence score each.
+    The local classifier scores the message first, the LLM is only asked for the messages
+    it isn't confident about (see MEMORY_CLASSIFIER and MEMORY_CLASSIFIER_MIN_CONFIDENCE).
+    """
+    if CLASSIFIER_MODE != "llm":
+        try:
+            phrases, confidence = MemoryClassifier.classify(message)
+            if CLASSIFIER_MODE == "local" or confidence >= MIN_CONFIDENCE:
+                MemoryClassifier.record(fast_path=True)
+                return phrases
+        except Exception as e:
+            if CLASSIFIER_MODE == "local":
+                raise
+            logger.error(f"Local memory classifier failed, using the LLM: {str(e)}")
+    MemoryClassifier.record(fast_path=False)
+    return extract_embeddings_llm(message)
+
+
+def extract_embeddings_llm(message):
     """
     Uses OpenAI to extract different meanings from a message and assign a persistence score.
     Ensures the response is valid JSON before parsing.
@@ -82,10 +94,10 @@ def extract_embeddings(message):
     """
 
     try:
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)  # ✅ New OpenAI client format
+        client = get_openai_client()
 
         response = client.chat.completions.create(  # ✅ New OpenAI SDK format
-            model="gpt-4",
+            model=MEMORY_CLASSIFIER_MODEL,
             messages=[{"role": "system", "content": prompt}]
         )
         
@@ -109,11 +121,23 @@ def extract_embeddings(message):
 
 
 
+def memory_id(user_id, session_id, text, embedding_type):
+    """
+    Content-addressed memory id: restating a fact maps to the same vector.
+    - Persistent vectors -> "{user_id}-persistent-{hash}"
+    - Temporary vectors -> "{user_id}-{session_id}-temp-{hash}"
+    """
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()[:32]
+    if embedding_type == "persistent":
+        return f"{user_id}-persistent-{digest}"
+    return f"{user_id}-{session_id}-temp-{digest}"
+
+
 def store_embeddings(user_id, session_id, message):
     """
-    Splits message into multiple meanings, assigns persistence scores, embeds them, and upserts into Pinecone.
-    - Persistent vectors -> Indexed as "{user_id}-persistent-{i}"
-    - Temporary vectors -> Indexed as "{user_id}-{session_id}-temp-{i}"
+    Splits message into multiple meanings, assigns persistence scores, embeds them, and upserts into the memory store.
+    Meanings that are already stored (same normalized text) are skipped before embedding, and those
+    nearly identical to a stored memory (MEMORY_DEDUP_THRESHOLD) before upserting.
     """
 
     # Extract meanings and persistence scores
@@ -123,29 +147,44 @@ def store_embeddings(user_id, session_id, message):
         logger.error(f"No embeddings extracted for message: {message}")
         return
 
-    meanings = [entry["phrase"] for entry in extracted_data]
-    persistence_scores = [entry["persistence"] for entry in extracted_data]
+    store = get_memory_store()
 
-    # Embed the meanings
-    embeddings = embed_texts(meanings)
+    entries: Dict[str, Tuple[str, str, float]] = {}
+    for entry in extracted_data:
+        embedding_type = "persistent" if entry["persistence"] >= 0.7 else "temporary"  # Define threshold
+        vector_id = memory_id(user_id, session_id, entry["phrase"], embedding_type)
+        entries.setdefault(vector_id, (entry["phrase"], embedding_type, entry["persistence"]))
+
+    # Only new facts are embedded
+    for vector_id in store.existing_ids(list(entries)):
+        del entries[vector_id]
+    if not entries:
+        logger.info(f"All {len(extracted_data)} meanings are already stored.")
+        return
+
+    embeddings = embed_texts([meaning for meaning, _, _ in entries.values()])
 
     vectors = []
-    for i, (meaning, embedding, persistence_score) in enumerate(zip(meanings, embeddings, persistence_scores)):
-        embedding_type = "persistent" if persistence_score >= 0.7 else "temporary"  # Define threshold
-        
-        vector_id = f"{user_id}-persistent-{i}" if embedding_type == "persistent" else f"{user_id}-{session_id}-temp-{i}"
-        
+    for (vector_id, (meaning, embedding_type, persistence_score)), embedding in zip(entries.items(), embeddings):
+        # A near duplicate is only kept if it makes a temporary memory persistent
+        matches = store.query_matches(embedding, user_id=user_id, session_id=session_id, top_k=1)
+        if (
+            matches
+            and matches[0]["score"] >= MEMORY_DEDUP_THRESHOLD
+            and (embedding_type == "temporary" or matches[0]["metadata"]["type"] == "persistent")
+        ):
+            logger.info(f"Skipped memory {vector_id}, near duplicate of {matches[0]['id']}")
+            continue
+
         vectors.append({
             "id": vector_id,
-            "values": embedding.values,
-            "metadata": {"text": meaning, "type": embedding_type, "user_id": user_id, "persistence_score": persistence_score}
+            "values": embedding,
+            "metadata": {"text": meaning, "type": embedding_type, "user_id": user_id, "session_id": session_id, "persistence_score": persistence_score}
         })
 
-    # Upsert into Pinecone
-    index.upsert(
-        vectors=vectors,
-        namespace="ns1"
-    )
+    # Upsert into the memory store
+    if vectors:
+        store.upsert(vectors)
     
     print(f"Stored {len(vectors)} embeddings.")
 
@@ -153,40 +192,28 @@ def store_embeddings(user_id, session_id, message):
 
 def search_embeddings(user_id, session_id, query, k=3):
     """
-    Queries the vector database for the k nearest vectors, considering only:
+    Queries the memory store for the k nearest vectors, considering only:
     - Persistent vectors linked to `user_id`
     - Temporary vectors linked to `user_id` and `session_id`
     """
+    store = get_memory_store()
+
     # Generate query embedding
-    query_embedding = pc.inference.embed(
-        model="llama-text-embed-v2",
-        inputs=[query],
-        parameters={"input_type": "query"}
-    )[0].values
-
-    # Define Pinecone filter: match only relevant vectors
-    filter_conditions = {
-        "$or": [
-            {"user_id": user_id, "type": "persistent"},  # Persistent vectors for user
-            {"user_id": user_id, "session_id": session_id, "type": "temporary"}  # Temporary vectors for user+session
-        ]
-    }
-
-    # Query Pinecone
-    search_results = index.query(
-        namespace="ns1",
-        vector=query_embedding,
+    query_embedding = store.embed([query], input_type="query")[0]
+
+    # Only the persistent vectors of the user and the temporary vectors of the session
+    matches = store.query(
+        query_embedding,
+        user_id=user_id,
+        session_id=session_id,
         top_k=k * 2,  # Fetch more to ensure we get a mix of both types if available
-        include_metadata=True,
-        filter=filter_conditions
     )
 
     # Separate results into temporary and persistent lists
     temp_results = []
     persistent_results = []
 
-    for match in search_results["matches"]:
-        metadata = match["metadata"]
+    for metadata in matches:
         meaning_text = metadata["text"]
         embedding_type = metadata["type"]
 
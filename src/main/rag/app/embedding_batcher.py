@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, NamedTuple, Optional
+
+from llama_index.core.base.embeddings.base import Embedding
+
+logger = logging.getLogger(__name__)
+
+
+class _EmbeddingRequest(NamedTuple):
+    key: Hashable
+    texts: List[str]
+    embed_batch: Callable[[List[str]], List[Embedding]]
+    future: Future
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches embedding requests across concurrent callers.
+    Requests are collected for up to `max_wait` seconds, or until `max_batch_size` texts
+    are waiting. Requests with the same key (model and input type) are then sent as one
+    batched embed call, and each caller gets its own embeddings back. Batches are sent
+    from a small pool, so new requests are collected while batches are in flight.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait: float, workers: int, timeout: float = 60):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # Longest wait of a caller for its embeddings, queueing included
+        self.timeout = timeout
+        self._requests: "queue.Queue[_EmbeddingRequest]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding-batch")
+        self._collector: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        key: Hashable,
+        texts: List[str],
+        embed_batch: Callable[[List[str]], List[Embedding]],
+    ) -> Future:
+        """
+        Queue the texts to be embedded with the next batch of the key.
+        embed_batch must embed a list of texts, it's called with the texts of all
+        requests of the batch.
+        """
+        future: Future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        self._start()
+        self._requests.put(_EmbeddingRequest(key, list(texts), embed_batch, future))
+        return future
+
+    def embed(
+        self,
+        key: Hashable,
+        texts: List[str],
+        embed_batch: Callable[[List[str]], List[Embedding]],
+    ) -> List[Embedding]:
+        future = self.submit(key, texts, embed_batch)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Not embedded if it's still queued
+            future.cancel()
+            raise
+
+    async def aembed(
+        self,
+        key: Hashable,
+        texts: List[str],
+        embed_batch: Callable[[List[str]], List[Embedding]],
+    ) -> List[Embedding]:
+        return await asyncio.wait_for(
+            asyncio.wrap_future(self.submit(key, texts, embed_batch)), self.timeout
+        )
+
+    def _start(self) -> None:
+        if self._collector is not None:
+            return
+        with self._lock:
+            if self._collector is None:
+                self._collector = threading.Thread(
+                    target=self._collect, name="embedding-batcher", daemon=True
+                )
+                self._collector.start()
+
+    def _collect(self) -> None:
+        while True:
+            requests = [self._requests.get()]
+            size = len(requests[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                size += len(request.texts)
+
+            batches: Dict[Hashable, List[_EmbeddingRequest]] = {}
+            for request in requests:
+                batches.setdefault(request.key, []).append(request)
+            for batch in batches.values():
+                self._executor.submit(self._send, batch)
+
+    def _send(self, batch: List[_EmbeddingRequest]) -> None:
+        # Requests cancelled by their caller (e.g. a timeout) are skipped, the others
+        # can't be cancelled from now on
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = [text for request in batch for text in request.texts]
+        try:
+            embeddings: List[Embedding] = []
+            for start in range(0, len(texts), self.max_batch_size):
+                embeddings.extend(batch[0].embed_batch(texts[start : start + self.max_batch_size]))
+            if len(embeddings) != len(texts):
+                raise ValueError(f"Got {len(embeddings)} embeddings for {len(texts)} texts")
+        except Exception as e:
+            for request in batch:
+                self._resolve(request.future, exception=e)
+            return
+        logger.debug(f"Embedded {len(texts)} texts of {len(batch)} requests in one batch")
+        offset = 0
+        for request in batch:
+            self._resolve(request.future, result=embeddings[offset : offset + len(request.texts)])
+            offset += len(request.texts)
+
+    @staticmethod
+    def _resolve(
+        future: Future,
+        result: Optional[List[Embedding]] = None,
+        exception: Optional[BaseException] = None,
+    ) -> None:
+        """
+        Set the outcome of one request, a request that can't take it doesn't stop the
+        others of the batch from getting theirs.
+        """
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            logger.warning("Embedding request was already resolved, dropped its result")
+
+
+_embedding_batcher: Optional[EmbeddingBatcher] = None
+_embedding_batcher_lock = threading.Lock()
+
+
+def get_embedding_batcher() -> Optional[EmbeddingBatcher]:
+    """
+    Embedding batcher shared by the embed model and the memory store,
+    None if disabled with EMBEDDING_BATCH_WAIT_MS=0.
+    """
+    global _embedding_batcher
+    max_wait_ms = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+    if max_wait_ms <= 0:
+        return None
+    if _embedding_batcher is None:
+        with _embedding_batcher_lock:
+            if _embedding_batcher is None:
+                _embedding_batcher = EmbeddingBatcher(
+                    max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "96")),
+                    max_wait=max_wait_ms / 1000,
+                    workers=int(os.getenv("EMBEDDING_BATCH_WORKERS", "4")),
+                    timeout=float(os.getenv("EMBEDDING_BATCH_TIMEOUT", "60")),
+                )
+    return _embedding_batcher
@@ -0,0 +1,354 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+from cachetools import LRUCache
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.settings import Settings
+from pydantic import Field
+
+from app.embedding_batcher import get_embedding_batcher
+
+logger = logging.getLogger(__name__)
+
+# Log the hit rates every this many lookups
+STATS_LOG_INTERVAL = 1000
+# The expired disk entries are dropped at least this often (seconds)
+DISK_EVICTION_INTERVAL = 3600
+
+
+def normalize_text(text: str) -> str:
+    """
+    Texts that only differ by case, unicode form or whitespace share an embedding.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip().casefold()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache: an in-memory LRU in front of an on-disk key/value store
+    (a SQLite file), keyed by model, input type and the hash of the normalized text.
+    The disk tier keeps embeddings across restarts, it's skipped if no path is set.
+    It holds at most max_disk_rows embeddings and drops the ones unused for ttl seconds,
+    least recently used first.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        path: Optional[str] = None,
+        max_disk_rows: int = 50000,
+        ttl: float = 30 * 86400,
+    ):
+        self._memory: LRUCache = LRUCache(maxsize=maxsize)
+        # The memory tier and the stats, the disk tier has its own lock so memory hits
+        # never wait on SQLite
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        self.max_disk_rows = max_disk_rows
+        self.ttl = ttl
+        self._disk_rows = 0
+        self._evicted_at = 0.0
+        if path:
+            self._disk = sqlite3.connect(path, check_same_thread=False)
+            self._open_disk(self._disk)
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _open_disk(self, disk: sqlite3.Connection) -> None:
+        disk.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, embedding BLOB NOT NULL, used_at REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in disk.execute("PRAGMA table_info(embeddings)")]
+        if "used_at" not in columns:
+            # Files written before the eviction, their rows count as used now
+            disk.execute("ALTER TABLE embeddings ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+            disk.execute("UPDATE embeddings SET used_at = ?", (time.time(),))
+        disk.execute("CREATE INDEX IF NOT EXISTS embeddings_used_at ON embeddings (used_at)")
+        disk.commit()
+        with self._disk_lock:
+            self._evict_disk(disk)
+
+    def _evict_disk(self, disk: sqlite3.Connection) -> None:
+        """
+        Drop the expired rows, then the least recently used ones down to 90% of
+        max_disk_rows, so eviction runs once every few thousand writes.
+        """
+        now = time.time()
+        expired = disk.execute("DELETE FROM embeddings WHERE used_at < ?", (now - self.ttl,)).rowcount
+        rows = disk.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = rows - int(self.max_disk_rows * 0.9) if rows > self.max_disk_rows else 0
+        if excess > 0:
+            disk.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY used_at LIMIT ?)",
+                (excess,),
+            )
+        disk.commit()
+        self._disk_rows = rows - excess
+        self._evicted_at = now
+        if expired or excess:
+            logger.info(f"Evicted {expired} expired and {excess} least recently used cached embeddings")
+
+    @staticmethod
+    def key(model: str, input_type: str, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{model}:{input_type}:{digest}"
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Hit counts and rates since start.
+        """
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        lookups = sum(stats.values())
+        stats["lookups"] = lookups
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["memory_hit_rate"] = stats["memory_hits"] / lookups if lookups else 0.0
+        return stats
+
+    def embed(
+        self,
+        model: str,
+        input_type: str,
+        texts: List[str],
+        embed_missing: Callable[[List[str]], List[Embedding]],
+    ) -> List[Embedding]:
+        """
+        Embeddings of the texts, only the texts missing from both tiers are embedded,
+        once each.
+        """
+        keys, found, missing = self._lookup(model, input_type, texts)
+        if missing:
+            self._store(found, missing, embed_missing(list(missing.values())))
+        return [found[key] for key in keys]
+
+    async def aembed(
+        self,
+        model: str,
+        input_type: str,
+        texts: List[str],
+        aembed_missing: Callable[[List[str]], Awaitable[List[Embedding]]],
+    ) -> List[Embedding]:
+        keys, found, missing = self._lookup(model, input_type, texts)
+        if missing:
+            self._store(found, missing, await aembed_missing(list(missing.values())))
+        return [found[key] for key in keys]
+
+    def _lookup(self, model: str, input_type: str, texts: List[str]):
+        keys = [self.key(model, input_type, text) for text in texts]
+        found = self._get_many(keys)
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        return keys, found, missing
+
+    def _store(self, found: Dict[str, Embedding], missing: Dict[str, str], embeddings: List[Embedding]) -> None:
+        new_embeddings = dict(zip(missing.keys(), embeddings))
+        self._put_many(new_embeddings)
+        found.update(new_embeddings)
+
+    def _get_many(self, keys: List[str]) -> Dict[str, Embedding]:
+        found: Dict[str, Embedding] = {}
+        with self._lock:
+            for key in keys:
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    found[key] = embedding
+        disk_keys = [key for key in set(keys) if key not in found]
+        memory_hits = sum(1 for key in keys if key in found)
+
+        disk_found: Dict[str, Embedding] = {}
+        if disk_keys and self._disk is not None:
+            disk_found = self._disk_get(self._disk, disk_keys)
+            found.update(disk_found)
+
+        disk_hits = sum(1 for key in keys if key in found) - memory_hits
+        with self._lock:
+            for key, embedding in disk_found.items():
+                self._memory[key] = embedding
+            self._stats["memory_hits"] += memory_hits
+            self._stats["disk_hits"] += disk_hits
+            self._stats["misses"] += len(keys) - memory_hits - disk_hits
+            lookups = sum(self._stats.values())
+        if lookups // STATS_LOG_INTERVAL != (lookups - len(keys)) // STATS_LOG_INTERVAL:
+            logger.info(f"Embedding cache stats: {self.stats()}")
+        return found
+
+    def _disk_get(self, disk: sqlite3.Connection, keys: List[str]) -> Dict[str, Embedding]:
+        placeholders = ",".join("?" * len(keys))
+        with self._disk_lock:
+            rows = disk.execute(
+                f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})",
+                keys,
+            ).fetchall()
+            if rows:
+                disk.execute(
+                    f"UPDATE embeddings SET used_at = ? WHERE key IN ({placeholders})",
+                    [time.time(), *keys],
+                )
+                disk.commit()
+        return {key: np.frombuffer(embedding, dtype=np.float32).tolist() for key, embedding in rows}
+
+    def _put_many(self, embeddings: Dict[str, Embedding]) -> None:
+        with self._lock:
+            for key, embedding in embeddings.items():
+                self._memory[key] = embedding
+        if self._disk is not None:
+            self._disk_put(self._disk, embeddings)
+
+    def _disk_put(self, disk: sqlite3.Connection, embeddings: Dict[str, Embedding]) -> None:
+        now = time.time()
+        rows = [
+            (key, np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            for key, embedding in embeddings.items()
+        ]
+        with self._disk_lock:
+            disk.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, used_at) VALUES (?, ?, ?)", rows
+            )
+            disk.commit()
+            # Replaced rows are counted too, the eviction recounts
+            self._disk_rows += len(rows)
+            if self._disk_rows > self.max_disk_rows or now - self._evicted_at > DISK_EVICTION_INTERVAL:
+                self._evict_disk(disk)
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Embedding cache shared by the embed model and the memory store,
+    None if disabled with EMBEDDING_CACHE_SIZE=0.
+    """
+    global _embedding_cache
+    maxsize = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+    if maxsize <= 0:
+        return None
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache(
+                    maxsize=maxsize,
+                    path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db"),
+                    max_disk_rows=int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "50000")),
+                    ttl=float(os.getenv("EMBEDDING_CACHE_TTL_DAYS", "30")) * 86400,
+                )
+    return _embedding_cache
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embed model that serves repeated texts and queries of the wrapped model from the
+    embedding cache. The misses of concurrent callers are sent to the wrapped model
+    in batches by the embedding batcher.
+    """
+
+    embed_model: BaseEmbedding = Field(description="The wrapped embed model.")
+    cache_model: str = Field(description="Model part of the cache keys.")
+
+    def __init__(self, embed_model: BaseEmbedding, **kwargs: Any):
+        dimensions = getattr(embed_model, "dimensions", None)
+        super().__init__(
+            embed_model=embed_model,
+            cache_model=f"{embed_model.class_name()}:{embed_model.model_name}:{dimensions}",
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            callback_manager=embed_model.callback_manager,
+            **kwargs,
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _embed_queries(self, queries: List[str]) -> List[Embedding]:
+        # OpenAI models embed queries like texts when both use the same engine,
+        # so a batch of queries is one request. Other models embed them one by one.
+        query_engine = getattr(self.embed_model, "_query_engine", None)
+        if query_engine is not None and query_engine == getattr(self.embed_model, "_text_engine", None):
+            return self.embed_model._get_text_embeddings(queries)
+        return [self.embed_model._get_query_embedding(query) for query in queries]
+
+    def _batched(self, input_type: str, embed: Callable[[List[str]], List[Embedding]]) -> Callable[[List[str]], List[Embedding]]:
+        batcher = get_embedding_batcher()
+        if batcher is None:
+            return embed
+        return lambda texts: batcher.embed((self.cache_model, input_type), texts, embed)
+
+    def _abatched(
+        self,
+        input_type: str,
+        embed: Callable[[List[str]], List[Embedding]],
+        aembed: Callable[[List[str]], Awaitable[List[Embedding]]],
+    ) -> Callable[[List[str]], Awaitable[List[Embedding]]]:
+        # Batches are sent from the batcher threads with the sync embed
+        batcher = get_embedding_batcher()
+        if batcher is None:
+            return aembed
+        return lambda texts: batcher.aembed((self.cache_model, input_type), texts, embed)
+
+    def _cached(self, input_type: str, texts: List[str], embed: Callable[[List[str]], List[Embedding]]) -> List[Embedding]:
+        embed = self._batched(input_type, embed)
+        cache = get_embedding_cache()
+        if cache is None:
+            return embed(texts)
+        return cache.embed(self.cache_model, input_type, texts, embed)
+
+    async def _acached(
+        self,
+        input_type: str,
+        texts: List[str],
+        embed: Callable[[List[str]], List[Embedding]],
+        aembed: Callable[[List[str]], Awaitable[List[Embedding]]],
+    ) -> List[Embedding]:
+        aembed = self._abatched(input_type, embed, aembed)
+        cache = get_embedding_cache()
+        if cache is None:
+            return await aembed(texts)
+        return await cache.aembed(self.cache_model, input_type, texts, aembed)
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._cached("query", [query], self._embed_queries)[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        async def aembed(queries: List[str]) -> List[Embedding]:
+            return [await self.embed_model._aget_query_embedding(query) for query in queries]
+
+        return (await self._acached("query", [query], self._embed_queries, aembed))[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._cached("passage", texts, self.embed_model._get_text_embeddings)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self._acached(
+            "passage", texts, self.embed_model._get_text_embeddings, self.embed_model._aget_text_embeddings
+        )
+
+
+def get_ingestion_embed_model() -> BaseEmbedding:
+    """
+    Embed model for indexing documents. Their chunks are embedded once, so they bypass
+    the embedding cache instead of filling it.
+    """
+    embed_model = Settings.embed_model
+    if isinstance(embed_model, CachedEmbedding):
+        return embed_model.embed_model
+    return embed_model
@@ -1,5 +1,6 @@
 import os
-from typing import List
+import threading
+from typing import List, Optional
 import logging
 
 from llama_index.core.agent import AgentRunner
@@ -7,7 +8,7 @@ from llama_index.core.callbacks import CallbackManager
 from llama_index.core.settings import Settings
 from llama_index.core.tools import BaseTool
 
-from app.engine.index import IndexConfig, get_index
+from app.engine.index import get_index_manager
 from app.engine.tools import ToolFactory
 from app.engine.tools.query_engine import get_query_engine_tool
 # from tools.activity_recommendation import ActivityRecommendation
@@ -18,27 +19,79 @@ from app.engine.tools.query_engine import get_query_engine_tool
 
 logger = logging.getLogger(__name__)
 
-def get_chat_engine(params=None, event_handlers=None, **kwargs):
-    system_prompt = os.getenv("SYSTEM_PROMPT")
-    tools: List[BaseTool] = []
-    callback_manager = CallbackManager(handlers=event_handlers or [])
-
-
-    # Add query tool if index exists
-    index_config = IndexConfig(callback_manager=callback_manager, **(params or {}))
-    index = get_index(index_config)
-    if index is not None:
-        query_engine_tool = get_query_engine_tool(index, **kwargs)
-        tools.append(query_engine_tool)
-
-    # Add additional tools
-    configured_tools: List[BaseTool] = ToolFactory.from_env()
-    tools.extend(configured_tools)
-
-    return AgentRunner.from_llm(
-        llm=Settings.llm,
-        tools=tools,
-        system_prompt=system_prompt,
-        callback_manager=callback_manager,
-        verbose=True,
-    )
+
+class ChatEngineFactory:
+    """
+    Process-level factory for chat engines.
+    Loads the configured tools once and keeps the index resident, then hands out a cheap
+    agent per request that only carries the request's filters and callback handlers.
+    """
+
+    _lock = threading.Lock()
+    _is_initialized: bool = False
+    _tools: List[BaseTool] = []
+
+    @classmethod
+    def init(cls) -> None:
+        """
+        Load the index and the configured tools. Safe to call more than once.
+        """
+        if cls._is_initialized:
+            return
+        with cls._lock:
+            if cls._is_initialized:
+                return
+            get_index_manager().start()
+            cls._tools = ToolFactory.from_env()
+            cls._is_initialized = True
+            logger.info(f"Chat engine factory initialized with {len(cls._tools)} tools")
+
+    @classmethod
+    def shutdown(cls) -> None:
+        get_index_manager().stop()
+
+    @classmethod
+    def get_index(cls):
+        cls.init()
+        return get_index_manager().index
+
+    @classmethod
+    def create_chat_engine(
+        cls,
+        event_handlers: Optional[list] = None,
+        **kwargs,
+    ) -> AgentRunner:
+        """
+        Create a new agent for a single request.
+
+        Args:
+            event_handlers (optional): Callback handlers for this request only.
+            kwargs (optional): Additional parameters for the query engine, e.g: filters
+        """
+        cls.init()
+        system_prompt = os.getenv("SYSTEM_PROMPT")
+        callback_manager = CallbackManager(handlers=event_handlers or [])
+
+        tools: List[BaseTool] = []
+        # Add query tool if index exists
+        index = get_index_manager().index
+        if index is not None:
+            query_engine_tool = get_query_engine_tool(
+                index, callback_manager=callback_manager, **kwargs
+            )
+            tools.append(query_engine_tool)
+
+        # Add additional tools
+        tools.extend(cls._tools)
+
+        return AgentRunner.from_llm(
+            llm=Settings.llm,
+            tools=tools,
+            system_prompt=system_prompt,
+            callback_manager=callback_manager,
+            verbose=True,
+        )
+
+
+def get_chat_engine(event_handlers=None, **kwargs):
+    return ChatEngineFactory.create_chat_engine(event_handlers=event_handlers, **kwargs)
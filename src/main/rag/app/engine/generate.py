@@ -6,7 +6,14 @@ load_dotenv()
 import logging
 import os
 
+from app.embedding_cache import get_ingestion_embed_model
+from app.engine.index import persist_index, storage_write_lock
 from app.engine.loaders import get_documents
+from app.engine.vector_stores import (
+    build_ann_index,
+    get_storage_context,
+    quantize_vectors,
+)
 from app.settings import init_settings
 from llama_index.core.indices import (
     VectorStoreIndex,
@@ -27,10 +34,15 @@ def generate_datasource():
         doc.metadata["private"] = "false"
     index = VectorStoreIndex.from_documents(
         documents,
+        storage_context=get_storage_context(),
+        embed_model=get_ingestion_embed_model(),
         show_progress=True,
     )
-    # store it for later
-    index.storage_context.persist(storage_dir)
+    quantize_vectors(index.vector_store)
+    build_ann_index(index.vector_store)
+    # store it for later as a new version, running servers pick it up on their next poll
+    with storage_write_lock(storage_dir):
+        persist_index(index, storage_dir)
     logger.info(f"Finished creating new index. Stored in {storage_dir}")
 
 
@@ -1,43 +1,223 @@
+import fcntl
 import logging
 import os
-from datetime import timedelta
-from typing import Optional
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional, Sequence, Tuple
 
-from cachetools import TTLCache, cached  # type: ignore
-from llama_index.core.callbacks import CallbackManager
-from llama_index.core.indices import load_index_from_storage
-from llama_index.core.storage import StorageContext
-from pydantic import BaseModel, Field
+from llama_index.core.indices import VectorStoreIndex, load_index_from_storage
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.schema import BaseNode
+
+from app.engine.vector_stores import get_storage_context
 
 logger = logging.getLogger("uvicorn")
 
+# Layout of the storage dir:
+#   STORAGE_DIR/CURRENT            -> name of the active version
+#   STORAGE_DIR/versions/<version> -> a complete persisted index
+# Storage dirs created before versioning (index files directly in STORAGE_DIR)
+# are still loaded as the legacy version.
+CURRENT_VERSION_FILE = "CURRENT"
+WRITE_LOCK_FILE = ".write.lock"
+VERSIONS_DIR = "versions"
+LEGACY_VERSION = "legacy"
+
 
-class IndexConfig(BaseModel):
-    callback_manager: Optional[CallbackManager] = Field(
-        default=None,
-    )
+def get_storage_dir() -> str:
+    return os.getenv("STORAGE_DIR", "storage")
 
 
-def get_index(config: IndexConfig = None):
-    if config is None:
-        config = IndexConfig()
-    storage_dir = os.getenv("STORAGE_DIR", "storage")
-    # check if storage already exists
-    if not os.path.exists(storage_dir):
+def get_current_version(storage_dir: str) -> Optional[str]:
+    """
+    Get the version the storage dir currently points to, or None if there is no index.
+    """
+    try:
+        with open(os.path.join(storage_dir, CURRENT_VERSION_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(storage_dir, "docstore.json")):
+            return LEGACY_VERSION
         return None
-    # load the existing index
-    logger.info(f"Loading index from {storage_dir}...")
-    storage_context = get_storage_context(storage_dir)
-    index = load_index_from_storage(
-        storage_context, callback_manager=config.callback_manager
-    )
-    logger.info(f"Finished loading index from {storage_dir}")
+
+
+def get_version_dir(storage_dir: str, version: str) -> str:
+    if version == LEGACY_VERSION:
+        return storage_dir
+    return os.path.join(storage_dir, VERSIONS_DIR, version)
+
+
+@contextmanager
+def storage_write_lock(storage_dir: str) -> Iterator[None]:
+    """
+    Exclusive lock on the storage dir shared by all processes (uvicorn workers, the
+    generate script), held while a new version is derived and persisted.
+    """
+    os.makedirs(storage_dir, exist_ok=True)
+    with open(os.path.join(storage_dir, WRITE_LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def persist_index(index: BaseIndex, storage_dir: Optional[str] = None) -> str:
+    """
+    Persist the index as a new version and atomically point the storage dir to it.
+    Readers only ever follow the pointer, so they never see a half-written index.
+    Writers must hold the storage_write_lock.
+    """
+    storage_dir = storage_dir or get_storage_dir()
+    version = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+    index.storage_context.persist(persist_dir=get_version_dir(storage_dir, version))
+
+    tmp_pointer = os.path.join(storage_dir, f".{CURRENT_VERSION_FILE}.{version}")
+    with open(tmp_pointer, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, os.path.join(storage_dir, CURRENT_VERSION_FILE))
+
+    _remove_old_versions(storage_dir, keep=int(os.getenv("INDEX_KEEP_VERSIONS", "3")))
+    logger.info(f"Persisted index version {version} to {storage_dir}")
+    return version
+
+
+def _remove_old_versions(storage_dir: str, keep: int) -> None:
+    versions_dir = os.path.join(storage_dir, VERSIONS_DIR)
+    current = get_current_version(storage_dir)
+    # Version names start with a millisecond timestamp, so they sort by age
+    versions = sorted(os.listdir(versions_dir), reverse=True)
+    for version in versions[max(keep, 1) :]:
+        if version != current:
+            shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+
+
+def load_index(storage_dir: str, version: str) -> BaseIndex:
+    persist_dir = get_version_dir(storage_dir, version)
+    logger.info(f"Loading index version {version} from {persist_dir}...")
+    storage_context = get_storage_context(persist_dir)
+    index = load_index_from_storage(storage_context)
+    logger.info(f"Finished loading index version {version}")
     return index
 
 
-@cached(
-    TTLCache(maxsize=10, ttl=timedelta(minutes=5).total_seconds()),
-    key=lambda *args, **kwargs: "global_storage_context",
-)
-def get_storage_context(persist_dir: str) -> StorageContext:
-    return StorageContext.from_defaults(persist_dir=persist_dir)
+class IndexManager:
+    """
+    Keeps the index resident in memory and hot-swaps it when a new version is persisted.
+    A background thread polls the version pointer in STORAGE_DIR, loads new versions
+    off the request path and replaces the index reference in a single assignment,
+    so readers never block on a reload.
+    """
+
+    def __init__(
+        self,
+        storage_dir: Optional[str] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        self.storage_dir = storage_dir or get_storage_dir()
+        self.poll_interval = (
+            poll_interval
+            if poll_interval is not None
+            else float(os.getenv("INDEX_POLL_INTERVAL", "5"))
+        )
+        # (version, index) is swapped as one tuple to keep both consistent
+        self._state: Tuple[Optional[str], Optional[BaseIndex]] = (None, None)
+        self._load_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    @property
+    def index(self) -> Optional[BaseIndex]:
+        return self._state[1]
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._state[0]
+
+    def refresh(self) -> bool:
+        """
+        Load and swap in the persisted version if it differs from the resident one.
+        Returns True if the index was swapped.
+        """
+        with self._load_lock:
+            version = get_current_version(self.storage_dir)
+            if version is None or version == self.version:
+                return False
+            index = load_index(self.storage_dir, version)
+            self._state = (version, index)
+            return True
+
+    def start(self) -> None:
+        """
+        Load the current version and start watching for new ones.
+        """
+        self.refresh()
+        if self._watcher is None and self.poll_interval > 0:
+            self._stop_event.clear()
+            self._watcher = threading.Thread(
+                target=self._watch, name="index-watcher", daemon=True
+            )
+            self._watcher.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=self.poll_interval + 1)
+            self._watcher = None
+
+    def _watch(self) -> None:
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the resident index, retry on the next poll
+                logger.error(f"Failed to refresh index from {self.storage_dir}: {e}")
+
+    def insert_nodes(self, nodes: Sequence[BaseNode]) -> BaseIndex:
+        """
+        Insert nodes into the latest persisted version and persist it as a new version.
+        The nodes go into a copy loaded from disk, never into the resident index that
+        readers are querying; the copy is swapped in once persisted. It's loaded under
+        the cross-process lock, so concurrent uploads of other workers are included
+        rather than overwritten.
+        """
+        with self._write_lock, storage_write_lock(self.storage_dir):
+            version = get_current_version(self.storage_dir)
+            if version is None:
+                index = VectorStoreIndex(
+                    nodes=nodes, storage_context=get_storage_context()
+                )
+            else:
+                index = load_index(self.storage_dir, version)
+                index.insert_nodes(nodes=nodes)
+            with self._load_lock:
+                version = persist_index(index, self.storage_dir)
+                # Our own write is already loaded, no need to reload it
+                self._state = (version, index)
+            return index
+
+
+_index_manager: Optional[IndexManager] = None
+_index_manager_lock = threading.Lock()
+
+
+def get_index_manager() -> IndexManager:
+    global _index_manager
+    if _index_manager is None:
+        with _index_manager_lock:
+            if _index_manager is None:
+                _index_manager = IndexManager()
+    return _index_manager
+
+
+def get_index() -> Optional[BaseIndex]:
+    manager = get_index_manager()
+    if manager.version is None:
+        manager.refresh()
+    return manager.index
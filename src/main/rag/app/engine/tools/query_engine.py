@@ -18,6 +18,7 @@ from llama_index.core.schema import (
 from llama_index.core.tools.query_engine import QueryEngineTool
 from llama_index.core.types import RESPONSE_TEXT_TYPE
 
+from app.engine.vector_stores import MemmapVectorStore
 from app.settings import get_multi_modal_llm
 
 
@@ -30,9 +31,19 @@ def create_query_engine(index, **kwargs) -> BaseQueryEngine:
         params (optional): Additional parameters for the query engine, e.g: similarity_top_k
     """
 
+    # The index is shared across requests, so the request's callback manager
+    # is attached to the query engine instead of the index
+    callback_manager = kwargs.pop("callback_manager", None)
     top_k = int(os.getenv("TOP_K", 0))
     if top_k != 0 and kwargs.get("filters") is None:
         kwargs["similarity_top_k"] = top_k
+    if isinstance(getattr(index, "vector_store", None), MemmapVectorStore):
+        kwargs["vector_store_kwargs"] = {
+            # Number of IVF lists to search if the index was built with ANN_INDEX=ivf
+            "nprobe": int(os.getenv("ANN_NPROBE", "8")),
+            # Shortlist per result re-ranked exactly if built with VECTOR_QUANTIZATION
+            "rerank_factor": int(os.getenv("VECTOR_RERANK_FACTOR", "4")),
+        }
     multimodal_llm = get_multi_modal_llm()
     if multimodal_llm:
         kwargs["response_synthesizer"] = MultiModalSynthesizer(
@@ -46,7 +57,11 @@ def create_query_engine(index, **kwargs) -> BaseQueryEngine:
             kwargs["retrieval_mode"] = "auto_routed"
         if multimodal_llm:
             kwargs["retrieve_image_nodes"] = True
-    return index.as_query_engine(**kwargs)
+    query_engine = index.as_query_engine(**kwargs)
+    if callback_manager is not None:
+        query_engine.callback_manager = callback_manager
+        query_engine.retriever.callback_manager = callback_manager
+    return query_engine
 
 
 def get_query_engine_tool(
@@ -0,0 +1,70 @@
+import logging
+import os
+
+from llama_index.core.storage import StorageContext
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+
+from app.engine.vector_stores.memmap import MemmapVectorStore
+
+logger = logging.getLogger(__name__)
+
+# Below this size an exact search is already fast, so no ANN index is built
+ANN_MIN_VECTORS = 10000
+
+
+def get_storage_context(persist_dir: str = None) -> StorageContext:
+    """
+    Get the storage context for a new index or for loading a persisted one.
+    New indexes use the memory-mapped vector store unless VECTOR_STORE_FORMAT=json,
+    persisted JSON stores are still loaded as `SimpleVectorStore`.
+    """
+    if persist_dir is None:
+        if os.getenv("VECTOR_STORE_FORMAT", "memmap") == "json":
+            return StorageContext.from_defaults()
+        return StorageContext.from_defaults(vector_store=MemmapVectorStore())
+
+    if MemmapVectorStore.exists(persist_dir):
+        return StorageContext.from_defaults(
+            persist_dir=persist_dir,
+            vector_store=MemmapVectorStore.from_persist_dir(persist_dir),
+        )
+    return StorageContext.from_defaults(persist_dir=persist_dir)
+
+
+def build_ann_index(vector_store: BasePydanticVectorStore) -> None:
+    """
+    Build the approximate nearest neighbour index configured by ANN_INDEX (e.g. `ivf`).
+    The number of IVF lists can be set with ANN_NLIST, it defaults to 4 * sqrt(N).
+    """
+    ann_index = os.getenv("ANN_INDEX")
+    if not ann_index:
+        return
+    if ann_index != "ivf":
+        raise ValueError(f"Invalid ANN index: {ann_index}")
+    if not isinstance(vector_store, MemmapVectorStore):
+        logger.warning("ANN index is only supported for the memmap vector store")
+        return
+
+    count = len(vector_store.data.ids)
+    if count < ANN_MIN_VECTORS:
+        logger.info(f"Skipping ANN index for {count} vectors, using exact search")
+        return
+    nlist = os.getenv("ANN_NLIST")
+    vector_store.build_ivf_index(nlist=int(nlist) if nlist else None)
+
+
+def quantize_vectors(vector_store: BasePydanticVectorStore) -> None:
+    """
+    Also store the embeddings in the compressed format configured by VECTOR_QUANTIZATION
+    (e.g. `int8`). Queries score the compressed vectors and re-rank a shortlist exactly,
+    the float embeddings are kept for the re-rank.
+    """
+    quantization = os.getenv("VECTOR_QUANTIZATION")
+    if not quantization:
+        return
+    if quantization != "int8":
+        raise ValueError(f"Invalid vector quantization: {quantization}")
+    if not isinstance(vector_store, MemmapVectorStore):
+        logger.warning("Quantization is only supported for the memmap vector store")
+        return
+    vector_store.quantize()
@@ -0,0 +1,202 @@
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
+
+# Operators that can be answered from the inverted index.
+# Others (e.g. GT, CONTAINS) fall back to evaluating the filter per node.
+MASK_OPERATORS = {
+    FilterOperator.EQ,
+    FilterOperator.NE,
+    FilterOperator.IN,
+    FilterOperator.NIN,
+}
+
+# Keys used by `generate_filters` on every chat, indexed when a snapshot is built
+# instead of on the first query
+INDEXED_KEYS = ("private", "doc_id")
+
+# Values on more than 1/64 of the rows keep a bitmap, it's smaller than their row ids
+DENSE_FRACTION = 1 / 64
+
+_BITS = np.array([128, 64, 32, 16, 8, 4, 2, 1], dtype=np.uint8)
+
+
+class Postings:
+    """
+    Rows of one metadata key, by value. Every value keeps its row ids, dense values
+    (e.g. `private=false`) also keep a packed bitmap so they are combined 8 rows per byte.
+    """
+
+    def __init__(self, rows: Dict[Any, np.ndarray], count: int):
+        self.rows = rows
+        self.count = count
+        self.present = rows_to_bitmap(
+            np.concatenate(list(rows.values())) if rows else np.zeros(0, np.int64),
+            count,
+        )
+        self.bitmaps = {
+            value: rows_to_bitmap(value_rows, count)
+            for value, value_rows in rows.items()
+            if len(value_rows) > count * DENSE_FRACTION
+        }
+
+    @classmethod
+    def build(cls, key: str, metadata: Sequence[Dict[str, Any]]) -> "Postings":
+        """
+        Raises TypeError if the key has unhashable values such as lists.
+        """
+        return cls(_collect_rows(key, metadata), len(metadata))
+
+    def extend(self, key: str, metadata: Sequence[Dict[str, Any]]) -> "Postings":
+        """
+        Return new postings with the given rows appended.
+        """
+        rows = dict(self.rows)
+        for value, value_rows in _collect_rows(key, metadata, self.count).items():
+            if value in rows:
+                rows[value] = np.concatenate([rows[value], value_rows])
+            else:
+                rows[value] = value_rows
+        return Postings(rows, self.count + len(metadata))
+
+    def values_bitmap(self, values: Sequence[Any]) -> np.ndarray:
+        bitmap = np.zeros((self.count + 7) // 8, dtype=np.uint8)
+        sparse_rows = []
+        for value in values:
+            if value in self.bitmaps:
+                bitmap |= self.bitmaps[value]
+            elif value in self.rows:
+                sparse_rows.append(self.rows[value])
+        if sparse_rows:
+            rows = np.concatenate(sparse_rows)
+            np.bitwise_or.at(bitmap, rows >> 3, _BITS[rows & 7])
+        return bitmap
+
+
+def _collect_rows(
+    key: str, metadata: Sequence[Dict[str, Any]], offset: int = 0
+) -> Dict[Any, np.ndarray]:
+    rows_by_value: Dict[Any, List[int]] = {}
+    for row, node_metadata in enumerate(metadata, start=offset):
+        value = node_metadata.get(key)
+        if value is not None:
+            rows_by_value.setdefault(value, []).append(row)
+    return {
+        value: np.asarray(value_rows, dtype=np.int64)
+        for value, value_rows in rows_by_value.items()
+    }
+
+
+def rows_to_bitmap(rows: np.ndarray, count: int) -> np.ndarray:
+    mask = np.zeros(count, dtype=bool)
+    mask[rows] = True
+    return np.packbits(mask)
+
+
+class MetadataMaskIndex:
+    """
+    Inverted index from metadata (key, value) pairs to row bitmaps.
+
+    Filters like `private != "true" OR doc_id IN [...]` become a few bitwise
+    operations over packed bitmaps, and the result is unpacked once into the row mask
+    used for scoring. Keys in INDEXED_KEYS are indexed up front and carried over to the
+    next snapshot on insert, other keys are indexed on first use.
+    Semantics follow `SimpleVectorStore`: a node without the key never matches.
+    """
+
+    def __init__(
+        self,
+        metadata: List[Dict[str, Any]],
+        postings: Optional[Dict[str, Optional[Postings]]] = None,
+    ):
+        self._metadata = metadata
+        self._count = len(metadata)
+        # key -> postings, None if the key has unhashable values
+        self._postings: Dict[str, Optional[Postings]] = postings or {}
+        self._lock = threading.Lock()
+        for key in INDEXED_KEYS:
+            self._get_postings(key)
+
+    def _get_postings(self, key: str) -> Optional[Postings]:
+        if key in self._postings:
+            return self._postings[key]
+        with self._lock:
+            if key in self._postings:
+                return self._postings[key]
+            postings: Optional[Postings]
+            try:
+                postings = Postings.build(key, self._metadata)
+            except TypeError:
+                # Unhashable values such as lists can't be indexed
+                postings = None
+            self._postings[key] = postings
+            return postings
+
+    def extend(self, metadata: List[Dict[str, Any]]) -> "MetadataMaskIndex":
+        """
+        Return the index of the given metadata, which must start with the rows of this
+        index. Only the new rows are indexed.
+        """
+        new_metadata = metadata[self._count :]
+        postings: Dict[str, Optional[Postings]] = {}
+        for key in INDEXED_KEYS:
+            current = self._get_postings(key)
+            if current is None:
+                continue
+            try:
+                postings[key] = current.extend(key, new_metadata)
+            except TypeError:
+                postings[key] = None
+        return MetadataMaskIndex(metadata, postings)
+
+    def _filter_bitmap(self, filter_: MetadataFilter) -> Optional[np.ndarray]:
+        if filter_.operator not in MASK_OPERATORS:
+            return None
+        value = filter_.value
+        values: List[Any]
+        if filter_.operator in (FilterOperator.IN, FilterOperator.NIN):
+            if not isinstance(value, (list, tuple, set)):
+                return None
+            values = list(value)
+        else:
+            values = [value]
+        try:
+            postings = self._get_postings(filter_.key)
+            if postings is None:
+                return None
+            bitmap = postings.values_bitmap(values)
+        except TypeError:
+            return None
+        if filter_.operator in (FilterOperator.NE, FilterOperator.NIN):
+            bitmap = postings.present & ~bitmap
+        return bitmap
+
+    def get_mask(self, filters: MetadataFilters) -> Optional[np.ndarray]:
+        """
+        Get the boolean mask of rows matching the filters,
+        or None if the filters can't be answered from the index.
+        """
+        bitmaps = []
+        for filter_ in filters.filters:
+            if isinstance(filter_, MetadataFilters):
+                return None
+            bitmap = self._filter_bitmap(filter_)
+            if bitmap is None:
+                return None
+            bitmaps.append(bitmap)
+        if not bitmaps:
+            return np.ones(self._count, dtype=bool)
+        if filters.condition == FilterCondition.OR:
+            bitmap = np.bitwise_or.reduce(bitmaps)
+        elif filters.condition == FilterCondition.AND:
+            bitmap = np.bitwise_and.reduce(bitmaps)
+        else:
+            return None
+        return np.unpackbits(bitmap, count=self._count).view(bool)
@@ -0,0 +1,130 @@
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger("uvicorn")
+
+CENTROIDS_SUFFIX = ".ivf_centroids.npy"
+ASSIGNMENTS_SUFFIX = ".ivf_assignments.npy"
+
+# Rows are assigned to centroids in chunks to bound the size of the score matrix
+ASSIGN_CHUNK_SIZE = 8192
+
+
+def default_nlist(count: int) -> int:
+    return max(1, int(4 * np.sqrt(count)))
+
+
+def _assign(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), ASSIGN_CHUNK_SIZE):
+        chunk = np.asarray(embeddings[start : start + ASSIGN_CHUNK_SIZE])
+        assignments[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """
+    Inverted file index for approximate nearest neighbour search.
+
+    Rows are clustered with spherical k-means (embeddings are L2-normalized).
+    A query only scores the rows in its `nprobe` closest clusters, so the cost
+    grows with nprobe * N / nlist instead of N. New rows are assigned to their
+    closest centroid, so inserts don't need a rebuild.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self._lists = self._build_lists(self.assignments, len(self.centroids))
+
+    @staticmethod
+    def _build_lists(assignments: np.ndarray, nlist: int) -> List[np.ndarray]:
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        return [order[bounds[i] : bounds[i + 1]] for i in range(nlist)]
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def train(
+        cls,
+        embeddings: np.ndarray,
+        nlist: Optional[int] = None,
+        iterations: int = 10,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        count = len(embeddings)
+        nlist = min(nlist or default_nlist(count), count)
+        rng = np.random.default_rng(seed)
+
+        # Train on a sample, then assign every row to its closest centroid
+        sample_size = min(count, nlist * 256)
+        sample = np.asarray(
+            embeddings[np.sort(rng.choice(count, sample_size, replace=False))],
+            dtype=np.float32,
+        )
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            sample_assignments = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, sample_assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            non_empty = norms[:, 0] > 0
+            centroids[non_empty] = sums[non_empty] / norms[non_empty]
+
+        logger.info(f"Trained IVF index with {nlist} lists on {sample_size} vectors")
+        return cls(centroids, _assign(embeddings, centroids))
+
+    def add(self, embeddings: np.ndarray) -> "IVFIndex":
+        """
+        Return a new index with the given rows appended.
+        """
+        return IVFIndex(
+            self.centroids,
+            np.concatenate([self.assignments, _assign(embeddings, self.centroids)]),
+        )
+
+    def select(self, rows: List[int]) -> "IVFIndex":
+        """
+        Return a new index that only keeps the given rows, e.g. after a delete.
+        """
+        return IVFIndex(self.centroids, self.assignments[rows])
+
+    def candidates(self, query_embedding: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Get the rows of the `nprobe` clusters closest to the query.
+        """
+        nprobe = min(max(nprobe, 1), self.nlist)
+        centroid_scores = self.centroids @ query_embedding
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.nlist)
+        return np.sort(np.concatenate([self._lists[probe] for probe in probes]))
+
+    @staticmethod
+    def exists(base_path: str) -> bool:
+        return os.path.exists(f"{base_path}{CENTROIDS_SUFFIX}")
+
+    @classmethod
+    def load(cls, base_path: str) -> "IVFIndex":
+        return cls(
+            np.load(f"{base_path}{CENTROIDS_SUFFIX}"),
+            np.load(f"{base_path}{ASSIGNMENTS_SUFFIX}", mmap_mode="r"),
+        )
+
+    def save(self, base_path: str) -> None:
+        for suffix, array in (
+            (CENTROIDS_SUFFIX, self.centroids),
+            (ASSIGNMENTS_SUFFIX, self.assignments),
+        ):
+            # np.save appends .npy to names without it, so keep the suffix last
+            tmp_path = f"{base_path}.tmp{suffix}"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, f"{base_path}{suffix}")
@@ -0,0 +1,462 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import fsspec
+import numpy as np
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import (
+    DEFAULT_VECTOR_STORE,
+    NAMESPACE_SEP,
+    _build_metadata_filter_fn,
+)
+from llama_index.core.vector_stores.types import (
+    DEFAULT_PERSIST_FNAME,
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+from pydantic import PrivateAttr
+
+from app.engine.vector_stores.filters import MetadataMaskIndex
+from app.engine.vector_stores.ivf import IVFIndex
+from app.engine.vector_stores.quantization import Int8Codes
+
+logger = logging.getLogger("uvicorn")
+
+FORMAT_VERSION = 1
+# Files written next to the docstore, e.g. default__vector_store.f32
+MATRIX_SUFFIX = ".f32"
+SIDECAR_SUFFIX = ".meta.json"
+
+# With int8 codes, rerank_factor * top_k rows are re-scored with the float embeddings
+DEFAULT_RERANK_FACTOR = 4
+
+# Filters matching at most this fraction of rows score only those rows,
+# broader filters score every row and mask out the rest
+SELECTIVE_MASK_FRACTION = 0.5
+
+
+class MemmapVectorStoreData(NamedTuple):
+    """
+    Immutable snapshot of the store. Writers build a new snapshot and swap it in,
+    so a query always works on one consistent version.
+    """
+
+    embeddings: np.ndarray  # (count, dim) float32, rows are L2-normalized
+    ids: List[str]
+    ref_doc_ids: List[str]
+    metadata: List[Dict[str, Any]]
+    id_to_row: Dict[str, int]
+    metadata_index: MetadataMaskIndex
+    ivf: Optional[IVFIndex] = None
+    quantized: Optional[Int8Codes] = None
+
+    @classmethod
+    def empty(cls, dim: int = 0) -> "MemmapVectorStoreData":
+        return cls.from_rows(np.zeros((0, dim), dtype=np.float32), [], [], [])
+
+    @classmethod
+    def from_rows(
+        cls,
+        embeddings: np.ndarray,
+        ids: List[str],
+        ref_doc_ids: List[str],
+        metadata: List[Dict[str, Any]],
+        ivf: Optional[IVFIndex] = None,
+        quantized: Optional[Int8Codes] = None,
+        metadata_index: Optional[MetadataMaskIndex] = None,
+    ) -> "MemmapVectorStoreData":
+        id_to_row = {node_id: row for row, node_id in enumerate(ids)}
+        return cls(
+            embeddings,
+            ids,
+            ref_doc_ids,
+            metadata,
+            id_to_row,
+            metadata_index or MetadataMaskIndex(metadata),
+            ivf,
+            quantized,
+        )
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (embeddings / norms).astype(np.float32)
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Get the indices of the k highest scores, best first.
+    `argpartition` selects them in O(n) and only the k winners are sorted.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def get_base_path(persist_path: str) -> str:
+    """
+    Strip the `.json` extension that StorageContext uses for vector store files.
+    """
+    base, extension = os.path.splitext(persist_path)
+    return base if extension == ".json" else persist_path
+
+
+def get_namespaced_base_path(
+    persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE
+) -> str:
+    return get_base_path(
+        os.path.join(persist_dir, f"{namespace}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}")
+    )
+
+
+class MemmapVectorStore(BasePydanticVectorStore):
+    """
+    Local vector store that persists embeddings as a contiguous float32 matrix.
+
+    The matrix is loaded with `numpy.memmap`, so startup doesn't parse any embeddings
+    and all workers on a host share the same page-cache pages. Node ids and the
+    filterable metadata live in a small JSON sidecar next to the matrix.
+    """
+
+    stores_text: bool = False
+    is_embedding_query: bool = True
+
+    _data: MemmapVectorStoreData = PrivateAttr()
+
+    def __init__(self, data: Optional[MemmapVectorStoreData] = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._data = data or MemmapVectorStoreData.empty()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MemmapVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def data(self) -> MemmapVectorStoreData:
+        return self._data
+
+    @staticmethod
+    def exists(persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> bool:
+        base_path = get_namespaced_base_path(persist_dir, namespace)
+        return os.path.exists(f"{base_path}{SIDECAR_SUFFIX}")
+
+    @classmethod
+    def from_persist_dir(
+        cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE
+    ) -> "MemmapVectorStore":
+        return cls.from_persist_path(get_namespaced_base_path(persist_dir, namespace))
+
+    @classmethod
+    def from_persist_path(
+        cls, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None
+    ) -> "MemmapVectorStore":
+        base_path = get_base_path(persist_path)
+        with open(f"{base_path}{SIDECAR_SUFFIX}") as f:
+            sidecar = json.load(f)
+        if sidecar.get("format") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported vector store format {sidecar.get('format')} in {base_path}"
+            )
+
+        count, dim = sidecar["count"], sidecar["dim"]
+        embeddings = cls._map_matrix(base_path, count, dim)
+        ivf = IVFIndex.load(base_path) if IVFIndex.exists(base_path) else None
+        quantized = Int8Codes.load(base_path) if Int8Codes.exists(base_path) else None
+        logger.info(f"Mapped {count} embeddings of dimension {dim} from {base_path}")
+        return cls(
+            data=MemmapVectorStoreData.from_rows(
+                embeddings,
+                sidecar["ids"],
+                sidecar["ref_doc_ids"],
+                sidecar["metadata"],
+                ivf=ivf,
+                quantized=quantized,
+            )
+        )
+
+    @staticmethod
+    def _map_matrix(base_path: str, count: int, dim: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.memmap(
+            f"{base_path}{MATRIX_SUFFIX}",
+            dtype=np.float32,
+            mode="r",
+            shape=(count, dim),
+        )
+
+    def persist(
+        self,
+        persist_path: str,
+        fs: Optional[fsspec.AbstractFileSystem] = None,
+    ) -> None:
+        base_path = get_base_path(persist_path)
+        os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+        data = self._data
+
+        # Write to temp files first so a concurrent reader never maps a partial matrix
+        matrix_path = f"{base_path}{MATRIX_SUFFIX}"
+        np.ascontiguousarray(data.embeddings, dtype=np.float32).tofile(
+            f"{matrix_path}.tmp"
+        )
+        sidecar_path = f"{base_path}{SIDECAR_SUFFIX}"
+        with open(f"{sidecar_path}.tmp", "w") as f:
+            json.dump(
+                {
+                    "format": FORMAT_VERSION,
+                    "count": len(data.ids),
+                    "dim": int(data.embeddings.shape[1]),
+                    "ids": data.ids,
+                    "ref_doc_ids": data.ref_doc_ids,
+                    "metadata": data.metadata,
+                },
+                f,
+            )
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+        os.replace(f"{sidecar_path}.tmp", sidecar_path)
+        if data.ivf is not None:
+            data.ivf.save(base_path)
+        if data.quantized is not None:
+            data.quantized.save(base_path)
+
+        # Rows added since the store was mapped live in anonymous memory, serve them
+        # from the files just written so the process shares the page cache again
+        if self._data is data:
+            self._data = data._replace(
+                embeddings=self._map_matrix(
+                    base_path, len(data.ids), int(data.embeddings.shape[1])
+                ),
+                ivf=IVFIndex.load(base_path) if data.ivf is not None else None,
+                quantized=Int8Codes.load(base_path) if data.quantized is not None else None,
+            )
+
+    def build_ivf_index(self, nlist: Optional[int] = None) -> None:
+        """
+        Train an IVF index over the current embeddings for approximate search.
+        """
+        data = self._data
+        ivf = IVFIndex.train(data.embeddings, nlist=nlist)
+        self._data = data._replace(ivf=ivf)
+
+    def quantize(self) -> None:
+        """
+        Encode the current embeddings as int8 codes. Queries then score the codes
+        and only read the float embeddings of a shortlist for the exact re-rank.
+        The float matrix is kept, the codes add a quarter of its size.
+        """
+        data = self._data
+        self._data = data._replace(quantized=Int8Codes.encode(data.embeddings))
+        logger.info(f"Quantized {len(data.ids)} embeddings to int8")
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        """
+        Add the nodes to a new snapshot. Its matrix is a copy in memory until the store
+        is persisted, which maps it from the new files.
+        """
+        if not nodes:
+            return []
+        new_embeddings = _normalize(
+            np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        )
+        new_metadata = []
+        for node in nodes:
+            node_metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+            node_metadata.pop("_node_content", None)
+            new_metadata.append(node_metadata)
+
+        data = self._data
+        embeddings = (
+            np.concatenate([data.embeddings, new_embeddings])
+            if len(data.ids) > 0
+            else new_embeddings
+        )
+        metadata = data.metadata + new_metadata
+        self._data = MemmapVectorStoreData.from_rows(
+            embeddings,
+            data.ids + [node.node_id for node in nodes],
+            data.ref_doc_ids + [node.ref_doc_id or "None" for node in nodes],
+            metadata,
+            # New rows join their closest list, no retraining needed
+            ivf=data.ivf.add(new_embeddings) if data.ivf is not None else None,
+            quantized=(
+                data.quantized.add(new_embeddings)
+                if data.quantized is not None
+                else None
+            ),
+            # Only the new rows are added to the metadata bitmaps
+            metadata_index=data.metadata_index.extend(metadata),
+        )
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        data = self._data
+        keep = [row for row, doc_id in enumerate(data.ref_doc_ids) if doc_id != ref_doc_id]
+        if len(keep) == len(data.ids):
+            return
+        self._data = MemmapVectorStoreData.from_rows(
+            np.asarray(data.embeddings[keep], dtype=np.float32),
+            [data.ids[row] for row in keep],
+            [data.ref_doc_ids[row] for row in keep],
+            [data.metadata[row] for row in keep],
+            ivf=data.ivf.select(keep) if data.ivf is not None else None,
+            quantized=(
+                data.quantized.select(keep) if data.quantized is not None else None
+            ),
+        )
+
+    def query(
+        self,
+        query: VectorStoreQuery,
+        nprobe: Optional[int] = None,
+        rerank_factor: int = DEFAULT_RERANK_FACTOR,
+        **kwargs: Any,
+    ) -> VectorStoreQueryResult:
+        """
+        Get the top k most similar nodes.
+
+        Args:
+            query: The vector store query.
+            nprobe (optional): Number of IVF lists to search. Without it or without
+                an IVF index, the search is exact.
+            rerank_factor (optional): Shortlist size per result for the exact
+                re-rank, only used if the store is quantized.
+        """
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise NotImplementedError(
+                f"Query mode {query.mode} is not supported by MemmapVectorStore"
+            )
+        data = self._data
+        if len(data.ids) == 0 or query.query_embedding is None:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        mask = self._get_query_mask(data, query)
+        if mask is not None and not mask.any():
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_embedding = _normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        k = query.similarity_top_k
+        if data.ivf is not None and nprobe:
+            rows = self._get_ivf_rows(data, query_embedding, mask, nprobe, k)
+            if rows is not None:
+                return self._search(data, query_embedding, k, rerank_factor, rows=rows)
+
+        if mask is not None:
+            rows = np.flatnonzero(mask)
+            # Only score the filtered rows, so a filtered query is never slower
+            if len(rows) <= len(data.ids) * SELECTIVE_MASK_FRACTION:
+                return self._search(data, query_embedding, k, rerank_factor, rows=rows)
+        return self._search(data, query_embedding, k, rerank_factor, mask=mask)
+
+    @staticmethod
+    def _get_ivf_rows(
+        data: MemmapVectorStoreData,
+        query_embedding: np.ndarray,
+        mask: Optional[np.ndarray],
+        nprobe: int,
+        k: int,
+    ) -> Optional[np.ndarray]:
+        """
+        Get the candidate rows from the probed IVF lists.
+        Returns None if the exact search should be used instead.
+        """
+        rows = data.ivf.candidates(query_embedding, nprobe)
+        if mask is not None:
+            filtered_rows = np.flatnonzero(mask)
+            # A selective filter has fewer rows than the probed lists, score them all
+            if len(filtered_rows) <= len(rows):
+                return filtered_rows
+            rows = rows[mask[rows]]
+        if len(rows) < k:
+            return None
+        return rows
+
+    @staticmethod
+    def _search(
+        data: MemmapVectorStoreData,
+        query_embedding: np.ndarray,
+        k: int,
+        rerank_factor: int,
+        rows: Optional[np.ndarray] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> VectorStoreQueryResult:
+        """
+        Get the top k of the given rows (all rows if None).
+        Rows outside the mask are pushed to the bottom instead of being skipped one by one.
+        If the store is quantized, the rows are scored with the int8 codes and only the
+        best `rerank_factor * k` are re-scored with the float embeddings.
+        """
+        if data.quantized is not None:
+            scores = data.quantized.score(query_embedding, rows)
+        else:
+            vectors = data.embeddings if rows is None else data.embeddings[rows]
+            scores = np.asarray(vectors @ query_embedding)
+        candidates = len(scores)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            candidates = int(np.count_nonzero(mask))
+            k = min(k, candidates)
+
+        if data.quantized is None:
+            top = top_k_rows(scores, k)
+            similarities = scores[top]
+            top_rows = top if rows is None else rows[top]
+        else:
+            # The re-rank scores the shortlist again without the mask, so it must
+            # not reach past the masked-in rows into the -inf ones
+            shortlist = top_k_rows(scores, min(k * max(rerank_factor, 1), candidates))
+            # Sorted rows read the memory-mapped embeddings in file order
+            shortlist_rows = np.sort(shortlist if rows is None else rows[shortlist])
+            exact_scores = np.asarray(data.embeddings[shortlist_rows] @ query_embedding)
+            top = top_k_rows(exact_scores, k)
+            similarities = exact_scores[top]
+            top_rows = shortlist_rows[top]
+        return VectorStoreQueryResult(
+            similarities=[float(score) for score in similarities],
+            ids=[data.ids[row] for row in top_rows],
+        )
+
+    @staticmethod
+    def _get_query_mask(
+        data: MemmapVectorStoreData, query: VectorStoreQuery
+    ) -> Optional[np.ndarray]:
+        """
+        Combine the node id restriction and the metadata filters into one row mask.
+        Returns None if all rows are candidates.
+        """
+        mask = None
+        # The retriever passes all node ids of the index, only restrict when it's a subset
+        if query.node_ids is not None and len(query.node_ids) < len(data.ids):
+            mask = np.zeros(len(data.ids), dtype=bool)
+            rows = [data.id_to_row[i] for i in query.node_ids if i in data.id_to_row]
+            mask[rows] = True
+
+        if query.filters is not None and query.filters.filters:
+            filter_mask = data.metadata_index.get_mask(query.filters)
+            if filter_mask is None:
+                # Filters the index can't answer are evaluated per node
+                filter_fn = _build_metadata_filter_fn(
+                    lambda node_id: data.metadata[data.id_to_row[node_id]],
+                    query.filters,
+                )
+                filter_mask = np.fromiter(
+                    (filter_fn(node_id) for node_id in data.ids),
+                    dtype=bool,
+                    count=len(data.ids),
+                )
+            mask = filter_mask if mask is None else mask & filter_mask
+        return mask
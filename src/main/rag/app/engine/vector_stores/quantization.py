@@ -0,0 +1,96 @@
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger("uvicorn")
+
+CODES_SUFFIX = ".i8_codes.npy"
+SCALES_SUFFIX = ".i8_scales.npy"
+
+# Codes are converted to float in chunks to bound the temporary memory of a query
+SCORE_CHUNK_SIZE = 16384
+
+
+class Int8Codes:
+    """
+    Scalar-quantized copy of the embeddings, one signed byte per dimension.
+
+    Every row is scaled by its own max absolute value, so a row is approximated by
+    `scale * codes` and a query is scored with one int8 pass over the matrix.
+    The codes are 4x smaller than float32, and since quantization needs no training,
+    new rows are encoded on insert. They come on top of the float matrix, which stays
+    mapped for the exact re-rank and is mostly resident under a query load, so they
+    don't reduce the memory of the store (see benchmarks/vector_quantization.py).
+    """
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes
+        self.scales = np.asarray(scales, dtype=np.float32)
+
+    @classmethod
+    def encode(cls, embeddings: np.ndarray) -> "Int8Codes":
+        codes = np.empty(embeddings.shape, dtype=np.int8)
+        scales = np.empty(len(embeddings), dtype=np.float32)
+        for start in range(0, len(embeddings), SCORE_CHUNK_SIZE):
+            chunk = np.asarray(
+                embeddings[start : start + SCORE_CHUNK_SIZE], dtype=np.float32
+            )
+            chunk_scales = np.abs(chunk).max(axis=1) / 127.0
+            chunk_scales[chunk_scales == 0] = 1.0
+            end = start + len(chunk)
+            codes[start:end] = np.rint(chunk / chunk_scales[:, None])
+            scales[start:end] = chunk_scales
+        return cls(codes, scales)
+
+    def add(self, embeddings: np.ndarray) -> "Int8Codes":
+        """
+        Return new codes with the given rows appended.
+        """
+        new_codes = Int8Codes.encode(embeddings)
+        return Int8Codes(
+            np.concatenate([self.codes, new_codes.codes]),
+            np.concatenate([self.scales, new_codes.scales]),
+        )
+
+    def select(self, rows: List[int]) -> "Int8Codes":
+        """
+        Return new codes that only keep the given rows, e.g. after a delete.
+        """
+        return Int8Codes(np.asarray(self.codes[rows]), self.scales[rows])
+
+    def score(
+        self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Approximate the similarity of the query to the given rows (all rows if None).
+        """
+        codes = self.codes if rows is None else self.codes[rows]
+        scales = self.scales if rows is None else self.scales[rows]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_SIZE):
+            chunk = np.asarray(codes[start : start + SCORE_CHUNK_SIZE], dtype=np.float32)
+            scores[start : start + len(chunk)] = chunk @ query_embedding
+        return scores * scales
+
+    @staticmethod
+    def exists(base_path: str) -> bool:
+        return os.path.exists(f"{base_path}{CODES_SUFFIX}")
+
+    @classmethod
+    def load(cls, base_path: str) -> "Int8Codes":
+        return cls(
+            np.load(f"{base_path}{CODES_SUFFIX}", mmap_mode="r"),
+            np.load(f"{base_path}{SCALES_SUFFIX}"),
+        )
+
+    def save(self, base_path: str) -> None:
+        for suffix, array in (
+            (CODES_SUFFIX, self.codes),
+            (SCALES_SUFFIX, self.scales),
+        ):
+            # np.save appends .npy to names without it, so keep the suffix last
+            tmp_path = f"{base_path}.tmp{suffix}"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, f"{base_path}{suffix}")
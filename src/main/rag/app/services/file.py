@@ -10,6 +10,7 @@ from typing import List, Optional, Tuple
 
 from llama_index.core import VectorStoreIndex
 from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.readers.file.base import (
     _try_loading_included_file_formats as get_file_loaders_map,
 )
@@ -57,16 +58,11 @@ class FileService:
         Store the uploaded file and index it if necessary.
         """
         try:
-            from app.engine.index import IndexConfig, get_index
+            from app.engine.index import get_index
         except ImportError as e:
-            raise ValueError("IndexConfig or get_index is not found") from e
+            raise ValueError("get_index is not found") from e
 
-        if params is None:
-            params = {}
-
-        # Add the nodes to the index and persist it
-        index_config = IndexConfig(**params)
-        index = get_index(index_config)
+        index = get_index()
 
         # Preprocess and store the file
         file_data, extension = cls._preprocess_base64_file(base64_content)
@@ -90,7 +86,7 @@ class FileService:
                 document_file.refs = [doc_id]
             else:
                 documents = cls._load_file_to_documents(document_file)
-                cls._add_documents_to_vector_store_index(documents, index)
+                cls._add_documents_to_vector_store_index(documents)
                 # Add document ids to the file metadata
                 document_file.refs = [doc.doc_id for doc in documents]
 
@@ -209,23 +205,21 @@ class FileService:
         return documents
 
     @staticmethod
-    def _add_documents_to_vector_store_index(
-        documents: List[Document], index: VectorStoreIndex
-    ) -> None:
+    def _add_documents_to_vector_store_index(documents: List[Document]) -> None:
         """
-        Add the documents to the vector store index
+        Add the documents to the shared vector store index and persist it as a new version
         """
-        pipeline = IngestionPipeline()
-        nodes = pipeline.run(documents=documents)
+        from app.embedding_cache import get_ingestion_embed_model
+        from app.engine.index import get_index_manager
 
-        # Add the nodes to the index and persist it
-        if index is None:
-            index = VectorStoreIndex(nodes=nodes)
-        else:
-            index.insert_nodes(nodes=nodes)
-        index.storage_context.persist(
-            persist_dir=os.environ.get("STORAGE_DIR", "storage")
+        # The default transformations, with the chunks bypassing the embedding cache
+        pipeline = IngestionPipeline(
+            transformations=[SentenceSplitter(), get_ingestion_embed_model()]
         )
+        nodes = pipeline.run(documents=documents)
+
+        # Add the nodes to the resident index and persist it
+        get_index_manager().insert_nodes(nodes)
 
     @staticmethod
     def _add_file_to_llama_cloud_index(
@@ -4,6 +4,8 @@ from typing import Dict, Optional
 from llama_index.core.multi_modal_llms import MultiModalLLM
 from llama_index.core.settings import Settings
 
+from app.embedding_cache import CachedEmbedding, get_embedding_cache
+
 # `Settings` does not support setting `MultiModalLLM`
 # so we use a global variable to store it
 _multi_modal_llm: Optional[MultiModalLLM] = None
@@ -39,6 +41,10 @@ def init_settings():
         case _:
             raise ValueError(f"Invalid model provider: {model_provider}")
 
+    # Serve repeated texts and queries from the embedding cache
+    if get_embedding_cache() is not None:
+        Settings.embed_model = CachedEmbedding(Settings.embed_model)
+
     Settings.chunk_size = int(os.getenv("CHUNK_SIZE", "1024"))
     Settings.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "20"))
 
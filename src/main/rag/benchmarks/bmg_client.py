@@ -0,0 +1,172 @@
+"""
+Fetching a city's products from BMG (the list, then every product's details
+concurrently) with the shared pooled BMGClient versus a new httpx client per call.
+
+BMG is replaced by a local TLS server that waits one round trip (RTTS_MS) per
+request and two per new connection (TCP and TLS handshakes), and counts the connections it
+accepted. The server's certificate is self-signed with the `openssl` command.
+Run from src/main/rag:
+
+    poetry run python -m benchmarks.bmg_client
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Any
+
+import httpx
+
+from app.api.services.bmg import api_client
+
+RTTS_MS = [0, 20, 50]
+PRODUCTS = 200
+RUNS = 6
+
+
+def _create_certificate(directory: str) -> tuple:
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", key, "-out", cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def _serve(cert: str, key: str, rtt: float, ports) -> None:
+    """
+    Stub of the BMG endpoints used by the products service, in its own process so it
+    doesn't compete with the client for the event loop.
+    """
+    accepted = [0]
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+
+    async def handle(reader, writer):
+        accepted[0] += 1
+        await asyncio.sleep(2 * rtt)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                path = head.split(b" ", 2)[1].decode()
+                data: Any
+                if path == "/stats":
+                    data = {"connections": accepted[0]}
+                elif path.startswith("/v2/products?"):
+                    data = [{"uuid": f"p{i}"} for i in range(PRODUCTS)]
+                else:
+                    data = {"uuid": path.rsplit("/", 1)[-1], "title": "Product"}
+                await asyncio.sleep(rtt)
+                body = json.dumps({"data": data}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, ssl=context, backlog=1024)
+        ports.put(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+async def fetch_per_call(endpoint: str, params=None):
+    """
+    The former fetch_from_bmg: a new client, so a new connection, for every call.
+    """
+    async with httpx.AsyncClient() as client:
+        response = await client.get(
+            f"{api_client.BMG_BASE_URL}{endpoint}",
+            headers={"X-Authorization": api_client.BMG_API_KEY, "Accept": "application/json"},
+            params=params,
+        )
+    response.raise_for_status()
+    return response.json().get("data")
+
+
+async def fetch_city(fetch) -> int:
+    """
+    The requests of get_products_with_details, without the product cache.
+    """
+    products = await fetch("/v2/products", {"city": "c"})
+    details = await asyncio.gather(*[fetch(f"/v2/products/{p['uuid']}") for p in products])
+    return len(details)
+
+
+async def connections(base_url: str) -> int:
+    async with httpx.AsyncClient() as client:
+        return (await client.get(f"{base_url}/stats")).json()["data"]["connections"]
+
+
+async def time_fetches(base_url: str, fetch):
+    """
+    (first run, median of the warm runs) in seconds, and the new connections per run.
+    """
+    start_connections = await connections(base_url)
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        assert await fetch_city(fetch) == PRODUCTS
+        times.append(time.perf_counter() - start)
+    # The stats request opens one connection too
+    new_connections = (await connections(base_url) - start_connections - 1) / RUNS
+    await api_client.BMGClient.stop()
+    return times[0], statistics.median(times[1:]), new_connections
+
+
+async def run(base_url: str) -> dict:
+    return {
+        "per call": await time_fetches(base_url, fetch_per_call),
+        "pooled": await time_fetches(base_url, api_client.fetch_from_bmg),
+    }
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = _create_certificate(directory)
+        # Trusted by the httpx clients of both variants
+        os.environ["SSL_CERT_FILE"] = cert
+        os.environ.setdefault("BMG_API_KEY", "benchmark")
+        print("rtt      client     first run   warm median   connections/run")
+        for rtt in RTTS_MS:
+            ports: multiprocessing.Queue = multiprocessing.Queue()
+            server = multiprocessing.Process(
+                target=_serve, args=(cert, key, rtt / 1000, ports), daemon=True
+            )
+            server.start()
+            try:
+                base_url = f"https://127.0.0.1:{ports.get(timeout=10)}"
+                api_client.BMG_BASE_URL = base_url
+                api_client.BMG_API_KEY = os.environ["BMG_API_KEY"]
+                results = asyncio.run(run(base_url))
+            finally:
+                server.terminate()
+                server.join()
+            for client, (first, warm, new_connections) in results.items():
+                print(
+                    f"{rtt:3d} ms   {client:8s}   {first * 1000:6.0f} ms   {warm * 1000:8.0f} ms"
+                    f"   {new_connections:15.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Time to the first streamed byte of a chat response, with the agent call handed to
+VercelStreamResponse unawaited versus awaited to the end before the response starts.
+
+The agent is simulated (50 ms before the first token, 5 ms per token), so the numbers
+only depend on the streaming path. Run from src/main/rag:
+
+    poetry run python -m benchmarks.chat_stream
+"""
+
+import asyncio
+import time
+from typing import Awaitable, cast
+
+from fastapi import BackgroundTasks, Request
+from llama_index.core.chat_engine.types import StreamingAgentChatResponse
+
+from app.api.routers.llm.events import EventCallbackHandler
+from app.api.routers.llm.models import ChatData
+from app.api.routers.llm.vercel_response import VercelStreamResponse
+
+FIRST_TOKEN_DELAY = 0.05
+TOKEN_DELAY = 0.005
+TOKEN_COUNTS = [10, 100, 500]
+
+
+class SimulatedStream:
+    source_nodes: list = []
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.response = ""
+
+    async def async_response_gen(self):
+        for i in range(self.tokens):
+            await asyncio.sleep(TOKEN_DELAY)
+            self.response += f"t{i} "
+            yield f"t{i} "
+
+
+async def simulated_agent(tokens: int) -> SimulatedStream:
+    # Retrieval and the first LLM step
+    await asyncio.sleep(FIRST_TOKEN_DELAY)
+    return SimulatedStream(tokens)
+
+
+class ConnectedRequest:
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+async def time_response(tokens: int, awaited: bool):
+    """
+    (first byte, last byte) in seconds, the stored answer must be complete.
+    """
+    stored = {}
+
+    async def store(text: str) -> None:
+        stored["text"] = text
+
+    chat_data = ChatData(session_id=1, messages=[{"role": "user", "content": "hi"}])
+    start = time.perf_counter()
+    if awaited:
+        # The answer is generated and stored before the response starts
+        result = await simulated_agent(tokens)
+        async for _ in result.async_response_gen():
+            pass
+        await store(result.response)
+        response = VercelStreamResponse(
+            cast(Request, ConnectedRequest()),
+            EventCallbackHandler(),
+            cast(StreamingAgentChatResponse, result),
+            chat_data,
+            BackgroundTasks(),
+        )
+    else:
+        response = VercelStreamResponse(
+            cast(Request, ConnectedRequest()),
+            EventCallbackHandler(),
+            cast(Awaitable[StreamingAgentChatResponse], simulated_agent(tokens)),
+            chat_data,
+            BackgroundTasks(),
+            on_final_response=store,
+        )
+
+    first_byte = None
+
+    async def send(message):
+        nonlocal first_byte
+        if message["type"] == "http.response.body" and message.get("body") and first_byte is None:
+            first_byte = time.perf_counter() - start
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    await response({"type": "http"}, receive, send)
+    last_byte = time.perf_counter() - start
+    await VercelStreamResponse.wait_final_responses()
+    assert stored["text"].count("t") == tokens
+    return first_byte, last_byte
+
+
+async def main() -> None:
+    print("tokens   first byte awaited   first byte streamed   last byte streamed")
+    for tokens in TOKEN_COUNTS:
+        awaited_first, _ = await time_response(tokens, awaited=True)
+        streamed_first, streamed_last = await time_response(tokens, awaited=False)
+        print(
+            f"{tokens:6d}   {awaited_first * 1000:15.0f} ms   {streamed_first * 1000:16.0f} ms"
+            f"   {streamed_last * 1000:15.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
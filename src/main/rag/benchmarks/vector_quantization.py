@@ -0,0 +1,135 @@
+"""
+Recall, latency and memory of the local vector search with the float32 embeddings
+(exact) versus the int8 codes with the exact re-rank of a shortlist.
+
+The store is persisted and mapped again like a served index. Memory is the resident
+size of each mapped file after the queries, read from /proc/self/smaps (Linux only).
+The float matrix stays mapped next to the codes for the re-rank, and the shortlists of
+a few hundred queries already touch most of its pages: the kernel maps whole folios
+and neighbouring pages on a fault, not single rows. The corpus is synthetic
+(clustered unit vectors). Run from src/main/rag:
+
+    poetry run python -m benchmarks.vector_quantization
+"""
+
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.engine.vector_stores.memmap import (
+    MATRIX_SUFFIX,
+    MemmapVectorStore,
+    get_namespaced_base_path,
+)
+from app.engine.vector_stores.quantization import CODES_SUFFIX
+
+COUNT = 100_000
+DIM = 384
+CLUSTERS = 1000
+QUERIES = 200
+TOP_K = 10
+RERANK_FACTORS = [1, 2, 4, 8]
+
+
+def _corpus(rng: np.random.Generator) -> np.ndarray:
+    centroids = rng.normal(size=(CLUSTERS, DIM)).astype(np.float32)
+    rows = centroids[rng.integers(CLUSTERS, size=COUNT)]
+    rows += 0.5 * rng.normal(size=rows.shape).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def _persist(embeddings: np.ndarray, directory: str) -> MemmapVectorStore:
+    store = MemmapVectorStore()
+    store.add(
+        [
+            TextNode(id_=f"n{row}", text="", embedding=embedding.tolist())
+            for row, embedding in enumerate(embeddings)
+        ]
+    )
+    store.quantize()
+    store.persist(get_namespaced_base_path(directory))
+    # Mapped again, nothing is resident before the first query
+    return MemmapVectorStore.from_persist_dir(directory)
+
+
+def _resident_kb(path: str) -> int:
+    """
+    Resident size of the mapping of the file in this process, 0 if unavailable.
+    """
+    resident, in_mapping = 0, False
+    try:
+        with open("/proc/self/smaps") as f:
+            for line in f:
+                if "-" in line.split(" ", 1)[0]:
+                    in_mapping = line.rstrip().endswith(path)
+                elif in_mapping and line.startswith("Rss:"):
+                    resident += int(line.split()[1])
+    except FileNotFoundError:
+        return 0
+    return resident
+
+
+def _search(store: MemmapVectorStore, queries: np.ndarray, **kwargs) -> tuple:
+    """
+    Result ids per query and the median latency in ms.
+    """
+    results: List[List[str]] = []
+    times = []
+    for query_embedding in queries:
+        query = VectorStoreQuery(query_embedding=query_embedding.tolist(), similarity_top_k=TOP_K)
+        start = time.perf_counter()
+        results.append(store.query(query, **kwargs).ids)
+        times.append(time.perf_counter() - start)
+    return results, float(np.median(times)) * 1000
+
+
+def _recall(results: List[List[str]], expected: List[List[str]]) -> float:
+    return float(np.mean([len(set(r) & set(e)) / len(e) for r, e in zip(results, expected)]))
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    embeddings = _corpus(rng)
+    queries = embeddings[rng.integers(COUNT, size=QUERIES)]
+    queries = queries + 0.3 * rng.normal(size=queries.shape).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = _persist(embeddings, directory)
+        base_path = get_namespaced_base_path(directory)
+        matrix_path, codes_path = f"{base_path}{MATRIX_SUFFIX}", f"{base_path}{CODES_SUFFIX}"
+        print(
+            f"{COUNT} vectors of dimension {DIM}: float32 matrix "
+            f"{os.path.getsize(matrix_path) // 1024} KB, int8 codes "
+            f"{os.path.getsize(codes_path) // 1024} KB on disk\n"
+        )
+        print("search              recall@10   median latency   resident float32   resident int8")
+
+        rows: Dict[str, tuple] = {}
+        for factor in RERANK_FACTORS:
+            mapped = MemmapVectorStore.from_persist_dir(directory)
+            results, latency = _search(mapped, queries, rerank_factor=factor)
+            rows[f"int8, re-rank x{factor}"] = (
+                results, latency, _resident_kb(matrix_path), _resident_kb(codes_path)
+            )
+            del mapped
+
+        exact = MemmapVectorStore(data=store.data._replace(quantized=None))
+        expected, latency = _search(exact, queries)
+        print(
+            f"{'exact float32':18s}  {1.0:9.3f}   {latency:11.2f} ms"
+            f"   {_resident_kb(matrix_path):13d} KB   {0:10d} KB"
+        )
+        for name, (results, latency, matrix_kb, codes_kb) in rows.items():
+            print(
+                f"{name:18s}  {_recall(results, expected):9.3f}   {latency:11.2f} ms"
+                f"   {matrix_kb:13d} KB   {codes_kb:10d} KB"
+            )
+
+
+if __name__ == "__main__":
+    main()
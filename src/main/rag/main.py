@@ -7,6 +7,7 @@ load_dotenv()
 
 import logging
 import os
+from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI
@@ -15,6 +16,13 @@ from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
 
 from app.api.routers import api_router
+from app.api.routers.llm.vercel_response import VercelStreamResponse
+from app.api.services.bmg.api_client import BMGClient
+from app.api.services.bmg.locations import LocationCatalog
+from app.api.services.context.context_stage import ContextStage
+from app.api.services.context.retention_job import RetentionJob
+from app.api.services.context.update_queue import ContextUpdateQueue
+from app.engine.engine import ChatEngineFactory
 #from app.middlewares.frontend import FrontendProxyMiddleware
 from app.observability import init_observability
 from app.settings import init_settings
@@ -25,7 +33,32 @@ servers = []
 app_name = os.getenv("FLY_APP_NAME")
 if app_name:
     servers = [{"url": f"https://{app_name}.fly.dev"}]
-app = FastAPI(servers=servers)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the index and the tools once instead of on every chat request
+    ChatEngineFactory.init()
+    # One pooled client for all the BMG API calls
+    BMGClient.start()
+    # Load the BMG locations in the background and keep them fresh
+    LocationCatalog.start()
+    # Apply the context updates of chat turns in the background
+    await ContextUpdateQueue.start()
+    # Collect the temporary memories of stale sessions periodically
+    RetentionJob.start()
+    yield
+    await RetentionJob.stop()
+    # Store the chat turns of the streams that just ended
+    await VercelStreamResponse.wait_final_responses()
+    await ContextUpdateQueue.stop()
+    await LocationCatalog.stop()
+    await BMGClient.stop()
+    ChatEngineFactory.shutdown()
+    ContextStage.shutdown()
+
+
+app = FastAPI(servers=servers, lifespan=lifespan)
 
 init_settings()
 init_observability()
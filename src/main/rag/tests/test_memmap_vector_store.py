@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+    VectorStoreQuery,
+)
+
+from app.engine.vector_stores.memmap import MemmapVectorStore, get_namespaced_base_path
+
+DIM = 16
+
+
+def _nodes(count: int, private_rows: set, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(count, DIM)).astype(np.float32)
+    return [
+        TextNode(
+            id_=f"n{row}",
+            text=f"node {row}",
+            embedding=embeddings[row].tolist(),
+            metadata={
+                "private": "true" if row in private_rows else "false",
+                "doc_id": f"d{row}",
+            },
+        )
+        for row in range(count)
+    ]
+
+
+def _stores(nodes):
+    exact = MemmapVectorStore()
+    exact.add(nodes)
+    quantized = MemmapVectorStore()
+    quantized.add(nodes)
+    quantized.quantize()
+    return exact, quantized
+
+
+def _public_or_docs(doc_ids):
+    return MetadataFilters(
+        filters=[
+            MetadataFilter(key="private", value="true", operator=FilterOperator.NE),
+            MetadataFilter(key="doc_id", value=doc_ids, operator=FilterOperator.IN),
+        ],
+        condition=FilterCondition.OR,
+    )
+
+
+@pytest.mark.parametrize("private_rows", [{2, 3, 5, 7}, set(range(1, 10))])
+def test_quantized_filtered_search_never_returns_excluded_rows(private_rows):
+    nodes = _nodes(10, private_rows)
+    _, quantized = _stores(nodes)
+    filters = _public_or_docs(["d5"])
+    allowed = {
+        node.node_id
+        for node in nodes
+        if node.metadata["private"] != "true" or node.metadata["doc_id"] == "d5"
+    }
+
+    for seed in range(20):
+        query_embedding = np.random.default_rng(100 + seed).normal(size=DIM).tolist()
+        result = quantized.query(
+            VectorStoreQuery(
+                query_embedding=query_embedding, similarity_top_k=2, filters=filters
+            ),
+            rerank_factor=4,
+        )
+        assert set(result.ids) <= allowed
+
+
+@pytest.mark.parametrize("top_k", [1, 2, 5, 50])
+@pytest.mark.parametrize("private_count", [0, 4, 40, 95])
+def test_quantized_filtered_search_matches_float_search(top_k, private_count):
+    nodes = _nodes(100, set(range(private_count)), seed=top_k)
+    exact, quantized = _stores(nodes)
+    # The first doc ids are private, one of them is allowed explicitly
+    filters = _public_or_docs(["d0"])
+
+    for seed in range(10):
+        query = VectorStoreQuery(
+            query_embedding=np.random.default_rng(seed).normal(size=DIM).tolist(),
+            similarity_top_k=top_k,
+            filters=filters,
+        )
+        expected = exact.query(query)
+        # A shortlist covering every row makes the re-rank exact
+        result = quantized.query(query, rerank_factor=100)
+        assert result.ids == expected.ids
+        assert result.similarities == pytest.approx(expected.similarities, abs=1e-5)
+
+
+def test_persist_maps_added_rows_from_the_written_files(tmp_path):
+    nodes = _nodes(10, set())
+    store = MemmapVectorStore()
+    store.add(nodes[:6])
+    store.quantize()
+    store.persist(get_namespaced_base_path(str(tmp_path / "v1")))
+    store = MemmapVectorStore.from_persist_dir(str(tmp_path / "v1"))
+    store.add(nodes[6:])
+    assert not isinstance(store.data.embeddings, np.memmap)
+
+    query = VectorStoreQuery(query_embedding=nodes[7].get_embedding(), similarity_top_k=3)
+    expected = store.query(query)
+    store.persist(get_namespaced_base_path(str(tmp_path / "v2")))
+
+    assert isinstance(store.data.embeddings, np.memmap)
+    assert isinstance(store.data.quantized.codes, np.memmap)
+    assert store.query(query).ids == expected.ids